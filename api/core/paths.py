@@ -13,6 +13,7 @@ class PathManager:
     ├── used/                    # hook_maker: used videos
     ├── temp/                    # common: temp files (shared)
     ├── final/                   # common: final output (shared)
+    ├── cache/                   # common: preview/render caches (shared)
     ├── config/                  # config directory
     │   └── presets/            # common: subtitle presets (shared)
     ├── assets/                  # video_maker assets
@@ -26,6 +27,7 @@ class PathManager:
     - temp/: Temporary files used by both workflows
     - final/: Final output files from both workflows
     - config/presets/: Subtitle presets used by both workflows
+    - cache/: Cached previews and reusable render artifacts
     
     Hook maker specific:
     - Input_16_9/: Input directory for 16:9 videos
@@ -63,6 +65,7 @@ class PathManager:
         self.common_paths = {
             "temp": "temp",
             "final": "final",
+            "cache": "cache",
             "presets": "config/presets"  # Shared presets folder
         }
         
@@ -0,0 +1,226 @@
+import time
+import uuid
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from .config import Settings
+from .paths import path_manager
+from modules.utils.job_queue import JobQueue, input_fingerprint
+from modules.utils.cancellation import TaskCancelToken, TaskCancelledError
+from modules.utils.task_history_manager import TaskHistoryManager
+from modules.utils.job_workspace import sweep_orphaned_workspaces
+from modules.video.error_policy import PERMANENT, classify_error, failed_input
+
+# Cấu hình mặc định, ghi đè bằng common.render_workers trong config/settings.json
+DEFAULT_WORKER_SETTINGS = {
+    "workers": 2,
+    "poll_interval": 1.0,
+    "db_path": "job_queue.db"
+}
+
+def get_worker_settings() -> Dict:
+    """Cấu hình worker pool (common.render_workers)"""
+    worker_settings = dict(DEFAULT_WORKER_SETTINGS)
+    try:
+        worker_settings.update(Settings().get_common_settings().get("render_workers", {}))
+    except Exception as e:
+        logging.error(f"Error loading render worker settings: {e}")
+    return worker_settings
+
+def get_queue_path() -> Path:
+    """Đường dẫn file SQLite của hàng đợi (tương đối theo base_path)"""
+    db_path = Path(get_worker_settings()["db_path"])
+    return db_path if db_path.is_absolute() else path_manager.base_path / db_path
+
+# Hàng đợi dùng chung cho API (mỗi worker process tự mở connection riêng)
+job_queue = JobQueue(get_queue_path())
+
+# Processor được tạo 1 lần trong mỗi worker process
+_processors: Dict[str, object] = {}
+
+def _get_processor(name: str):
+    """Lazy tạo processor trong worker process (không tạo trong process API)"""
+    if name not in _processors:
+        if name == "hook":
+            from modules.video.hook_video_processor import HookVideoProcessor
+            _processors[name] = HookVideoProcessor(path_manager.base_path)
+        elif name == "video_maker":
+            from api.workflows.video_maker.service import VideoMakerService
+            _processors[name] = VideoMakerService()
+        else:
+            raise ValueError(f"Unknown processor: {name}")
+    return _processors[name]
+
+def run_hook_video_job(task_id: str, payload: Dict):
+    """Job render 1 video hook"""
+    _get_processor("hook").process_hook_video_background(
+        task_id,
+        Path(payload["hook_audio_path"]),
+        Path(payload["main_audio_path"]),
+        Path(payload["subtitle_path"]),
+        Path(payload["thumbnail_path"]),
+        payload["subtitle_settings"],
+        payload.get("is_vertical", False),
+        payload.get("draft", False),
+        payload.get("draft_duration")
+    )
+
+def run_hook_batch_job(task_id: str, payload: Dict):
+    """Job render batch video hook từ 1 thư mục"""
+    _get_processor("hook").process_batch_videos_background(
+        task_id,
+        Path(payload["input_folder"]),
+        payload["subtitle_settings"],
+        Path(payload["bg_path"]),
+        payload.get("is_vertical", False),
+        payload.get("draft", False),
+        payload.get("draft_duration")
+    )
+
+def run_video_maker_job(task_id: str, payload: Dict):
+    """Job render video của workflow video_maker"""
+    _get_processor("video_maker").run_video_job(task_id, **payload)
+
+# kind -> handler(task_id, payload); handler là hàm top-level để pickle/spawn được
+JOB_HANDLERS: Dict[str, Callable[[str, Dict], None]] = {
+    "hook_video": run_hook_video_job,
+    "hook_batch": run_hook_batch_job,
+    "video_maker": run_video_maker_job
+}
+
+# Field của payload không ảnh hưởng tới kết quả render (không gộp vào dấu vân tay)
+FINGERPRINT_IGNORED_FIELDS = ("output_name",)
+
+def job_fingerprint(payload: Dict) -> Optional[str]:
+    """
+    Dấu vân tay của job: nội dung các file đầu vào (các field *_path trỏ tới file)
+    + cài đặt render đã resolve (subtitle_settings, is_vertical, draft, ...)
+    """
+    paths = []
+    settings = {}
+    for key, value in sorted(payload.items()):
+        if key.endswith("_path"):
+            if isinstance(value, str):
+                paths.append(value)
+        elif key not in FINGERPRINT_IGNORED_FIELDS:
+            settings[key] = value
+    return input_fingerprint(paths, settings)
+
+def worker_main(worker_id: str, db_path: str, poll_interval: float, stop_event):
+    """
+    Vòng lặp của 1 worker process: claim job -> chạy handler -> đánh dấu done/failed
+    Worker chỉ dừng giữa 2 job khi stop_event được set.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - %(levelname)s - [{worker_id}] %(message)s'
+    )
+    queue = JobQueue(Path(db_path))
+    task_history = TaskHistoryManager(path_manager.base_path)
+    logging.info(f"Render worker {worker_id} started")
+
+    while not stop_event.is_set():
+        try:
+            job = queue.claim(worker_id)
+        except Exception as e:
+            logging.error(f"Error claiming job: {e}")
+            stop_event.wait(poll_interval)
+            continue
+
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+
+        handler = JOB_HANDLERS.get(job["kind"])
+        fingerprint = job_fingerprint(job["payload"])
+        quarantined = queue.quarantined(fingerprint)
+        if quarantined:
+            # Cùng bộ đầu vào đã lỗi permanent trước đó: không tốn thời gian encode lại
+            error = f"Input quarantined after a permanent failure: {quarantined['error']}"
+            queue.quarantine(job["job_id"], error)
+            task_history.update_task_status(job["task_id"], "error", error=error)
+            continue
+
+        logging.info(f"Running job {job['job_id']} ({job['kind']}) for task {job['task_id']}")
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job kind: {job['kind']}")
+            # Job dừng (kill ffmpeg đang chạy) khi task bị hủy qua API
+            with TaskCancelToken(job["task_id"], task_history).activate():
+                handler(job["task_id"], job["payload"])
+            queue.complete(job["job_id"])
+            logging.info(f"Job {job['job_id']} done")
+        except TaskCancelledError:
+            logging.info(f"Job {job['job_id']} cancelled")
+            queue.mark_cancelled(job["job_id"])
+        except Exception as e:
+            kind = classify_error(e)
+            logging.error(f"Job {job['job_id']} failed ({kind}): {e}")
+            bad_input = failed_input(e) if kind == PERMANENT else None
+            if bad_input:
+                # Chỉ lỗi probe/decode file đầu vào mới quarantine bộ đầu vào
+                queue.quarantine(job["job_id"], str(e), fingerprint, label=f"{job['kind']}: {Path(bad_input).name}")
+            else:
+                queue.fail(job["job_id"], str(e))
+
+    logging.info(f"Render worker {worker_id} stopped")
+
+class RenderWorkerPool:
+    """
+    Pool các worker process render (số lượng cấu hình trong common.render_workers.workers)
+
+    Process API chỉ enqueue job; việc render chạy trong các process này nên
+    event loop của API không bao giờ bị chặn và tải đột biến chỉ làm hàng đợi dài thêm.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, db_path: Optional[Path] = None,
+                 poll_interval: Optional[float] = None):
+        """
+        Args:
+            num_workers: Số worker process, mặc định lấy từ settings
+            db_path: File SQLite của hàng đợi, mặc định lấy từ settings
+            poll_interval: Thời gian chờ (giây) khi hàng đợi trống
+        """
+        worker_settings = get_worker_settings()
+        self.num_workers = max(0, int(num_workers if num_workers is not None else worker_settings["workers"]))
+        self.db_path = Path(db_path) if db_path else get_queue_path()
+        self.poll_interval = float(poll_interval if poll_interval is not None else worker_settings["poll_interval"])
+        # spawn để worker không thừa hưởng state của uvicorn (event loop, socket)
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = None
+        self._processes: List[multiprocessing.Process] = []
+
+    def start(self):
+        """Khởi động các worker (requeue job và dọn workspace của worker đã chết trước đó)"""
+        if self._processes:
+            return
+        JobQueue(self.db_path).requeue_orphaned()
+        sweep_orphaned_workspaces(path_manager.base_path / 'temp')
+        self._stop_event = self._context.Event()
+        for i in range(self.num_workers):
+            worker_id = f"worker-{i + 1}-{uuid.uuid4().hex[:6]}"
+            process = self._context.Process(
+                target=worker_main,
+                args=(worker_id, str(self.db_path), self.poll_interval, self._stop_event),
+                name=worker_id,
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+        logging.info(f"Started {len(self._processes)} render workers (queue: {self.db_path})")
+
+    def stop(self, timeout: float = 10.0):
+        """Dừng các worker; worker đang render quá timeout sẽ bị terminate (job được requeue lần sau)"""
+        if not self._processes:
+            return
+        self._stop_event.set()
+        deadline = time.time() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                logging.warning(f"Terminating render worker {process.name}")
+                process.terminate()
+                process.join(5)
+        self._processes = []
+        logging.info("Render workers stopped")
@@ -2,8 +2,9 @@ import os
 import sys
 from pathlib import Path
 import uvicorn
-from fastapi import FastAPI, Request, BackgroundTasks, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, File, UploadFile, Form, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, Dict
 import uuid
@@ -21,7 +22,9 @@ from api.core.paths import PathManager
 from modules.file.file_manager import FileManager
 from modules.utils.settings_manager import SettingsManager
 from modules.utils.task_history_manager import TaskHistoryManager
-from modules.video.hook_video_processor import HookVideoProcessor
+from modules.utils.task_event_bus import TaskEventBus, TERMINAL_STATUSES
+from api.core.render_workers import job_queue, RenderWorkerPool
+from modules.video.subtitle_preview import SubtitlePreviewRenderer
 
 # Initialize settings and paths
 settings = Settings()
@@ -30,9 +33,11 @@ path_manager = PathManager()
 # Initialize processors and managers
 video_maker = VideoMakerRouter()
 settings_manager = SettingsManager()  # SettingsManager uses path_manager internally
-hook_processor = HookVideoProcessor(path_manager.base_path)
 file_manager = FileManager(path_manager.base_path)
 task_history = TaskHistoryManager(path_manager.base_path)  # Use base_path from path_manager
+task_events = TaskEventBus(task_history)  # Đẩy cập nhật trạng thái task tới client đang chờ
+subtitle_preview = SubtitlePreviewRenderer()
+render_workers = RenderWorkerPool()  # Render chạy trong các worker process, API chỉ enqueue
 
 # Create FastAPI app
 app = FastAPI(
@@ -53,6 +58,16 @@ app.add_middleware(
 # Add video maker router
 app.include_router(video_maker.router, prefix="/api/v1")
 
+@app.on_event("startup")
+async def start_render_workers():
+    render_workers.start()
+    task_events.start()
+
+@app.on_event("shutdown")
+async def stop_render_workers():
+    await task_events.stop()
+    await run_in_threadpool(render_workers.stop)
+
 def update_task_status(task_id: str, status: str, message: str = None, error: str = None):
     """Update task status in history"""
     task_data = {
@@ -72,14 +87,15 @@ def create_task(initial_status: dict) -> str:
 # Hook API endpoints
 @app.post("/api/v1/hook/process")
 async def process_hook_video(
-    background_tasks: BackgroundTasks,
     hook_audio: UploadFile = File(...),
     main_audio: UploadFile = File(...),
     subtitle_file: UploadFile = File(...),
     thumbnail_file: UploadFile = File(...),
     preset_name: Optional[str] = Form(None),
     subtitle_settings: Optional[str] = Form(None),
-    is_vertical: bool = Form(False)
+    is_vertical: bool = Form(False),
+    draft: bool = Form(False),
+    draft_duration: Optional[float] = Form(None)
 ):
     task_id = create_task({"status": "processing", "message": "Task started successfully"})
     try:
@@ -97,22 +113,22 @@ async def process_hook_video(
         else:
             raise HTTPException(status_code=400, detail="Either preset_name or subtitle_settings is required")
 
-        # Process video in background
-        background_tasks.add_task(
-            hook_processor.process_hook_video_background,
-            task_id,
-            hook_path,
-            main_path,
-            subtitle_path,
-            thumbnail_path,
-            subtitle_settings,
-            is_vertical
-        )
+        # Đưa vào hàng đợi, render worker sẽ xử lý
+        job_queue.enqueue("hook_video", {
+            "hook_audio_path": str(hook_path),
+            "main_audio_path": str(main_path),
+            "subtitle_path": str(subtitle_path),
+            "thumbnail_path": str(thumbnail_path),
+            "subtitle_settings": subtitle_settings,
+            "is_vertical": is_vertical,
+            "draft": draft,
+            "draft_duration": draft_duration
+        }, task_id=task_id)
 
         return {
             "task_id": task_id,
             "status": "processing",
-            "message": "Task started successfully"
+            "message": "Task queued"
         }
     except Exception as e:
         update_task_status(task_id, "error", error=str(e))
@@ -124,10 +140,11 @@ async def process_hook_video(
 
 @app.post("/api/v1/hook/batch/16_9")
 async def process_batch_hooks_16_9(
-    background_tasks: BackgroundTasks,
     input_folder: str = Form(...),
     preset_name: str = Form(...),
-    bg_path: str = Form(None)
+    bg_path: str = Form(None),
+    draft: bool = Form(False),
+    draft_duration: Optional[float] = Form(None)
 ):
     """
     Xử lý batch video hook với tỉ lệ 16:9
@@ -135,6 +152,8 @@ async def process_batch_hooks_16_9(
         input_folder: Thư mục chứa các file đầu vào
         preset_name: Tên preset cài đặt phụ đề
         bg_path: Đường dẫn đến file nền (nếu có)
+        draft: Render nhanh để xem thử (480p, fps thấp)
+        draft_duration: Chỉ render N giây đầu khi draft
     """
     try:
         # Validate input folder
@@ -159,14 +178,15 @@ async def process_batch_hooks_16_9(
         # ---- SỬA Ở ĐÂY: Chuyển background_path sang Path ----
         background_path = Path(background_path)  # Quan trọng!
 
-        # Process videos in background
-        background_tasks.add_task(
-            hook_processor.process_batch_videos_background,
-            task_id,
-            input_path,
-            subtitle_settings,
-            background_path    # Lúc này background_path đã là Path
-        )
+        # Đưa vào hàng đợi, render worker sẽ xử lý
+        job_queue.enqueue("hook_batch", {
+            "input_folder": str(input_path),
+            "subtitle_settings": subtitle_settings,
+            "bg_path": str(background_path),
+            "is_vertical": False,
+            "draft": draft,
+            "draft_duration": draft_duration
+        }, task_id=task_id)
 
         return {
             "task_id": task_id,
@@ -181,10 +201,11 @@ async def process_batch_hooks_16_9(
 
 @app.post("/api/v1/hook/batch/9_16")
 async def process_batch_hooks_9_16(
-    background_tasks: BackgroundTasks,
     input_folder: str = Form(...),
     preset_name: str = Form(...),
-    bg_path: str = Form(None)
+    bg_path: str = Form(None),
+    draft: bool = Form(False),
+    draft_duration: Optional[float] = Form(None)
 ):
     """
     Xử lý batch video hook với tỉ lệ 9:16
@@ -192,6 +213,8 @@ async def process_batch_hooks_9_16(
         input_folder: Thư mục chứa các file đầu vào
         preset_name: Tên preset cài đặt phụ đề
         bg_path: Đường dẫn đến file nền (nếu có) 
+        draft: Render nhanh để xem thử (480p, fps thấp)
+        draft_duration: Chỉ render N giây đầu khi draft
     """
     try:
         # Validate input folder
@@ -222,15 +245,15 @@ async def process_batch_hooks_9_16(
         # CHUYỂN THÀNH PATH  (bắt buộc để .exists() không lỗi)
         background_path = Path(background_path)
 
-        # Giả sử bạn muốn đặt is_vertical=True cho video 9:16
-        background_tasks.add_task(
-            hook_processor.process_batch_videos_background,
-            task_id,
-            input_path,
-            subtitle_settings,
-            background_path,
-            True  # <-- truyền True để báo là 9:16 (nếu hàm bạn sử dụng tham số này)
-        )
+        # Đưa vào hàng đợi, render worker sẽ xử lý (is_vertical=True cho 9:16)
+        job_queue.enqueue("hook_batch", {
+            "input_folder": str(input_path),
+            "subtitle_settings": subtitle_settings,
+            "bg_path": str(background_path),
+            "is_vertical": True,
+            "draft": draft,
+            "draft_duration": draft_duration
+        }, task_id=task_id)
 
         return {
             "task_id": task_id,
@@ -258,13 +281,13 @@ async def get_hook_status(task_id: str):
             )
             
         # If task is completed or has error, return immediately
-        if status.get('status') in ['completed', 'error']:
+        if status.get('status') in TERMINAL_STATUSES:
             return status
             
-        # If task is still processing, wait for completion or error
+        # If task is still processing, wait for completion or error (long-poll, không poll DB)
         try:
             # Wait for task to complete with 30 minute timeout
-            status = await task_history.wait_for_task(task_id)
+            status = await task_events.wait_for_task(task_id)
             return status
             
         except asyncio.TimeoutError:
@@ -280,6 +303,178 @@ async def get_hook_status(task_id: str):
         logging.error(f"Error getting hook status: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/v1/tasks/{task_id}/cancel")
+async def cancel_task(task_id: str):
+    """
+    Hủy task: job chưa chạy bị bỏ khỏi hàng đợi, job đang chạy bị kill ffmpeg,
+    bỏ qua các nhóm còn lại của batch và dọn file tạm
+    """
+    try:
+        # Kiểm tra + ghi trong 1 transaction: task vừa xong giữ nguyên completed/error
+        task = await run_in_threadpool(
+            task_history.cancel_task,
+            task_id,
+            {
+                "message": "Task cancelled by user",
+                "cancelled_at": datetime.now().isoformat()
+            }
+        )
+        if task is None:
+            raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+        if task.get('status') != 'cancelled':
+            # Task đã kết thúc thì không có gì để hủy
+            return task
+
+        cancelled_jobs = await run_in_threadpool(job_queue.cancel, task_id)
+        logging.info(f"Task {task_id} cancelled ({cancelled_jobs} queued jobs removed)")
+        return task
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Error cancelling task {task_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/v1/quarantine")
+async def list_quarantine():
+    """
+    Danh sách bộ đầu vào bị quarantine (file đầu vào không probe/decode được), mới nhất trước
+    """
+    try:
+        entries = await run_in_threadpool(job_queue.list_quarantine)
+        return {"total": len(entries), "entries": entries}
+    except Exception as e:
+        logging.error(f"Error listing quarantine: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/v1/quarantine/{fingerprint}")
+async def release_quarantine(fingerprint: str):
+    """
+    Bỏ 1 bộ đầu vào khỏi quarantine để gửi lại được
+    """
+    try:
+        released = await run_in_threadpool(job_queue.release_quarantine, fingerprint)
+        if not released:
+            raise HTTPException(status_code=404, detail=f"Fingerprint {fingerprint} not in quarantine")
+        logging.info(f"Released quarantined input {fingerprint}")
+        return {"fingerprint": fingerprint, "status": "released"}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Error releasing quarantine {fingerprint}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/v1/tasks/{task_id}/events")
+async def stream_task_events(task_id: str):
+    """
+    Server-Sent Events: gửi trạng thái task mỗi khi thay đổi, đóng stream khi task kết thúc
+    """
+    if task_history.get_task(task_id).get('status') == 'not_found':
+        raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+
+    async def event_source():
+        try:
+            async for task in task_events.stream(task_id):
+                yield f"event: status\ndata: {json.dumps(task, ensure_ascii=False)}\n\n"
+        except asyncio.TimeoutError:
+            yield f"event: timeout\ndata: {json.dumps({'task_id': task_id})}\n\n"
+        except ValueError as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/v1/tasks/{task_id}/ws")
+async def task_status_websocket(websocket: WebSocket, task_id: str):
+    """
+    WebSocket: gửi trạng thái task (JSON) mỗi khi thay đổi, đóng kết nối khi task kết thúc
+    """
+    await websocket.accept()
+    try:
+        async for task in task_events.stream(task_id):
+            await websocket.send_json(task)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except ValueError as e:
+        await websocket.send_json({"status": "not_found", "error": str(e)})
+        await websocket.close(code=1008)
+    except asyncio.TimeoutError:
+        await websocket.close(code=1001)
+
+@app.post("/api/v1/subtitle/preview")
+async def preview_subtitle(
+    preset_name: Optional[str] = Form(None),
+    subtitle_settings: Optional[str] = Form(None),
+    text: Optional[str] = Form(None),
+    subtitle_file: Optional[UploadFile] = File(None),
+    subtitle_path: Optional[str] = Form(None),
+    timestamp: float = Form(0.0),
+    aspect_ratio: str = Form("16:9")
+):
+    """
+    Render 1 frame PNG xem thử style subtitle (dùng chung cho cả 2 workflow)
+    Args:
+        preset_name: Tên preset (hoặc truyền subtitle_settings dạng JSON)
+        text: Dòng text mẫu
+        subtitle_file / subtitle_path: File .srt/.ass, lấy dòng subtitle tại timestamp
+        timestamp: Thời điểm (giây)
+        aspect_ratio: "16:9" hoặc "9:16"
+    """
+    uploaded_path = None
+    try:
+        if preset_name:
+            settings_dict = settings_manager.load_preset(preset_name)
+            if not settings_dict:
+                raise HTTPException(status_code=404, detail=f"Không tìm thấy preset: {preset_name}")
+        elif subtitle_settings:
+            try:
+                settings_dict = json.loads(subtitle_settings)
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=400, detail=f"subtitle_settings is not valid JSON: {e}")
+            if not isinstance(settings_dict, dict):
+                raise HTTPException(status_code=400, detail="subtitle_settings must be a JSON object")
+        else:
+            raise HTTPException(status_code=400, detail="Either preset_name or subtitle_settings is required")
+
+        if aspect_ratio not in ("16:9", "9:16"):
+            raise HTTPException(status_code=400, detail="aspect_ratio must be 16:9 or 9:16")
+
+        if subtitle_file is not None and subtitle_file.filename:
+            uploaded_path = await file_manager.save_upload(subtitle_file, "temp")
+            source_path = uploaded_path
+        elif subtitle_path:
+            source_path = Path(subtitle_path.strip('"'))
+        else:
+            source_path = None
+
+        if not source_path and not text:
+            raise HTTPException(status_code=400, detail="Either text or a subtitle file is required")
+
+        preview_path = await run_in_threadpool(
+            subtitle_preview.render,
+            settings_dict,
+            text,
+            source_path,
+            timestamp,
+            aspect_ratio == "9:16"
+        )
+        return FileResponse(str(preview_path), media_type="image/png")
+
+    except HTTPException as e:
+        raise e
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error rendering subtitle preview: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if uploaded_path and uploaded_path.exists():
+            uploaded_path.unlink()
+
 @app.get("/api/v1/hook/presets")
 async def get_presets():
     return settings_manager.get_presets()
@@ -108,6 +108,15 @@ class MakeVideoRequest(BaseModel):
         default=None, 
         description="Tên file video đầu ra"
     )
+    draft: Optional[bool] = Field(
+        default=False,
+        description="Render nhanh để xem thử (480p, fps thấp), file đầu ra có hậu tố _draft"
+    )
+    draft_duration: Optional[float] = Field(
+        default=None,
+        description="Chỉ render N giây đầu khi draft",
+        gt=0
+    )
 
     class Config:
         schema_extra = {
@@ -138,8 +147,8 @@ class VideoResponse(BaseModel):
 class ProcessingStatus(BaseModel):
     """Trạng thái xử lý video"""
     status: str = Field(
-        description="Trạng thái hiện tại: processing, completed, error",
-        examples=["processing", "completed", "error"]
+        description="Trạng thái hiện tại: processing, completed, error, cancelled",
+        examples=["processing", "completed", "error", "cancelled"]
     )
     progress: int = Field(
         description="Tiến độ xử lý (0-100)",
@@ -167,3 +176,23 @@ class ProcessingStatus(BaseModel):
         default=None,
         description="Thông tin các file đầu vào"
     )
+    draft: Optional[bool] = Field(
+        default=None,
+        description="True nếu là bản render draft"
+    )
+    stage: Optional[str] = Field(
+        default=None,
+        description="Bước đang chạy (vd. video_concat, video_final)"
+    )
+    speed: Optional[float] = Field(
+        default=None,
+        description="Tốc độ encode so với realtime (vd. 2.5 = nhanh gấp 2.5 lần)"
+    )
+    fps: Optional[float] = Field(
+        default=None,
+        description="Số frame encode mỗi giây"
+    )
+    eta_seconds: Optional[int] = Field(
+        default=None,
+        description="Ước lượng thời gian còn lại (giây)"
+    )
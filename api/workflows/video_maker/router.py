@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Form
+from fastapi import APIRouter, Depends, HTTPException, Form
 from typing import Optional
 from .models import MakeVideoRequest, VideoResponse, ProcessingStatus
 from .service import VideoMakerService
@@ -14,14 +14,15 @@ class VideoMakerRouter:
         """Setup all routes for video maker"""
         @self.router.post("/make", response_model=VideoResponse)
         async def make_final_video(
-            background_tasks: BackgroundTasks,
             request: Optional[str] = Form(None),
             audio_path: Optional[str] = Form(None),
             subtitle_path: Optional[str] = Form(None),
             overlay1_path: Optional[str] = Form(None),
             overlay2_path: Optional[str] = Form(None),
             preset_name: Optional[str] = Form(None),
-            output_name: Optional[str] = Form(None)
+            output_name: Optional[str] = Form(None),
+            draft: bool = Form(False),
+            draft_duration: Optional[float] = Form(None)
         ) -> VideoResponse:
             """
             Create final video with:
@@ -29,17 +30,19 @@ class VideoMakerRouter:
             - Subtitles
             - Overlays (optional)
             - Preset settings
+            - Draft mode (optional): 480p, low fps, only the first draft_duration seconds
             """
             try:
                 result = await self.service.make_final_video(
-                    background_tasks=background_tasks,
                     request=request,
                     audio_path=audio_path,
                     subtitle_path=subtitle_path,
                     overlay1_path=overlay1_path,
                     overlay2_path=overlay2_path,
                     preset_name=preset_name,
-                    output_name=output_name
+                    output_name=output_name,
+                    draft=draft,
+                    draft_duration=draft_duration
                 )
                 return VideoResponse(**result)
             except Exception as e:
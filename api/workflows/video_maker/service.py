@@ -4,20 +4,37 @@ import uuid
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Optional
-from fastapi import HTTPException, BackgroundTasks
+from fastapi import HTTPException
 from api.core.paths import path_manager
 from modules.video.processor import VideoProcessor
 from modules.utils.settings_manager import SettingsManager
+from modules.utils.task_history_manager import TaskHistoryManager
+from modules.utils.progress import ProgressTracker
+from modules.utils.cancellation import TaskCancelledError
+from api.core.render_workers import job_queue
+
+# Trọng số tiến độ: nối clip nền (encode lại) và render cuối (phụ đề + overlay + audio)
+VIDEO_STAGE_WEIGHTS = {
+    "video_concat": 0.3,
+    "video_final": 0.7
+}
 
 class VideoMakerService:
     def __init__(self):
-        """Initialize service with video processor"""
-        self.video_processor = VideoProcessor(
-            base_path=path_manager.base_path,
-            paths=path_manager.get_workflow_paths("video_maker")
-        )
+        """Initialize service (VideoProcessor chỉ được tạo khi chạy job trong render worker)"""
+        self._video_processor = None
         self.settings_manager = SettingsManager()  # Dùng settings manager để load preset
-        self._task_status = {}  # Store task status in memory
+        # Trạng thái task lưu trong task history để API và render worker cùng đọc/ghi
+        self.task_history = TaskHistoryManager(path_manager.base_path)
+
+    @property
+    def video_processor(self) -> VideoProcessor:
+        if self._video_processor is None:
+            self._video_processor = VideoProcessor(
+                base_path=path_manager.base_path,
+                paths=path_manager.get_workflow_paths("video_maker")
+            )
+        return self._video_processor
         
     def _load_preset(self, preset_name: str) -> dict:
         """Load subtitle preset from file"""
@@ -30,23 +47,24 @@ class VideoMakerService:
         return preset
     
     def update_task_status(self, task_id: str, status: Dict):
-        """Update task status"""
-        self._task_status[task_id] = status
+        """Update task status (gộp với trạng thái đã lưu)"""
+        self.task_history.merge_task(task_id, status)
         
     async def get_task_status(self, task_id: str) -> Dict:
         """Get task status"""
-        return self._task_status.get(task_id, {"status": "not_found"})
+        return self.task_history.get_task(task_id)
         
     async def make_final_video(
         self,
-        background_tasks: BackgroundTasks,
         request: Optional[str] = None,
         audio_path: Optional[str] = None,
         subtitle_path: Optional[str] = None,
         overlay1_path: Optional[str] = None,
         overlay2_path: Optional[str] = None,
         preset_name: Optional[str] = None,
-        output_name: Optional[str] = None
+        output_name: Optional[str] = None,
+        draft: bool = False,
+        draft_duration: Optional[float] = None
     ) -> Dict:
         """Create final video with audio, subtitles and overlays"""
         try:
@@ -63,6 +81,8 @@ class VideoMakerService:
                     overlay2_path = request_data.get('overlay2_path', overlay2_path)
                     preset_name = request_data.get('preset_name', preset_name)
                     output_name = request_data.get('output_name', output_name)
+                    draft = bool(request_data.get('draft', draft))
+                    draft_duration = request_data.get('draft_duration', draft_duration)
                 except json.JSONDecodeError:
                     raise HTTPException(status_code=400, detail="Invalid JSON in request")
             
@@ -96,8 +116,9 @@ class VideoMakerService:
             self.update_task_status(task_id, {
                 "status": "processing",
                 "progress": 0,
-                "message": "Starting video processing",
+                "message": "Draft render queued" if draft else "Video processing queued",
                 "created_at": datetime.now().isoformat(),
+                "draft": draft,
                 "input_files": {
                     "audio": str(paths['audio']),
                     "subtitle": str(paths['subtitle']),
@@ -106,22 +127,22 @@ class VideoMakerService:
                 }
             })
             
-            # Start processing in background
-            background_tasks.add_task(
-                self._make_video_background,
-                task_id=task_id,
-                output_name=output_name,
-                audio_path=paths['audio'],
-                subtitle_path=paths['subtitle'],
-                overlay1_path=paths['overlay1'],
-                overlay2_path=paths['overlay2'],
-                subtitle_config=subtitle_config
-            )
+            # Đưa vào hàng đợi, render worker sẽ xử lý
+            job_queue.enqueue("video_maker", {
+                "output_name": output_name,
+                "audio_path": str(paths['audio']),
+                "subtitle_path": str(paths['subtitle']),
+                "overlay1_path": str(paths['overlay1']) if paths['overlay1'] else None,
+                "overlay2_path": str(paths['overlay2']) if paths['overlay2'] else None,
+                "subtitle_config": subtitle_config,
+                "draft": draft,
+                "draft_duration": draft_duration
+            }, task_id=task_id)
             
             return {
                 "task_id": task_id,
                 "status": "processing",
-                "message": "Video processing started",
+                "message": "Video processing queued",
                 "output_path": None,
                 "error": None
             }
@@ -136,49 +157,61 @@ class VideoMakerService:
                 "error": str(e)
             }
             
-    async def _make_video_background(
+    def run_video_job(
         self,
         task_id: str,
         output_name: Optional[str] = None,
-        audio_path: Optional[Path] = None,
-        subtitle_path: Optional[Path] = None,
-        overlay1_path: Optional[Path] = None,
-        overlay2_path: Optional[Path] = None,
-        subtitle_config: Optional[dict] = None
+        audio_path: Optional[str] = None,
+        subtitle_path: Optional[str] = None,
+        overlay1_path: Optional[str] = None,
+        overlay2_path: Optional[str] = None,
+        subtitle_config: Optional[dict] = None,
+        draft: bool = False,
+        draft_duration: Optional[float] = None
     ):
-        """Process video in background"""
+        """Process video (chạy trong render worker)"""
         try:
             # Update status
             self.update_task_status(task_id, {
                 "status": "processing",
-                "progress": 10,
+                "progress": 0,
                 "message": "Processing video"
             })
             
-            # Process video
-            output_path = self.video_processor.process_video(
-                audio_path=audio_path,
-                subtitle_path=subtitle_path,
-                overlay1_path=overlay1_path,
-                overlay2_path=overlay2_path,
-                subtitle_config=subtitle_config,
-                output_name=output_name
-            )
+            # Process video, tiến độ ffmpeg ghi vào task
+            tracker = ProgressTracker(task_id, self.task_history, VIDEO_STAGE_WEIGHTS)
+            with tracker.activate():
+                output_path = self.video_processor.process_video(
+                    audio_path=Path(audio_path),
+                    subtitle_path=Path(subtitle_path),
+                    overlay1_path=Path(overlay1_path) if overlay1_path else None,
+                    overlay2_path=Path(overlay2_path) if overlay2_path else None,
+                    subtitle_config=subtitle_config,
+                    output_name=output_name,
+                    draft=draft,
+                    draft_duration=draft_duration
+                )
             
             # Update status on success
             self.update_task_status(task_id, {
                 "status": "completed",
                 "progress": 100,
-                "message": "Video processing completed",
+                "message": "Draft render completed" if draft else "Video processing completed",
                 "output_path": str(output_path),
+                "draft": draft,
                 "completed_at": datetime.now().isoformat()
             })
             
+        except TaskCancelledError:
+            # Status 'cancelled' đã được ghi khi hủy
+            logging.info(f"Video job {task_id} cancelled")
+            raise
         except Exception as e:
-            logging.error(f"Error in make_video_background: {str(e)}")
+            logging.error(f"Error in run_video_job: {str(e)}")
             self.update_task_status(task_id, {
                 "status": "error",
                 "progress": 0,
                 "message": str(e),
                 "error_at": datetime.now().isoformat()
             })
+            raise
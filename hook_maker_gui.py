@@ -4,10 +4,15 @@ from tkinter import ttk, filedialog, messagebox, colorchooser
 import logging
 import json
 from modules import FileManager, HookVideoProcessor, SubtitleProcessor, SettingsManager
+from modules.video.subtitle_preview import SubtitlePreviewRenderer
 from typing import Optional, List, Dict
 import os
 import time
-import winreg
+import threading
+from modules.utils.font_manager import FontManager
+from modules.utils.cancellation import CancelToken, TaskCancelledError
+from modules.utils.batch_executor import BatchResult
+from modules.video.batch_preflight import BatchPreflight, find_batch_groups
 
 class HookMakerGUI:
     def __init__(self, root):
@@ -33,6 +38,16 @@ class HookMakerGUI:
         self.alignment_var = tk.StringVar(value="2")
         self.max_chars_var = tk.StringVar(value="40")
         
+        # Draft mode: render nhanh 480p để xem thử preset
+        self.draft_var = tk.BooleanVar(value=False)
+        self.draft_duration_var = tk.StringVar(value="15")
+        
+        # Subtitle preview
+        self.preview_text_var = tk.StringVar(value="Sample subtitle line")
+        self.preview_time_var = tk.StringVar(value="1.0")
+        self.preview_aspect_var = tk.StringVar(value="16:9")
+        self.subtitle_preview = SubtitlePreviewRenderer()
+        
         # Initialize subtitle settings
         self.subtitle_settings = {}
         self.update_subtitle_settings()  # Initialize with default values
@@ -143,6 +158,24 @@ class HookMakerGUI:
         # Process button
         ttk.Button(main_frame, text="Process Video", command=self.process_video).grid(row=3, column=0, columnspan=2, padx=5, pady=10, sticky="ew")
         
+        # Draft options
+        draft_frame = ttk.Frame(main_frame)
+        draft_frame.grid(row=5, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+        ttk.Checkbutton(draft_frame, text="Draft (480p, fast)", variable=self.draft_var).grid(row=0, column=0, padx=5)
+        ttk.Label(draft_frame, text="First seconds (empty = full):").grid(row=0, column=1, padx=5)
+        ttk.Entry(draft_frame, textvariable=self.draft_duration_var, width=6).grid(row=0, column=2, padx=5)
+        
+        # Subtitle preview (1 frame)
+        preview_frame = ttk.LabelFrame(main_frame, text="Subtitle Preview", padding="5")
+        preview_frame.grid(row=6, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        ttk.Label(preview_frame, text="Sample text:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        ttk.Entry(preview_frame, textvariable=self.preview_text_var, width=40).grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        ttk.Label(preview_frame, text="Time (s):").grid(row=0, column=2, padx=5, pady=5)
+        ttk.Entry(preview_frame, textvariable=self.preview_time_var, width=6).grid(row=0, column=3, padx=5, pady=5)
+        ttk.Combobox(preview_frame, textvariable=self.preview_aspect_var, values=["16:9", "9:16"],
+                     width=6, state="readonly").grid(row=0, column=4, padx=5, pady=5)
+        ttk.Button(preview_frame, text="Preview Subtitle", command=self.preview_subtitle).grid(row=0, column=5, padx=5, pady=5)
+        
         # Subtitle settings frame
         subtitle_frame = ttk.LabelFrame(main_frame, text="Subtitle Settings", padding="5")
         subtitle_frame.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
@@ -199,12 +232,22 @@ class HookMakerGUI:
         process_frame.pack(padx=10, pady=10, fill='x')
 
         # Nút bắt đầu xử lý batch
-        process_btn = ttk.Button(
+        self.batch_start_btn = ttk.Button(
             process_frame, 
             text="Start Batch Processing", 
             command=self.start_batch_processing
         )
-        process_btn.pack(expand=True, fill='x')
+        self.batch_start_btn.pack(expand=True, fill='x')
+
+        # Nút hủy batch đang chạy
+        self.batch_cancel_btn = ttk.Button(
+            process_frame,
+            text="Cancel",
+            command=self.cancel_batch_processing,
+            state='disabled'
+        )
+        self.batch_cancel_btn.pack(expand=True, fill='x', pady=(5, 0))
+        self.batch_cancel_token = None
 
         # Thanh tiến trình
         self.batch_progress = ttk.Progressbar(
@@ -219,6 +262,16 @@ class HookMakerGUI:
         self.batch_log = tk.Text(self.batch_tab, height=10, state='disabled')
         self.batch_log.pack(padx=10, pady=10, expand=True, fill='both')
 
+    def get_draft_options(self):
+        """Lấy tùy chọn draft từ UI: (draft, draft_duration)"""
+        if not self.draft_var.get():
+            return False, None
+        try:
+            value = self.draft_duration_var.get().strip()
+            return True, float(value) if value else None
+        except ValueError:
+            raise ValueError("Draft duration must be a number of seconds")
+
     def browse_folder(self, var):
         """Browse and select folder"""
         folder_selected = filedialog.askdirectory()
@@ -226,7 +279,7 @@ class HookMakerGUI:
             var.set(folder_selected)
 
     def start_batch_processing(self):
-        """Bắt đầu xử lý batch"""
+        """Bắt đầu xử lý batch (chạy ở thread riêng để UI và nút Cancel vẫn hoạt động)"""
         try:
             # Lấy thư mục input và output
             input_dir = Path(self.batch_input_dir.get())
@@ -250,36 +303,80 @@ class HookMakerGUI:
             self.batch_progress['value'] = 0
             self.clear_batch_log()
 
-            # Xử lý từng nhóm file
-            for file_group in matching_files:
-                try:
-                    # Tạo tên file output
-                    output_filename = f"{file_group['thumbnail'].stem.replace('_hook', '')}_{int(time.time())}.mp4"
-                    output_path = output_dir / output_filename
-
-                    # Xử lý video
-                    self.video_processor.process_hook_video(
-                        hook_audio=file_group['hook_audio'],
-                        audio_path=file_group['main_audio'],
-                        thumbnail_path=file_group['thumbnail'],
-                        subtitle_path=file_group['subtitle'],
-                        output_path=output_path,
-                        subtitle_settings=self.subtitle_settings
-                    )
-
-                    # Cập nhật log và progress
-                    self.update_batch_log(f"Processed: {output_filename}")
-                    self.batch_progress['value'] += 1
-                    self.root.update_idletasks()
-
-                except Exception as e:
-                    self.update_batch_log(f"Error processing {file_group['thumbnail'].name}: {str(e)}")
-
-            # Hoàn thành
-            messagebox.showinfo("Batch Processing", "Batch processing completed!")
+            draft, draft_duration = self.get_draft_options()
 
         except Exception as e:
             messagebox.showerror("Error", f"Batch processing failed: {str(e)}")
+            return
+
+        self.batch_cancel_token = CancelToken()
+        self.batch_start_btn.configure(state='disabled')
+        self.batch_cancel_btn.configure(state='normal')
+        threading.Thread(
+            target=self._run_batch,
+            args=(matching_files, output_dir, draft, draft_duration, self.batch_cancel_token),
+            name="hook-batch",
+            daemon=True
+        ).start()
+
+    def cancel_batch_processing(self):
+        """Hủy batch: kill ffmpeg đang chạy và bỏ qua các nhóm còn lại"""
+        if self.batch_cancel_token:
+            self.batch_cancel_token.cancel()
+            self.batch_cancel_btn.configure(state='disabled')
+            self.update_batch_log("Cancelling...")
+
+    def _run_batch(self, matching_files: List[Dict[str, Path]], output_dir: Path, draft: bool,
+                   draft_duration: Optional[float], cancel_token: CancelToken):
+        """Xử lý các nhóm file song song (thread nền, cập nhật UI qua root.after)"""
+        def group_done(result: BatchResult):
+            # Cập nhật log và progress
+            if result.ok:
+                message = f"Processed: {Path(result.value).name}"
+            else:
+                message = f"Error processing {result.item[1]['thumbnail'].name}: {str(result.error)}"
+            self.root.after(0, self._on_batch_item_done, message)
+
+        groups = [
+            (file_group['thumbnail'].stem.replace('_hook', ''), file_group)
+            for file_group in matching_files
+        ]
+        cancelled = False
+        with cancel_token.activate():
+            try:
+                # Kiểm tra trước mọi nhóm (probe song song), nhóm lỗi bị loại trước khi encode
+                self.root.after(0, self.update_batch_log, f"Checking {len(groups)} groups...")
+                groups, rejected = BatchPreflight(self.video_processor.subtitle_processor).check(groups)
+                for result in rejected:
+                    self.root.after(0, self._on_batch_item_done, f"Skipped {result.name}: {result.reason()}")
+                cancel_token.raise_if_cancelled()
+                self.video_processor.render_batch(
+                    groups,
+                    output_dir,
+                    self.subtitle_settings,
+                    draft=draft,
+                    draft_duration=draft_duration,
+                    on_done=group_done
+                )
+            except TaskCancelledError:
+                cancelled = True
+
+        self.root.after(0, self._on_batch_finished, cancelled)
+
+    def _on_batch_item_done(self, message: str):
+        self.update_batch_log(message)
+        self.batch_progress['value'] += 1
+
+    def _on_batch_finished(self, cancelled: bool):
+        self.batch_cancel_token = None
+        self.batch_start_btn.configure(state='normal')
+        self.batch_cancel_btn.configure(state='disabled')
+        if cancelled:
+            self.update_batch_log("Batch cancelled")
+            messagebox.showinfo("Batch Processing", "Batch processing cancelled")
+        else:
+            # Hoàn thành
+            messagebox.showinfo("Batch Processing", "Batch processing completed!")
 
     def find_matching_batch_files(self, folder_path: Path) -> List[Dict[str, Path]]:
         """
@@ -291,43 +388,7 @@ class HookMakerGUI:
         Returns:
             List[Dict[str, Path]]: Danh sách các nhóm file khớp
         """
-        # Chuyển đổi tất cả các file về lowercase để so sánh
-        all_files = [f for f in folder_path.iterdir() if f.is_file()]
-        
-        # Nhóm file theo tên gốc
-        file_groups = {}
-        
-        for file in all_files:
-            # Tách tên file và phần mở rộng
-            stem = file.stem.lower()
-            
-            # Loại bỏ các hậu tố đặc biệt để lấy tên gốc
-            for suffix in ['_hook', '_audio']:
-                if stem.endswith(suffix):
-                    stem = stem[:-len(suffix)]
-            
-            # Tạo nhóm nếu chưa tồn tại
-            if stem not in file_groups:
-                file_groups[stem] = {}
-            
-            # Phân loại file
-            if '_hook.png' in file.name.lower():
-                file_groups[stem]['thumbnail'] = file
-            elif '_hook.wav' in file.name.lower() or '_hook.mp3' in file.name.lower():
-                file_groups[stem]['hook_audio'] = file
-            elif '_audio.wav' in file.name.lower() or '_audio.mp3' in file.name.lower():
-                file_groups[stem]['main_audio'] = file
-            elif file.suffix.lower() in ['.srt', '.ass']:
-                file_groups[stem]['subtitle'] = file
-        
-        # Lọc các bộ file đầy đủ
-        complete_groups = []
-        for name, group in file_groups.items():
-            # Kiểm tra xem nhóm có đủ các file cần thiết không
-            if len(group) >= 4:  # thumbnail, hook_audio, main_audio, subtitle
-                complete_groups.append(group)
-        
-        return complete_groups
+        return [group for _, group in find_batch_groups(folder_path)]
 
     def update_batch_log(self, message):
         """Cập nhật log trong batch processing"""
@@ -343,58 +404,12 @@ class HookMakerGUI:
         self.batch_log.configure(state='disabled')
 
     def get_system_fonts(self):
-        """Get list of installed fonts"""
+        """Get list of installed fonts (từ chỉ mục font đã cache, không quét registry)"""
+        # Danh sách font mặc định
+        default_fonts = ["Arial", "Times New Roman", "Calibri", "Verdana", "Tahoma"]
         try:
-            # Danh sách font mặc định
-            default_fonts = ["Arial", "Times New Roman", "Calibri", "Verdana", "Tahoma"]
-
-            # Đường dẫn registry chứa font
-            font_paths = [
-                (winreg.HKEY_LOCAL_MACHINE, r'SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts'),
-                (winreg.HKEY_LOCAL_MACHINE, r'SOFTWARE\Microsoft\Windows\CurrentVersion\Fonts'),
-                (winreg.HKEY_CURRENT_USER, r'SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts'),
-                (winreg.HKEY_CURRENT_USER, r'SOFTWARE\Microsoft\Windows\CurrentVersion\Fonts')
-            ]
-
-            installed_fonts = set()
-
-            for hkey, path in font_paths:
-                try:
-                    # Mở registry key
-                    key = winreg.OpenKey(hkey, path)
-                    
-                    # Đếm số lượng giá trị trong key
-                    num_values = winreg.QueryInfoKey(key)[1]
-                    
-                    # Lặp qua các giá trị
-                    for i in range(num_values):
-                        try:
-                            name, data, _ = winreg.EnumValue(key, i)
-                            # Loại bỏ phần mở rộng và (TrueType)
-                            clean_name = name.replace(' (TrueType)', '').replace(' (OpenType)', '').replace(' (Italic)', '')
-                            installed_fonts.add(clean_name)
-                        except Exception as e:
-                            logging.debug(f"Error reading font registry value: {e}")
-                    
-                    winreg.CloseKey(key)
-                except FileNotFoundError:
-                    logging.debug(f"Font registry path not found: {path}")
-                except PermissionError:
-                    logging.debug(f"Permission denied for registry path: {path}")
-                except Exception as e:
-                    logging.debug(f"Error accessing font registry path {path}: {e}")
-
-            # Thêm một số font phổ biến khác
-            additional_fonts = [
-                "Segoe UI", "Microsoft Sans Serif", "Consolas", 
-                "Courier New", "Georgia", "Palatino Linotype"
-            ]
-            
-            # Kết hợp font mặc định, font từ hệ thống và font bổ sung
-            all_fonts = list(set(default_fonts + list(installed_fonts) + additional_fonts))
-            
-            return sorted(all_fonts)
-
+            installed_fonts = FontManager.get_font_names()
+            return sorted(set(installed_fonts) | set(default_fonts), key=str.lower)
         except Exception as e:
             logging.error(f"Unexpected error getting system fonts: {e}")
             return default_fonts
@@ -623,6 +638,49 @@ class HookMakerGUI:
         logging.info(f"Updated subtitle settings: {self.subtitle_settings}")
         return self.subtitle_settings
 
+    def preview_subtitle(self):
+        """Render 1 frame xem thử subtitle với cài đặt hiện tại"""
+        try:
+            self.update_subtitle_settings()
+            config = self.subtitle_settings
+
+            subtitle_file = self.subtitle_path.get().strip()
+            sample_text = self.preview_text_var.get().strip()
+            if not subtitle_file and not sample_text:
+                messagebox.showerror("Error", "Please select a subtitle file or enter a sample line")
+                return
+            try:
+                timestamp = float(self.preview_time_var.get() or 0)
+            except ValueError:
+                messagebox.showerror("Error", "Preview time must be a number of seconds")
+                return
+
+            preview_path = self.subtitle_preview.render(
+                config,
+                text=None if subtitle_file else sample_text,
+                subtitle_path=Path(subtitle_file) if subtitle_file else None,
+                timestamp=timestamp,
+                is_vertical=self.preview_aspect_var.get() == "9:16"
+            )
+            self.show_preview_image(preview_path)
+
+        except Exception as e:
+            logging.error(f"Error rendering subtitle preview: {str(e)}")
+            messagebox.showerror("Error", f"Failed to render preview: {str(e)}")
+
+    def show_preview_image(self, image_path: Path):
+        """Hiển thị ảnh preview trong cửa sổ riêng"""
+        window = tk.Toplevel(self.root)
+        window.title(f"Subtitle Preview - {Path(image_path).name[:12]}")
+        image = tk.PhotoImage(file=str(image_path))
+        # Thu nhỏ để vừa màn hình (1920x1080 -> 960x540, 1080x1920 -> 360x640)
+        factor = max(1, -(-max(image.width(), image.height()) // 960))
+        if factor > 1:
+            image = image.subsample(factor)
+        label = ttk.Label(window, image=image)
+        label.image = image  # Giữ reference để Tk không giải phóng ảnh
+        label.pack(padx=5, pady=5)
+
     def process_video(self):
         """Process video with current settings"""
         try:
@@ -640,16 +698,20 @@ class HookMakerGUI:
             output_filename = f"{audio_path.stem}_{int(time.time())}.mp4"
             output_path = self.final_dir / output_filename
             
-            self.video_processor.process_hook_video(
+            draft, draft_duration = self.get_draft_options()
+            
+            output_path = self.video_processor.process_hook_video(
                 hook_audio=Path(self.hook_path_var.get()),
                 audio_path=Path(self.audio_path_var.get()),
                 thumbnail_path=Path(self.thumbnail_path.get()),
                 subtitle_path=Path(self.subtitle_path.get()),
                 output_path=output_path,
-                subtitle_settings=self.subtitle_settings
+                subtitle_settings=self.subtitle_settings,
+                draft=draft,
+                draft_duration=draft_duration
             )
             
-            messagebox.showinfo("Success", f"Video processing completed!\nOutput: {output_filename}")
+            messagebox.showinfo("Success", f"Video processing completed!\nOutput: {Path(output_path).name}")
             
         except Exception as e:
             logging.error(f"Error processing video: {str(e)}")
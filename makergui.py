@@ -8,6 +8,8 @@ from modules.video.video_cutter import VideoCutter
 from modules.video.processor import VideoProcessor
 from modules.video.subtitle_processor import SubtitleProcessor
 from modules.video.video_cutter_processor import VideoCutterProcessor
+from modules.video.subtitle_preview import SubtitlePreviewRenderer
+from modules.utils.font_manager import FontManager
 from api.core.paths import path_manager
 from typing import Optional
 import os
@@ -36,7 +38,8 @@ class VideoMakerGUI:
         )
         self.video_cutter = VideoCutterProcessor(
             raw_dir=self.raw_dir,
-            cut_dir=self.cut_dir
+            cut_dir=self.cut_dir,
+            vertical_cut_dir=path_manager.get_path("hook_maker", "input_9_16")
         )
         
         # Create notebook for tabs
@@ -92,6 +95,16 @@ class VideoMakerGUI:
         
         self.min_duration_var = tk.StringVar(value="4.0")
         self.max_duration_var = tk.StringVar(value="7.0")
+        self.include_vertical_var = tk.BooleanVar(value=True)
+        
+        # Draft mode: render nhanh 480p để xem thử preset
+        self.draft_var = tk.BooleanVar(value=False)
+        self.draft_duration_var = tk.StringVar(value="15")
+        
+        # Subtitle preview
+        self.preview_text_var = tk.StringVar(value="Sample subtitle line")
+        self.preview_time_var = tk.StringVar(value="1.0")
+        self.subtitle_preview = SubtitlePreviewRenderer()
         
         self.setup_ui()
         
@@ -133,6 +146,24 @@ class VideoMakerGUI:
         ttk.Button(preset_frame, text="Save Preset", command=self.save_preset).grid(row=2, column=0, padx=5, pady=5, sticky="ew")
         ttk.Button(preset_frame, text="Delete Preset", command=self.delete_preset).grid(row=2, column=1, padx=5, pady=5, sticky="ew")
         
+        # Draft options
+        draft_frame = ttk.Frame(main_frame)
+        draft_frame.grid(row=3, column=0, sticky=tk.W, pady=(0, 5))
+        ttk.Checkbutton(draft_frame, text="Draft (480p, fast)",
+                        variable=self.draft_var).grid(row=0, column=0, padx=5)
+        ttk.Label(draft_frame, text="First seconds (empty = full):").grid(row=0, column=1, padx=5)
+        ttk.Entry(draft_frame, textvariable=self.draft_duration_var, width=6).grid(row=0, column=2, padx=5)
+        
+        # Subtitle preview (1 frame)
+        preview_frame = ttk.LabelFrame(main_frame, text="Subtitle Preview", padding="5")
+        preview_frame.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=5)
+        ttk.Label(preview_frame, text="Sample text:").grid(row=0, column=0, sticky=tk.W)
+        ttk.Entry(preview_frame, textvariable=self.preview_text_var, width=40).grid(row=0, column=1, sticky=(tk.W, tk.E))
+        ttk.Label(preview_frame, text="Time (s):").grid(row=0, column=2, padx=5)
+        ttk.Entry(preview_frame, textvariable=self.preview_time_var, width=6).grid(row=0, column=3)
+        ttk.Button(preview_frame, text="Preview Subtitle",
+                  command=self.preview_subtitle).grid(row=0, column=4, padx=5)
+        
         # Process button
         ttk.Button(main_frame, text="Process Video", 
                   command=self.process_video).grid(row=2, column=0, pady=10)
@@ -168,6 +199,10 @@ class VideoMakerGUI:
         ttk.Label(settings_frame, text="Max Duration (s):").grid(row=1, column=0, sticky=tk.W)
         ttk.Entry(settings_frame, textvariable=self.max_duration_var, width=10).grid(row=1, column=1, padx=5)
         
+        # Tạo thêm clip 9:16 cho thư viện input_9_16 trong cùng lần decode
+        ttk.Checkbutton(settings_frame, text="Also create 9:16 clips (input_9_16)",
+                        variable=self.include_vertical_var).grid(row=2, column=0, columnspan=2, sticky=tk.W)
+        
         # Buttons frame
         buttons_frame = ttk.Frame(cutter_frame)
         buttons_frame.grid(row=2, column=0, sticky="ew", pady=5)
@@ -305,61 +340,12 @@ class VideoMakerGUI:
             color_var.set(ass_color)
             
     def get_system_fonts(self):
-        """Get list of installed fonts"""
+        """Get list of installed fonts (từ chỉ mục font đã cache, không quét registry)"""
+        # Danh sách font mặc định
+        default_fonts = ["Arial", "Times New Roman", "Calibri", "Verdana", "Tahoma"]
         try:
-            import winreg
-            import os
-
-            # Danh sách font mặc định
-            default_fonts = ["Arial", "Times New Roman", "Calibri", "Verdana", "Tahoma"]
-
-            # Đường dẫn registry chứa font
-            font_paths = [
-                (winreg.HKEY_LOCAL_MACHINE, r'SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts'),
-                (winreg.HKEY_LOCAL_MACHINE, r'SOFTWARE\Microsoft\Windows\CurrentVersion\Fonts'),
-                (winreg.HKEY_CURRENT_USER, r'SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts'),
-                (winreg.HKEY_CURRENT_USER, r'SOFTWARE\Microsoft\Windows\CurrentVersion\Fonts')
-            ]
-
-            installed_fonts = set()
-
-            for hkey, path in font_paths:
-                try:
-                    # Mở registry key
-                    key = winreg.OpenKey(hkey, path)
-                    
-                    # Đếm số lượng giá trị trong key
-                    num_values = winreg.QueryInfoKey(key)[1]
-                    
-                    # Lặp qua các giá trị
-                    for i in range(num_values):
-                        try:
-                            name, data, _ = winreg.EnumValue(key, i)
-                            # Loại bỏ phần mở rộng và (TrueType)
-                            clean_name = name.replace(' (TrueType)', '').replace(' (OpenType)', '').replace(' (Italic)', '')
-                            installed_fonts.add(clean_name)
-                        except Exception as e:
-                            logging.debug(f"Error reading font registry value: {e}")
-                    
-                    winreg.CloseKey(key)
-                except FileNotFoundError:
-                    logging.debug(f"Font registry path not found: {path}")
-                except PermissionError:
-                    logging.debug(f"Permission denied for registry path: {path}")
-                except Exception as e:
-                    logging.debug(f"Error accessing font registry path {path}: {e}")
-
-            # Thêm một số font phổ biến khác
-            additional_fonts = [
-                "Segoe UI", "Microsoft Sans Serif", "Consolas", 
-                "Courier New", "Georgia", "Palatino Linotype"
-            ]
-            
-            # Kết hợp font mặc định, font từ hệ thống và font bổ sung
-            all_fonts = list(set(default_fonts + list(installed_fonts) + additional_fonts))
-            
-            return sorted(all_fonts)
-
+            installed_fonts = FontManager.get_font_names()
+            return sorted(set(installed_fonts) | set(default_fonts), key=str.lower)
         except Exception as e:
             logging.error(f"Unexpected error getting system fonts: {e}")
             return default_fonts
@@ -553,15 +539,26 @@ class VideoMakerGUI:
             overlay1_path = Path(self.overlay1_path.get()) if self.overlay1_path.get() else None
             overlay2_path = Path(self.overlay2_path.get()) if self.overlay2_path.get() else None
 
+            # Draft options
+            draft = self.draft_var.get()
+            draft_duration = None
+            if draft and self.draft_duration_var.get().strip():
+                if not self.validate_numeric_value(self.draft_duration_var.get(), 1, 3600, allow_float=True):
+                    messagebox.showerror("Error", "Draft duration must be between 1 and 3600 seconds")
+                    return
+                draft_duration = float(self.draft_duration_var.get())
+
             # Step 4: Process video with progress updates
-            messagebox.showinfo("Processing", "Starting video processing...")
+            messagebox.showinfo("Processing", "Starting draft render..." if draft else "Starting video processing...")
             
             output_path = self.video_processor.process_video(
                 audio_path,
                 subtitle_path,
                 overlay1_path,
                 overlay2_path,
-                config
+                config,
+                draft=draft,
+                draft_duration=draft_duration
             )
 
             # Step 5: Show success message with output path
@@ -572,6 +569,50 @@ class VideoMakerGUI:
             logging.error(f"Error in processing: {error_msg}")
             messagebox.showerror("Error", f"Failed to process video: {error_msg}")
 
+    def preview_subtitle(self):
+        """Render 1 frame xem thử subtitle với cài đặt hiện tại"""
+        try:
+            config = self.get_subtitle_config()
+            if not config:
+                return
+
+            subtitle_file = self.subtitle_path.get().strip()
+            sample_text = self.preview_text_var.get().strip()
+            if not subtitle_file and not sample_text:
+                messagebox.showerror("Error", "Please select a subtitle file or enter a sample line")
+                return
+            try:
+                timestamp = float(self.preview_time_var.get() or 0)
+            except ValueError:
+                messagebox.showerror("Error", "Preview time must be a number of seconds")
+                return
+
+            preview_path = self.subtitle_preview.render(
+                config,
+                text=None if subtitle_file else sample_text,
+                subtitle_path=Path(subtitle_file) if subtitle_file else None,
+                timestamp=timestamp,
+                is_vertical=False
+            )
+            self.show_preview_image(preview_path)
+
+        except Exception as e:
+            logging.error(f"Error rendering subtitle preview: {str(e)}")
+            messagebox.showerror("Error", f"Failed to render preview: {str(e)}")
+
+    def show_preview_image(self, image_path: Path):
+        """Hiển thị ảnh preview trong cửa sổ riêng"""
+        window = tk.Toplevel(self.root)
+        window.title(f"Subtitle Preview - {Path(image_path).name[:12]}")
+        image = tk.PhotoImage(file=str(image_path))
+        # Thu nhỏ để vừa màn hình (1920x1080 -> 960x540, 1080x1920 -> 360x640)
+        factor = max(1, -(-max(image.width(), image.height()) // 960))
+        if factor > 1:
+            image = image.subsample(factor)
+        label = ttk.Label(window, image=image)
+        label.image = image  # Giữ reference để Tk không giải phóng ảnh
+        label.pack(padx=5, pady=5)
+
     def init_settings_manager(self):
         """Khởi tạo settings manager và load presets"""
         self.settings_manager = SettingsManager(Path(os.getcwd()))
@@ -670,7 +711,8 @@ class VideoMakerGUI:
             # Process videos
             segments = self.video_cutter.process_raw_videos(
                 min_duration=min_duration,
-                max_duration=max_duration
+                max_duration=max_duration,
+                include_vertical=self.include_vertical_var.get()
             )
             
             # Refresh counts
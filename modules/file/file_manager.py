@@ -163,6 +163,28 @@ class FileManager:
         """Tạo đường dẫn file tạm với tên ngẫu nhiên"""
         return self.temp_dir / f"{uuid.uuid4()}{suffix}"
 
+    async def save_upload(self, upload_file, folder: str = "temp") -> Path:
+        """
+        Lưu file upload (FastAPI UploadFile) vào thư mục của FileManager
+        Args:
+            upload_file: UploadFile
+            folder: Tên thư mục đích (temp, final, ...)
+        Returns:
+            Path: Đường dẫn file đã lưu (tên ngẫu nhiên, giữ phần mở rộng)
+        """
+        target_dir = self.paths.get(folder, self.base_path / folder)
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        suffix = Path(upload_file.filename or "").suffix
+        target_path = target_dir / f"{uuid.uuid4()}{suffix}"
+        with open(target_path, 'wb') as f:
+            while True:
+                chunk = await upload_file.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+        return target_path
+
     def get_files_by_extension(self, directory: Path, extension: str) -> List[Path]:
         """
         Get all files with specified extension in a directory
@@ -0,0 +1,219 @@
+import os
+import queue
+import logging
+import threading
+import contextvars
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from api.core.config import Settings
+from .cancellation import TaskCancelledError, raise_if_cancelled
+
+# Cấu hình mặc định, ghi đè bằng common.batch trong config/settings.json
+DEFAULT_BATCH_SETTINGS = {
+    # Số nhóm render cùng lúc trong 1 batch; "auto" = theo số CPU.
+    # Mỗi render worker process chạy batch riêng, tổng số ffmpeg = workers x concurrency
+    "concurrency": "auto",
+    # Số thread chuẩn bị (probe, normalize audio, SRT->ASS, cắt nền stream-copy)
+    "prepare_workers": 2,
+    # Số nhóm đã chuẩn bị xong được xếp hàng chờ encode; "auto" = bằng concurrency
+    "prepare_ahead": "auto"
+}
+
+# ffmpeg tự dùng nhiều thread cho 1 lần encode, "auto" chỉ chạy 1 nhóm cho mỗi N core
+CORES_PER_GROUP = 4
+MAX_AUTO_CONCURRENCY = 4
+
+def get_batch_settings() -> Dict:
+    """Cấu hình batch (common.batch)"""
+    batch_settings = dict(DEFAULT_BATCH_SETTINGS)
+    try:
+        batch_settings.update(Settings().get_common_settings().get("batch", {}))
+    except Exception as e:
+        logging.error(f"Error loading batch settings: {e}")
+    return batch_settings
+
+def _setting_int(value, default: int) -> int:
+    """Giá trị int >= 1 của 1 setting, "auto"/không hợp lệ thì dùng default"""
+    if value in (None, "", "auto"):
+        return default
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        logging.warning(f"Invalid batch setting {value!r}, using {default}")
+        return default
+
+def batch_concurrency(concurrency=None) -> int:
+    """
+    Số nhóm render song song
+    Args:
+        concurrency: Giá trị ghi đè (int hoặc "auto"), mặc định lấy từ settings
+    Returns:
+        int: >= 1
+    """
+    value = concurrency if concurrency is not None else get_batch_settings()["concurrency"]
+    auto = max(1, min(MAX_AUTO_CONCURRENCY, (os.cpu_count() or 1) // CORES_PER_GROUP))
+    return _setting_int(value, auto)
+
+class BatchResult:
+    """Kết quả xử lý 1 item của batch"""
+
+    def __init__(self, index: int, item: Any, value: Any = None, error: Optional[BaseException] = None):
+        self.index = index
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+class StagedBatchExecutor:
+    """
+    Batch 2 tầng: chuẩn bị (I/O, rẻ) -> hàng đợi có giới hạn -> encode (CPU/GPU)
+
+    Các thread chuẩn bị chạy trước, đẩy nhóm đã chuẩn bị vào hàng đợi; encoder lấy
+    ra encode ngay nên không phải chờ probe/normalize/cắt nền của nhóm kế tiếp.
+    Hàng đợi đầy thì thread chuẩn bị dừng lại chờ, giới hạn số workspace (dung lượng
+    temp/scratch) của các nhóm đã chuẩn bị mà chưa encode.
+
+    Mỗi item có 1 bản sao context và 1 ExitStack riêng đi qua cả 2 tầng: prepare()
+    gắn workspace, tracker tiến độ, ... vào stack, stack được đóng (trong context
+    của item) sau khi encode xong, lỗi hoặc bị hủy.
+    """
+
+    def __init__(self, encode_workers=None, prepare_workers=None, queue_size=None, name: str = "batch"):
+        """
+        Args:
+            encode_workers: Số item encode cùng lúc, mặc định common.batch.concurrency
+            prepare_workers: Số thread chuẩn bị, mặc định common.batch.prepare_workers
+            queue_size: Số item đã chuẩn bị chờ encode, mặc định common.batch.prepare_ahead
+            name: Tiền tố tên thread
+        """
+        settings = get_batch_settings()
+        self.encode_workers = batch_concurrency(encode_workers)
+        self.prepare_workers = _setting_int(
+            prepare_workers if prepare_workers is not None else settings["prepare_workers"], 2
+        )
+        self.queue_size = _setting_int(
+            queue_size if queue_size is not None else settings["prepare_ahead"], self.encode_workers
+        )
+        self.name = name
+
+    def run(
+        self,
+        items: Sequence[Any],
+        prepare: Callable[[int, Any, ExitStack], Any],
+        encode: Callable[[int, Any, Any], Any],
+        on_done: Optional[Callable[[BatchResult], None]] = None
+    ) -> List[BatchResult]:
+        """
+        Chạy prepare(index, item, stack) rồi encode(index, item, prepared) cho từng item
+        Args:
+            items: Danh sách item
+            prepare: Bước chuẩn bị, giá trị trả về được truyền cho encode
+            encode: Bước encode, giá trị trả về nằm trong BatchResult.value
+            on_done: Gọi (trên thread gọi run, lần lượt) mỗi khi 1 item xong
+        Returns:
+            List[BatchResult]: Kết quả theo thứ tự items
+        """
+        todo: "queue.Queue" = queue.Queue()
+        for index, item in enumerate(items):
+            todo.put((index, item))
+        ready: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        finished: "queue.Queue" = queue.Queue()
+
+        encoders = [
+            threading.Thread(
+                target=self._encode_loop,
+                args=(ready, finished, encode),
+                name=f"{self.name}-encode-{i}",
+                daemon=True
+            )
+            for i in range(min(self.encode_workers, len(items)))
+        ]
+        threads = [
+            # Thread chạy trong bản sao context của thread gọi run (token hủy, tracker, ...)
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._prepare_loop, todo, ready, finished, prepare),
+                name=f"{self.name}-prepare-{i}",
+                daemon=True
+            )
+            for i in range(min(self.prepare_workers, len(items)))
+        ] + encoders
+        for thread in threads:
+            thread.start()
+
+        results: List[Optional[BatchResult]] = [None] * len(items)
+        cancelled = False
+        try:
+            for _ in range(len(items)):
+                result = finished.get()
+                results[result.index] = result
+                if isinstance(result.error, TaskCancelledError):
+                    cancelled = True
+                    continue
+                if on_done:
+                    try:
+                        on_done(result)
+                    except Exception as e:
+                        logging.error(f"Batch callback failed for item {result.index}: {e}")
+        finally:
+            # Mọi item đã xong => hàng đợi rỗng, báo encoder dừng
+            for _ in encoders:
+                ready.put(None)
+            for thread in threads:
+                thread.join()
+
+        if cancelled:
+            raise TaskCancelledError("Task cancelled")
+        return [result for result in results if result is not None]
+
+    def _prepare_loop(self, todo: "queue.Queue", ready: "queue.Queue", finished: "queue.Queue",
+                      prepare: Callable[[int, Any, ExitStack], Any]):
+        while True:
+            try:
+                index, item = todo.get_nowait()
+            except queue.Empty:
+                return
+            context = contextvars.copy_context()
+            stack = ExitStack()
+            try:
+                prepared = context.run(self._prepare_item, prepare, index, item, stack)
+            except Exception as e:
+                self._close(context, stack, index)
+                finished.put(BatchResult(index, item, error=e))
+                continue
+            # Hàng đợi đầy: chờ encoder lấy bớt (giới hạn số nhóm chuẩn bị trước)
+            ready.put((index, item, context, stack, prepared))
+
+    @staticmethod
+    def _prepare_item(prepare: Callable[[int, Any, ExitStack], Any], index: int, item: Any, stack: ExitStack):
+        raise_if_cancelled()
+        return prepare(index, item, stack)
+
+    def _encode_loop(self, ready: "queue.Queue", finished: "queue.Queue", encode: Callable[[int, Any, Any], Any]):
+        while True:
+            entry = ready.get()
+            if entry is None:
+                return
+            index, item, context, stack, prepared = entry
+            try:
+                value = context.run(self._encode_item, encode, index, item, prepared)
+                result = BatchResult(index, item, value=value)
+            except Exception as e:
+                result = BatchResult(index, item, error=e)
+            self._close(context, stack, index)
+            finished.put(result)
+
+    @staticmethod
+    def _encode_item(encode: Callable[[int, Any, Any], Any], index: int, item: Any, prepared: Any):
+        raise_if_cancelled()
+        return encode(index, item, prepared)
+
+    @staticmethod
+    def _close(context: contextvars.Context, stack: ExitStack, index: int):
+        try:
+            context.run(stack.close)
+        except Exception as e:
+            logging.error(f"Error cleaning up batch item {index}: {e}")
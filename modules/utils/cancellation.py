@@ -0,0 +1,96 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Token hủy của job đang chạy trong context hiện tại (ffmpeg runner đọc từ đây)
+_current_token: ContextVar[Optional["CancelToken"]] = ContextVar("cancel_token", default=None)
+
+class TaskCancelledError(Exception):
+    """Task đã bị hủy, dừng xử lý ngay (không retry, không đánh dấu lỗi)"""
+
+def get_cancel_token() -> Optional["CancelToken"]:
+    """Token hủy của job hiện tại, None nếu code không chạy trong job nào"""
+    return _current_token.get()
+
+def raise_if_cancelled():
+    """Raise TaskCancelledError nếu job hiện tại đã bị hủy"""
+    token = get_cancel_token()
+    if token:
+        token.raise_if_cancelled()
+
+def sleep_unless_cancelled(seconds: float, interval: float = 0.5):
+    """Chờ seconds giây (vd. backoff trước khi thử lại), raise TaskCancelledError ngay khi job bị hủy"""
+    deadline = time.monotonic() + seconds
+    while True:
+        raise_if_cancelled()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(interval, remaining))
+
+class CancelToken:
+    """Cờ hủy dùng chung giữa người hủy (nút Cancel, API) và code đang render"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.is_cancelled():
+            raise TaskCancelledError("Task cancelled")
+
+    @contextmanager
+    def activate(self):
+        """Gắn token vào context hiện tại trong lúc chạy job"""
+        token = _current_token.set(self)
+        try:
+            yield self
+        finally:
+            _current_token.reset(token)
+
+class TaskCancelToken(CancelToken):
+    """
+    Token theo dõi status 'cancelled' của task trong TaskHistoryManager
+
+    API hủy task bằng cách ghi status vào DB; render worker (process khác) đọc lại
+    status tối đa 1 lần mỗi CHECK_INTERVAL giây nên kiểm tra thường xuyên vẫn rẻ.
+    """
+
+    # Khoảng cách tối thiểu giữa 2 lần đọc status từ DB (giây)
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, task_id: str, task_history):
+        """
+        Args:
+            task_id: ID của task
+            task_history: TaskHistoryManager chứa status của task
+        """
+        super().__init__()
+        self.task_id = task_id
+        self.task_history = task_history
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def is_cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_check < self.CHECK_INTERVAL:
+                return False
+            self._last_check = now
+        try:
+            if self.task_history.get_task(self.task_id).get('status') == 'cancelled':
+                logging.info(f"Task {self.task_id} was cancelled")
+                self._event.set()
+        except Exception as e:
+            logging.debug(f"Could not check cancellation of task {self.task_id}: {e}")
+        return self._event.is_set()
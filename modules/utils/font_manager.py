@@ -1,51 +1,420 @@
 import os
-import winreg
+import re
+import sys
+import json
+import shutil
+import struct
+import hashlib
 import logging
+import subprocess
+import threading
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from xml.sax.saxutils import escape as xml_escape
+from api.core.paths import path_manager
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc', '.otc')
+REGULAR_STYLES = ('regular', 'normal', 'book', 'roman', '')
+
+# Registry keys chứa danh sách font trên Windows
+WINDOWS_FONT_KEYS = [
+    ('HKEY_LOCAL_MACHINE', r'SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts'),
+    ('HKEY_LOCAL_MACHINE', r'SOFTWARE\Microsoft\Windows\CurrentVersion\Fonts'),
+    ('HKEY_CURRENT_USER', r'SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts'),
+    ('HKEY_CURRENT_USER', r'SOFTWARE\Microsoft\Windows\CurrentVersion\Fonts')
+]
+
+_FONT_SUFFIX_RE = re.compile(r'\s*\((TrueType|OpenType|Italic|All res)\)\s*$', re.IGNORECASE)
+_STYLE_FORMAT_RE = re.compile(r'^Format:\s*(.*)$', re.IGNORECASE)
+
+class FontIndex:
+    """
+    Chỉ mục font của máy: tên font -> đường dẫn file
+
+    Quét một lần (Windows: registry + thư mục Fonts; Linux/macOS: fc-list hoặc
+    ~/.fonts, /usr/share/fonts, ...), lưu ra đĩa và chỉ quét lại khi mtime
+    của các thư mục font thay đổi. Tra cứu không phân biệt hoa thường trong O(1),
+    kể cả tra theo family (bảng family -> file dựng 1 lần khi nạp chỉ mục).
+    """
+
+    # Tăng khi đổi cách quét để bỏ cache cũ
+    CACHE_VERSION = 1
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        """
+        Args:
+            cache_dir: Thư mục cache, mặc định là <base_path>/cache/fonts
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else path_manager.get_path("common", "cache") / "fonts"
+        self.cache_file = self.cache_dir / "font_index.json"
+        self.sets_dir = self.cache_dir / "sets"
+        self._fonts: Optional[Dict[str, str]] = None
+        self._lower: Dict[str, str] = {}
+        self._families: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def font_dirs() -> List[Path]:
+        """Các thư mục font của hệ điều hành hiện tại"""
+        if sys.platform == 'win32':
+            dirs = [Path(os.environ.get('WINDIR', r'C:\Windows')) / 'Fonts']
+            if os.environ.get('LOCALAPPDATA'):
+                dirs.append(Path(os.environ['LOCALAPPDATA']) / 'Microsoft' / 'Windows' / 'Fonts')
+        elif sys.platform == 'darwin':
+            dirs = [Path('/System/Library/Fonts'), Path('/Library/Fonts'), Path.home() / 'Library' / 'Fonts']
+        else:
+            dirs = [
+                Path('/usr/share/fonts'), Path('/usr/local/share/fonts'),
+                Path.home() / '.fonts', Path.home() / '.local' / 'share' / 'fonts'
+            ]
+        return [d for d in dirs if d.is_dir()]
+
+    def _signature(self) -> Dict[str, float]:
+        """mtime của các thư mục font (và registry trên Windows) để biết khi nào cần quét lại"""
+        signature = {}
+        for folder in self.font_dirs():
+            try:
+                signature[str(folder)] = folder.stat().st_mtime
+                # Font thường nằm trong thư mục con (Linux), lấy cả mtime cấp 1
+                for child in folder.iterdir():
+                    if child.is_dir():
+                        signature[str(child)] = child.stat().st_mtime
+            except OSError:
+                continue
+        if sys.platform == 'win32':
+            try:
+                import winreg
+                for hkey_name, key_path in WINDOWS_FONT_KEYS:
+                    try:
+                        with winreg.OpenKey(getattr(winreg, hkey_name), key_path) as key:
+                            signature[f"{hkey_name}\\{key_path}"] = winreg.QueryInfoKey(key)[2]
+                    except OSError:
+                        continue
+            except ImportError:
+                pass
+        return signature
+
+    def _scan_windows_registry(self, fonts: Dict[str, str]):
+        """Đọc font từ registry Windows"""
+        import winreg
+        default_dir = Path(os.environ.get('WINDIR', r'C:\Windows')) / 'Fonts'
+        for hkey_name, key_path in WINDOWS_FONT_KEYS:
+            try:
+                with winreg.OpenKey(getattr(winreg, hkey_name), key_path) as key:
+                    for i in range(winreg.QueryInfoKey(key)[1]):
+                        try:
+                            name, value, _ = winreg.EnumValue(key, i)
+                        except OSError:
+                            continue
+                        if not isinstance(value, str):
+                            continue
+                        path = value if os.path.isabs(value) else str(default_dir / value)
+                        if not os.path.exists(path):
+                            continue
+                        # "Arial Bold (TrueType)" -> "Arial Bold"; "Cambria & Cambria Math" -> cả 2 tên
+                        for font_name in _FONT_SUFFIX_RE.sub('', name).split(' & '):
+                            fonts.setdefault(font_name.strip(), path)
+            except OSError as e:
+                logging.debug(f"Font registry path not readable: {key_path}: {e}")
+
+    @staticmethod
+    def _scan_fontconfig(fonts: Dict[str, str]) -> bool:
+        """Đọc font từ fc-list (Linux/macOS có fontconfig)"""
+        if not shutil.which('fc-list'):
+            return False
+        try:
+            result = subprocess.run(
+                ['fc-list', '--format', '%{family}\t%{style}\t%{file}\n'],
+                capture_output=True, text=True, timeout=60
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.warning(f"fc-list failed: {e}")
+            return False
+        if result.returncode != 0:
+            return False
+        for line in result.stdout.splitlines():
+            parts = line.split('\t')
+            if len(parts) != 3:
+                continue
+            families, styles, path = parts
+            style = styles.split(',')[0].strip()
+            for family in families.split(','):
+                family = family.strip()
+                if not family:
+                    continue
+                # Regular giữ tên family, các style khác thêm "Family Style"
+                if style.lower() in REGULAR_STYLES:
+                    fonts[family] = path
+                else:
+                    fonts.setdefault(family, path)
+                    fonts.setdefault(f"{family} {style}", path)
+        return True
+
+    @staticmethod
+    def _read_name_table(path: Path) -> Tuple[Optional[str], Optional[str]]:
+        """Đọc (family, style) từ bảng 'name' của file TrueType/OpenType (font đầu tiên nếu là .ttc)"""
+        with open(path, 'rb') as f:
+            data = f.read(12)
+            offset = 0
+            if data[:4] == b'ttcf':
+                f.seek(12)
+                offset = struct.unpack('>I', f.read(4))[0]
+                f.seek(offset)
+                data = f.read(12)
+            num_tables = struct.unpack('>H', data[4:6])[0]
+            f.seek(offset + 12)
+            directory = f.read(16 * num_tables)
+            for i in range(num_tables):
+                tag, _, table_offset, length = struct.unpack('>4sIII', directory[i * 16:(i + 1) * 16])
+                if tag == b'name':
+                    f.seek(table_offset)
+                    table = f.read(length)
+                    break
+            else:
+                return None, None
+
+        _, count, string_offset = struct.unpack('>HHH', table[:6])
+        names = {}
+        for i in range(count):
+            platform_id, _, language_id, name_id, length, offset = struct.unpack('>HHHHHH', table[6 + i * 12:18 + i * 12])
+            if name_id not in (1, 2):
+                continue
+            raw = table[string_offset + offset:string_offset + offset + length]
+            if platform_id in (0, 3):
+                # Ưu tiên tên tiếng Anh (0x409) của Windows
+                if name_id in names and language_id != 0x409:
+                    continue
+                names[name_id] = raw.decode('utf-16-be', errors='replace')
+            elif platform_id == 1 and name_id not in names:
+                names[name_id] = raw.decode('mac_roman', errors='replace')
+        return names.get(1), names.get(2)
+
+    @staticmethod
+    def _font_file_names(path: Path) -> List[str]:
+        """Tên family (và family + style) đọc từ file font, fallback là tên file"""
+        try:
+            family, style = FontIndex._read_name_table(path)
+            if family:
+                names = [family]
+                if style and style.lower() not in REGULAR_STYLES:
+                    names.append(f"{family} {style}")
+                return names
+        except Exception as e:
+            logging.debug(f"Could not read font names from {path}: {e}")
+        return [path.stem]
+
+    def _scan_dirs(self, fonts: Dict[str, str]):
+        """Quét file font trong các thư mục font"""
+        for folder in self.font_dirs():
+            for root, _, files in os.walk(folder):
+                for file_name in files:
+                    if not file_name.lower().endswith(FONT_EXTENSIONS):
+                        continue
+                    path = Path(root) / file_name
+                    names = self._font_file_names(path)
+                    # File regular (chỉ có tên family) được ưu tiên cho tên family
+                    if len(names) == 1:
+                        fonts[names[0]] = str(path)
+                    else:
+                        for font_name in names:
+                            fonts.setdefault(font_name, str(path))
+
+    def scan(self) -> Dict[str, str]:
+        """
+        Quét toàn bộ font của máy
+        Returns:
+            dict: {tên font: đường dẫn file}
+        """
+        fonts: Dict[str, str] = {}
+        if sys.platform == 'win32':
+            try:
+                self._scan_windows_registry(fonts)
+            except ImportError:
+                pass
+            self._scan_dirs(fonts)
+        elif not self._scan_fontconfig(fonts):
+            self._scan_dirs(fonts)
+        logging.info(f"Indexed {len(fonts)} fonts")
+        return fonts
+
+    def _load(self):
+        """Nạp chỉ mục từ cache trên đĩa, quét lại nếu thư mục font đã thay đổi"""
+        signature = self._signature()
+        fonts = None
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if cached.get("version") == self.CACHE_VERSION and cached.get("signature") == signature:
+                    fonts = cached.get("fonts", {})
+            except Exception as e:
+                logging.warning(f"Invalid font index cache {self.cache_file}: {e}")
+
+        if fonts is None:
+            fonts = self.scan()
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({"version": self.CACHE_VERSION, "signature": signature, "fonts": fonts},
+                              f, ensure_ascii=False)
+                os.replace(tmp_path, self.cache_file)
+            except OSError as e:
+                logging.warning(f"Could not save font index cache: {e}")
+
+        self._fonts = fonts
+        self._lower = {name.lower(): path for name, path in fonts.items()}
+        self._families = self._build_families(self._lower)
+
+    @staticmethod
+    def _build_families(lower: Dict[str, str]) -> Dict[str, List[str]]:
+        """
+        family -> các file của family đó (font chính + biến thể)
+        'arial bold italic' thuộc các family 'arial', 'arial bold', 'arial bold italic'
+        """
+        families: Dict[str, List[str]] = {}
+        for name, path in lower.items():
+            words = name.split(' ')
+            for count in range(1, len(words) + 1):
+                files = families.setdefault(' '.join(words[:count]), [])
+                if path not in files:
+                    files.append(path)
+        return families
+
+    def fonts(self) -> Dict[str, str]:
+        """Toàn bộ chỉ mục {tên font: đường dẫn}"""
+        with self._lock:
+            if self._fonts is None:
+                self._load()
+            return self._fonts
+
+    def refresh(self):
+        """Bỏ chỉ mục trong bộ nhớ, lần tra tiếp theo sẽ kiểm tra lại đĩa"""
+        with self._lock:
+            self._fonts = None
+            self._lower = {}
+            self._families = {}
+
+    def resolve(self, font_name: str) -> Optional[str]:
+        """Đường dẫn file của font (không phân biệt hoa thường), None nếu không có"""
+        if not font_name:
+            return None
+        self.fonts()
+        return self._lower.get(font_name.strip().lower())
+
+    def font_files(self, font_name: str) -> List[str]:
+        """Các file của một family: font chính + các biến thể (Bold, Italic, ...)"""
+        self.fonts()
+        return list(self._families.get(font_name.strip().lower(), []))
+
+    def get_fontsdir(self, font_names: Iterable[str]) -> Optional[Path]:
+        """
+        Thư mục chỉ chứa các font cần dùng, để truyền cho libass (fontsdir)
+        Thư mục được đặt theo hash tập file nên các job dùng cùng font sẽ dùng chung.
+        Args:
+            font_names: Tên các font được dùng trong file ASS
+        Returns:
+            Path: Thư mục font, None nếu không tìm thấy font nào
+        """
+        files = []
+        for font_name in font_names:
+            for path in self.font_files(font_name):
+                if path not in files:
+                    files.append(path)
+        if not files:
+            return None
+
+        set_key = hashlib.sha256("\n".join(sorted(files)).encode('utf-8')).hexdigest()[:16]
+        fonts_dir = self.sets_dir / set_key
+        done_marker = fonts_dir / ".complete"
+        if done_marker.exists():
+            self._write_fontconfig(fonts_dir)
+            return fonts_dir
+
+        fonts_dir.mkdir(parents=True, exist_ok=True)
+        for path in files:
+            target = fonts_dir / Path(path).name
+            if target.exists():
+                continue
+            try:
+                os.link(path, target)
+            except OSError:
+                try:
+                    shutil.copy2(path, target)
+                except OSError as e:
+                    logging.warning(f"Could not copy font {path}: {e}")
+        self._write_fontconfig(fonts_dir)
+        done_marker.touch()
+        logging.info(f"Prepared fontsdir {fonts_dir} with {len(files)} font files")
+        return fonts_dir
+
+    def _write_fontconfig(self, fonts_dir: Path) -> Path:
+        """fonts.conf chỉ khai báo fonts_dir (cache fontconfig riêng trong sets/.fccache)"""
+        conf_path = fonts_dir / "fonts.conf"
+        if conf_path.exists():
+            return conf_path
+        content = (
+            '<?xml version="1.0"?>\n'
+            '<!DOCTYPE fontconfig SYSTEM "fonts.dtd">\n'
+            '<fontconfig>\n'
+            f'  <dir>{xml_escape(fonts_dir.resolve().as_posix())}</dir>\n'
+            f'  <cachedir>{xml_escape((self.sets_dir / ".fccache").resolve().as_posix())}</cachedir>\n'
+            '</fontconfig>\n'
+        )
+        tmp_path = conf_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, conf_path)
+        return conf_path
+
+    def fontconfig_env(self, font_names: Iterable[str]) -> Optional[Dict[str, str]]:
+        """
+        Môi trường cho ffmpeg để fontconfig (libass) chỉ nạp fontsdir thay vì đọc
+        cấu hình và cache font của cả máy khi khởi động.
+        Filter ass không có tùy chọn tắt fontconfig nên phải đổi FONTCONFIG_FILE.
+        Chỉ dùng khi tìm thấy mọi font trong file ASS: fontconfig rút gọn không còn
+        font dự phòng của hệ thống cho font/glyph thiếu.
+        Args:
+            font_names: Tên các font được dùng trong file ASS
+        Returns:
+            dict: {"FONTCONFIG_FILE": ...}, None nếu phải dùng fontconfig mặc định
+        """
+        font_names = [name for name in font_names if name]
+        if not font_names or any(not self.font_files(name) for name in font_names):
+            return None
+        fonts_dir = self.get_fontsdir(font_names)
+        if not fonts_dir:
+            return None
+        conf_path = fonts_dir / "fonts.conf"
+        if not conf_path.exists():
+            return None
+        return {"FONTCONFIG_FILE": str(conf_path.resolve())}
+
+# Instance dùng chung cho cả process
+font_index = FontIndex()
 
 class FontManager:
     @staticmethod
     def get_windows_fonts():
         """
-        Lấy danh sách font từ Windows Registry và thư mục Fonts
+        Lấy danh sách font của máy (giữ tên cũ, chạy được cả trên Linux/macOS)
         Returns:
             dict: Dictionary chứa tên font và đường dẫn tương ứng
         """
-        fonts_dict = {}
         try:
-            # Lấy fonts từ Registry
-            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts") as key:
-                try:
-                    i = 0
-                    while True:
-                        name, value, _ = winreg.EnumValue(key, i)
-                        # Bỏ phần "(TrueType)" hoặc tương tự từ tên
-                        font_name = name.split(' (')[0]
-                        
-                        # Xử lý đường dẫn font
-                        if not os.path.isabs(value):
-                            value = os.path.join(r'C:\Windows\Fonts', value)
-                            
-                        if os.path.exists(value):
-                            fonts_dict[font_name] = value
-                        i += 1
-                except WindowsError:
-                    pass
-
-            # Thêm fonts từ thư mục User Fonts
-            user_fonts_dir = os.path.join(os.environ['LOCALAPPDATA'], 'Microsoft', 'Windows', 'Fonts')
-            if os.path.exists(user_fonts_dir):
-                for font_file in os.listdir(user_fonts_dir):
-                    if font_file.lower().endswith(('.ttf', '.otf')):
-                        font_path = os.path.join(user_fonts_dir, font_file)
-                        font_name = os.path.splitext(font_file)[0]
-                        fonts_dict[font_name] = font_path
-
-            return fonts_dict
+            return dict(font_index.fonts())
+        except Exception as e:
+            logging.error(f"Lỗi khi lấy danh sách font: {e}")
+            return {}
 
+    @staticmethod
+    def get_font_names() -> List[str]:
+        """Danh sách tên font đã sắp xếp (dùng cho combobox trong GUI)"""
+        try:
+            return sorted(font_index.fonts().keys(), key=str.lower)
         except Exception as e:
             logging.error(f"Lỗi khi lấy danh sách font: {e}")
-            return {'Arial': os.path.join(r'C:\Windows\Fonts', 'arial.ttf')}
+            return []
 
     @staticmethod
     def get_font_path(font_name):
@@ -61,27 +430,17 @@ class FontManager:
             if os.path.exists(font_name):
                 path = font_name
             else:
-                # Lấy mapping font từ Registry
-                fonts = FontManager.get_windows_fonts()
-                path = fonts.get(font_name)
-                
-                # Nếu không tìm thấy, thử tìm không phân biệt hoa thường
-                if not path:
-                    font_name_lower = font_name.lower()
-                    for name, font_path in fonts.items():
-                        if name.lower() == font_name_lower:
-                            path = font_path
-                            break
-                
-                # Nếu vẫn không tìm thấy, dùng Arial
+                path = font_index.resolve(font_name)
+
+                # Nếu không tìm thấy, dùng Arial
                 if not path:
                     logging.warning(f"Không tìm thấy font {font_name}, sử dụng Arial")
-                    path = fonts.get('Arial', os.path.join(r'C:\Windows\Fonts', 'arial.ttf'))
+                    path = font_index.resolve('Arial') or os.path.join(r'C:\Windows\Fonts', 'arial.ttf')
 
             # Thêm dấu nháy kép nếu đường dẫn có khoảng trắng
             if ' ' in path:
                 path = f'"{path}"'
-            
+
             return path
 
         except Exception as e:
@@ -98,8 +457,63 @@ class FontManager:
             bool: True nếu font tồn tại, False nếu không
         """
         try:
-            fonts = FontManager.get_windows_fonts()
-            return font_name in fonts or any(name.lower() == font_name.lower() for name in fonts)
+            return font_index.resolve(font_name) is not None
         except Exception as e:
             logging.error(f"Lỗi khi kiểm tra font: {e}")
             return False
+
+    @staticmethod
+    def get_ass_fonts(ass_path) -> List[str]:
+        """
+        Tên các font dùng trong phần [V4+ Styles] của file ASS
+        Args:
+            ass_path: Đường dẫn file ASS
+        Returns:
+            list: Tên font (không trùng)
+        """
+        names = []
+        fontname_index = 1
+        in_styles = False
+        try:
+            with open(ass_path, 'r', encoding='utf-8-sig', errors='replace') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('['):
+                        if in_styles:
+                            break  # Hết phần style, không đọc phần events
+                        in_styles = line.lower() in ('[v4+ styles]', '[v4 styles]')
+                        continue
+                    if not in_styles:
+                        continue
+                    format_match = _STYLE_FORMAT_RE.match(line)
+                    if format_match:
+                        fields = [field.strip().lower() for field in format_match.group(1).split(',')]
+                        if 'fontname' in fields:
+                            fontname_index = fields.index('fontname')
+                    elif line.lower().startswith('style:'):
+                        values = line[len('style:'):].split(',')
+                        if len(values) > fontname_index:
+                            font_name = values[fontname_index].strip().lstrip('@')
+                            if font_name and font_name not in names:
+                                names.append(font_name)
+        except OSError as e:
+            logging.warning(f"Could not read fonts from {ass_path}: {e}")
+        return names
+
+    @staticmethod
+    def get_fontsdir(font_names: Iterable[str]) -> Optional[Path]:
+        """Thư mục chỉ chứa các font cần dùng cho libass, None nếu không tìm thấy font nào"""
+        try:
+            return font_index.get_fontsdir(font_names)
+        except Exception as e:
+            logging.warning(f"Could not prepare fontsdir: {e}")
+            return None
+
+    @staticmethod
+    def get_fontconfig_env(font_names: Iterable[str]) -> Optional[Dict[str, str]]:
+        """Biến môi trường để fontconfig của ffmpeg chỉ nạp fontsdir, None nếu dùng mặc định"""
+        try:
+            return font_index.fontconfig_env(font_names)
+        except Exception as e:
+            logging.warning(f"Could not prepare fontconfig file: {e}")
+            return None
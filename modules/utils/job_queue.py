@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+import psutil
+
+class JobQueue:
+    """
+    Hàng đợi job render lưu trong SQLite (sống sót qua restart)
+
+    API chỉ enqueue; các worker process claim job theo thứ tự ưu tiên rồi thời gian tạo.
+    Claim dùng transaction BEGIN IMMEDIATE nên nhiều process không lấy trùng job.
+    Job đang chạy mà worker đã chết (crash, restart) được đưa lại vào hàng đợi.
+
+    Trạng thái job: queued -> running -> done | failed | quarantined
+
+    Job lỗi permanent (file đầu vào hỏng) hoặc làm worker chết quá
+    MAX_ATTEMPTS lần bị đưa vào quarantine: không bao giờ được requeue. Dấu vân tay
+    đầu vào của nó được ghi vào bảng quarantine để lần gửi lại cùng đầu vào bị từ chối
+    ngay thay vì tốn thời gian encode.
+    """
+
+    # Job 'running' có worker chết quá N lần (crash do chính job) không được requeue nữa
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, db_path: Path):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection riêng cho từng thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                task_id TEXT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                worker_pid INTEGER,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority DESC, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_task ON jobs (task_id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS quarantine (
+                fingerprint TEXT PRIMARY KEY,
+                label TEXT,
+                stage TEXT,
+                error TEXT,
+                job_id TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+
+    def enqueue(self, kind: str, payload: Dict, task_id: Optional[str] = None, priority: int = 0) -> str:
+        """
+        Thêm job vào hàng đợi
+        Args:
+            kind: Loại job (tên handler đã đăng ký trong worker)
+            payload: Tham số của job (phải serialize được sang JSON)
+            task_id: Task tương ứng trong task history
+            priority: Job ưu tiên cao hơn được claim trước
+        Returns:
+            str: job_id
+        """
+        job_id = str(uuid.uuid4())
+        self._connect().execute(
+            "INSERT INTO jobs (job_id, task_id, kind, payload, priority, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, task_id, kind, json.dumps(payload, ensure_ascii=False, default=str), priority, time.time())
+        )
+        logging.info(f"Enqueued job {job_id} ({kind}) for task {task_id}")
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """
+        Lấy 1 job đang chờ và đánh dấu running
+        Args:
+            worker_id: ID của worker
+        Returns:
+            dict: Job (payload đã parse), None nếu hàng đợi trống
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_id = ?, worker_pid = ?, attempts = attempts + 1, "
+                "started_at = ? WHERE job_id = ?",
+                (worker_id, os.getpid(), time.time(), row["job_id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job.update(status="running", worker_id=worker_id, worker_pid=os.getpid(), attempts=job["attempts"] + 1)
+        return job
+
+    def complete(self, job_id: str):
+        """Đánh dấu job đã xong"""
+        self._connect().execute(
+            "UPDATE jobs SET status = 'done', error = NULL, finished_at = ? WHERE job_id = ?",
+            (time.time(), job_id)
+        )
+
+    def fail(self, job_id: str, error: str):
+        """Đánh dấu job lỗi"""
+        self._connect().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+            (error, time.time(), job_id)
+        )
+
+    def quarantine(self, job_id: str, error: str, fingerprint: Optional[str] = None, label: Optional[str] = None):
+        """
+        Đánh dấu job lỗi permanent (không requeue) và ghi dấu vân tay đầu vào vào quarantine
+        Args:
+            job_id: ID của job
+            error: Lỗi
+            fingerprint: Dấu vân tay đầu vào (input_fingerprint), None = chỉ đánh dấu job
+            label: Mô tả đầu vào (để hiển thị)
+        """
+        self._connect().execute(
+            "UPDATE jobs SET status = 'quarantined', error = ?, finished_at = ? WHERE job_id = ?",
+            (error, time.time(), job_id)
+        )
+        if fingerprint:
+            self.add_quarantine(fingerprint, label or job_id, error, job_id=job_id)
+        logging.warning(f"Job {job_id} quarantined: {error}")
+
+    def add_quarantine(self, fingerprint: str, label: str, error: str, stage: Optional[str] = None,
+                       job_id: Optional[str] = None):
+        """Ghi 1 bộ đầu vào lỗi permanent vào quarantine"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO quarantine (fingerprint, label, stage, error, job_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (fingerprint, label, stage, error, job_id, time.time())
+        )
+
+    def quarantined(self, fingerprint: Optional[str]) -> Optional[Dict]:
+        """Bản ghi quarantine của 1 bộ đầu vào, None nếu không bị quarantine"""
+        if not fingerprint:
+            return None
+        row = self._connect().execute(
+            "SELECT * FROM quarantine WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def list_quarantine(self) -> List[Dict]:
+        """Danh sách quarantine, mới nhất trước"""
+        rows = self._connect().execute("SELECT * FROM quarantine ORDER BY created_at DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    def release_quarantine(self, fingerprint: str) -> bool:
+        """Bỏ 1 bộ đầu vào khỏi quarantine (vd. file bị báo hỏng nhầm), trả về False nếu không có"""
+        cursor = self._connect().execute("DELETE FROM quarantine WHERE fingerprint = ?", (fingerprint,))
+        return cursor.rowcount > 0
+
+    def cancel(self, task_id: str) -> int:
+        """
+        Hủy các job chưa chạy của 1 task (job đang chạy tự dừng khi thấy task bị hủy)
+        Returns:
+            int: Số job đã hủy
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE task_id = ? AND status = 'queued'",
+            (time.time(), task_id)
+        )
+        return cursor.rowcount
+
+    def mark_cancelled(self, job_id: str):
+        """Đánh dấu job đang chạy đã dừng vì task bị hủy"""
+        self._connect().execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ?",
+            (time.time(), job_id)
+        )
+
+    def requeue_orphaned(self) -> int:
+        """
+        Đưa lại vào hàng đợi các job 'running' mà worker process không còn sống
+        Returns:
+            int: Số job đã requeue
+        """
+        conn = self._connect()
+        rows = conn.execute("SELECT job_id, worker_pid, attempts FROM jobs WHERE status = 'running'").fetchall()
+        orphaned = [row for row in rows
+                    if not row["worker_pid"] or not psutil.pid_exists(row["worker_pid"])]
+        requeued = []
+        for row in orphaned:
+            if row["attempts"] >= self.MAX_ATTEMPTS:
+                # Job làm worker chết nhiều lần: không chạy lại nữa
+                self.quarantine(row["job_id"], f"Worker died {row['attempts']} times while running this job")
+                continue
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker_id = NULL, worker_pid = NULL, started_at = NULL "
+                "WHERE job_id = ? AND status = 'running'",
+                (row["job_id"],)
+            )
+            requeued.append(row["job_id"])
+        if requeued:
+            logging.warning(f"Requeued {len(requeued)} orphaned jobs: {requeued}")
+        return len(requeued)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Thông tin 1 job"""
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        """Số job theo trạng thái"""
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def purge_finished(self, older_than_days: float = 30) -> int:
+        """Xóa job đã xong/lỗi/hủy cũ hơn N ngày"""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled', 'quarantined') AND finished_at < ?",
+            (time.time() - older_than_days * 86400,)
+        )
+        return cursor.rowcount
+
+# Số byte đầu/cuối file được hash khi lấy dấu vân tay (file lớn không phải đọc hết)
+FINGERPRINT_CHUNK = 1024 * 1024
+
+def input_fingerprint(paths: Iterable[Union[str, Path, None]], settings: Optional[Dict] = None) -> Optional[str]:
+    """
+    Dấu vân tay nội dung của 1 bộ file đầu vào (không phụ thuộc tên/đường dẫn)
+    Dùng kích thước + hash phần đầu/cuối mỗi file: file được sửa => dấu vân tay mới,
+    tự ra khỏi quarantine.
+    Args:
+        paths: Các file đầu vào
+        settings: Cài đặt render đã resolve (preset, tỉ lệ, draft, ...); đổi cài đặt => dấu vân tay mới
+    Returns:
+        str, None nếu không có file nào đọc được
+    """
+    digest = hashlib.sha1()
+    found = False
+    for path in paths:
+        if not path or not Path(path).is_file():
+            continue
+        try:
+            size = Path(path).stat().st_size
+            digest.update(str(size).encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read(FINGERPRINT_CHUNK))
+                if size > 2 * FINGERPRINT_CHUNK:
+                    f.seek(-FINGERPRINT_CHUNK, os.SEEK_END)
+                    digest.update(f.read(FINGERPRINT_CHUNK))
+            found = True
+        except OSError as e:
+            logging.debug(f"Could not fingerprint {path}: {e}")
+    if not found:
+        return None
+    if settings is not None:
+        digest.update(json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return digest.hexdigest()
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import uuid
+import logging
+import psutil
+from pathlib import Path
+from contextvars import ContextVar
+from typing import Optional
+from .temp_reaper import temp_reaper
+from .scratch_manager import scratch_manager
+from .cancellation import TaskCancelledError
+from .stage_checkpoint import CHECKPOINT_DIR, StageCheckpoints
+
+# Thư mục con của temp chứa workspace của các job
+JOBS_DIR = "jobs"
+
+# File ghi process đang sở hữu workspace (để dọn workspace mồ côi)
+OWNER_FILE = ".owner"
+
+# Workspace không có file owner chỉ bị coi là mồ côi khi cũ hơn N giây
+ORPHAN_MIN_AGE = 3600
+
+# Workspace resume được (job lỗi/crash giữa chừng) được giữ N giây kể từ stage xong cuối cùng
+RESUME_MAX_AGE = 24 * 3600
+
+# Workspace của job đang chạy trong context hiện tại
+_current_workspace: ContextVar[Optional["JobWorkspace"]] = ContextVar("job_workspace", default=None)
+
+def current_workspace() -> Optional["JobWorkspace"]:
+    """Workspace của job hiện tại, None nếu code không chạy trong job nào"""
+    return _current_workspace.get()
+
+def workspace_dir(default: Path) -> Path:
+    """Thư mục làm việc của job hiện tại, hoặc default nếu không chạy trong job nào"""
+    workspace = current_workspace()
+    return workspace.path if workspace else Path(default)
+
+class JobWorkspace:
+    """
+    Thư mục làm việc riêng của 1 job: temp/jobs/{job_id}, hoặc {scratch}/jobs/{job_id}
+    khi có size_estimate và scratch nhanh (tmpfs/SSD) còn đủ budget cho job
+
+    Mọi file trung gian (concat.txt, cut_0000.mp4, hook_background.mp4, ...) của job
+    nằm trong thư mục này nên các job chạy song song không ghi đè file của nhau.
+    Thư mục được tạo khi vào context và giao cho TempReaper xóa khi ra (kể cả khi
+    bị hủy) nên job không phải chờ xóa file. Trong context, workspace_dir()
+    trả về thư mục này cho mọi hàm con.
+
+    Workspace resumable (job_id cố định theo đầu vào) có StageCheckpoints: khi job lỗi
+    thư mục được giữ lại (retain) thay vì xóa, lần chạy sau với cùng job_id (thử lại,
+    restart sau crash) nhận lại thư mục và tiếp tục từ stage chưa xong đầu tiên.
+    """
+
+    def __init__(self, temp_dir: Path, job_id: Optional[str] = None, keep: bool = False,
+                 size_estimate: Optional[int] = None, resumable: bool = False):
+        """
+        Args:
+            temp_dir: Thư mục temp gốc (workspace nằm trong temp_dir/jobs)
+            job_id: Tên thư mục, mặc định là 1 id ngẫu nhiên
+            keep: Giữ lại thư mục khi ra khỏi context (để debug)
+            size_estimate: Dung lượng file trung gian ước lượng (byte), để đặt workspace
+                trên scratch; None = luôn dùng temp_dir
+            resumable: Ghi checkpoint từng stage và giữ workspace khi job lỗi (cần job_id
+                cố định theo đầu vào)
+        """
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.temp_dir = Path(temp_dir)
+        self.path = self.temp_dir / JOBS_DIR / self.job_id
+        self.keep = keep
+        self.size_estimate = size_estimate
+        self.resumable = resumable and job_id is not None
+        self.reservation = None
+        self.stages: Optional[StageCheckpoints] = None
+        self.retained = False
+        self._token = None
+
+    def file(self, name: str) -> Path:
+        """Đường dẫn 1 file trong workspace"""
+        return self.path / name
+
+    @property
+    def on_scratch(self) -> bool:
+        return self.reservation is not None
+
+    def __enter__(self) -> "JobWorkspace":
+        existing = self._find_existing() if self.resumable else None
+        if existing is not None:
+            # Workspace của lần chạy trước (lỗi/crash): dùng lại đúng chỗ cũ
+            self.path = existing
+            if self.size_estimate and scratch_manager.enabled and existing.parent.parent == scratch_manager.root:
+                self.reservation = scratch_manager.reserve(self.size_estimate)
+        elif self.size_estimate:
+            self.reservation = scratch_manager.reserve(self.size_estimate)
+            if self.reservation:
+                self.path = self.reservation.root / JOBS_DIR / self.job_id
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            if not self.on_scratch:
+                raise
+            logging.warning(f"Could not create scratch workspace {self.path}, using disk: {e}")
+            self._release_reservation()
+            self.path = self.temp_dir / JOBS_DIR / self.job_id
+            self.path.mkdir(parents=True, exist_ok=True)
+        if self.resumable and not self._claim():
+            # Cùng đầu vào đang chạy ở job khác: chạy riêng, không resume
+            logging.info(f"Workspace {self.path} is in use by another job, using a fresh one")
+            self._release_reservation()
+            self.job_id = uuid.uuid4().hex[:12]
+            self.resumable = False
+            self.path = self.temp_dir / JOBS_DIR / self.job_id
+            self.path.mkdir(parents=True, exist_ok=True)
+        if self.resumable:
+            self.stages = StageCheckpoints(self.path)
+        else:
+            self._write_owner()
+        self._token = _current_workspace.set(self)
+        logging.debug(
+            f"Job workspace {'resumed' if existing is not None else 'created'}: {self.path} (pid {os.getpid()}"
+            f"{', scratch' if self.on_scratch else ''})"
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_workspace.reset(self._token)
+        self._token = None
+        if exc_type is not None and not issubclass(exc_type, TaskCancelledError):
+            self.retain()
+        if self.retained:
+            self._release_reservation()
+            self._release_owner()
+            logging.info(f"Keeping workspace {self.path} to resume failed job {self.job_id}")
+        elif not self.keep:
+            self.cleanup()
+        else:
+            self._release_reservation()
+        return False
+
+    def retain(self):
+        """Giữ workspace khi ra khỏi context để lần chạy sau resume (chỉ với workspace resumable)"""
+        if self.resumable and self.stages is not None and self.stages.has_progress():
+            self.retained = True
+
+    def cleanup(self):
+        """Xóa toàn bộ workspace (ở thread nền của TempReaper), trả lại scratch khi đã xóa xong"""
+        reservation, self.reservation = self.reservation, None
+        temp_reaper.discard(self.path, on_done=reservation.release if reservation else None)
+
+    def _release_reservation(self):
+        if self.reservation:
+            self.reservation.release()
+            self.reservation = None
+
+    def _find_existing(self) -> Optional[Path]:
+        """Workspace cùng job_id còn lại từ lần chạy trước (trên scratch hoặc temp)"""
+        roots = [scratch_manager.root] if scratch_manager.enabled else []
+        for root in roots + [self.temp_dir]:
+            path = root / JOBS_DIR / self.job_id
+            if (path / CHECKPOINT_DIR).is_dir():
+                return path
+        return None
+
+    def _claim(self) -> bool:
+        """
+        Tạo file owner (O_EXCL) để nhận workspace; owner cũ đã chết thì nhận thay
+        Returns:
+            bool: False nếu process khác còn sống đang dùng workspace
+        """
+        owner_file = self.file(OWNER_FILE)
+        try:
+            owner = json.dumps(self._owner())
+        except Exception as e:
+            logging.debug(f"Could not read process info for {self.path}: {e}")
+            return True
+        for _ in range(2):
+            try:
+                fd = os.open(str(owner_file), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if _owner_alive(self.path, use_age=False):
+                    return False
+                try:
+                    owner_file.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            except OSError as e:
+                logging.debug(f"Could not claim workspace {self.path}: {e}")
+                return True
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(owner)
+            return True
+        return False
+
+    def _release_owner(self):
+        """Bỏ file owner của workspace được giữ lại (lần chạy sau nhận được ngay)"""
+        try:
+            self.file(OWNER_FILE).unlink()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _owner() -> dict:
+        return {"pid": os.getpid(), "create_time": psutil.Process().create_time()}
+
+    def _write_owner(self):
+        """Ghi pid + thời điểm tạo process để phân biệt với process khác dùng lại pid"""
+        try:
+            self.file(OWNER_FILE).write_text(json.dumps(self._owner()), encoding='utf-8')
+        except Exception as e:
+            logging.debug(f"Could not write workspace owner for {self.path}: {e}")
+
+def _owner_alive(workspace_path: Path, use_age: bool = True) -> bool:
+    """
+    Process tạo workspace còn sống không
+    Args:
+        use_age: Không có file owner thì coi workspace mới tạo (chưa tới ORPHAN_MIN_AGE) là còn chủ
+    """
+    owner_file = workspace_path / OWNER_FILE
+    try:
+        owner = json.loads(owner_file.read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        if not use_age:
+            return False
+        # Chưa kịp ghi owner (vừa tạo) hoặc workspace từ phiên bản cũ: dựa vào tuổi thư mục
+        try:
+            return time.time() - workspace_path.stat().st_mtime < ORPHAN_MIN_AGE
+        except OSError:
+            return False
+    except Exception:
+        return False
+    try:
+        process = psutil.Process(int(owner["pid"]))
+        return abs(process.create_time() - float(owner.get("create_time", 0))) < 1.0
+    except (psutil.Error, KeyError, ValueError):
+        return False
+
+def _resume_pending(workspace_path: Path) -> bool:
+    """Workspace có checkpoint chưa quá RESUME_MAX_AGE (job lỗi/crash có thể được chạy lại)"""
+    try:
+        markers = [marker.stat().st_mtime for marker in (workspace_path / CHECKPOINT_DIR).glob("*.done")]
+    except OSError:
+        return False
+    return bool(markers) and time.time() - max(markers) < RESUME_MAX_AGE
+
+def sweep_orphaned_workspaces(temp_dir: Path) -> int:
+    """
+    Dọn workspace của các job mà process đã chết (crash, bị kill) từ lần chạy trước,
+    trong temp_dir và trên scratch (nếu bật). Workspace còn checkpoint để resume
+    được giữ tới RESUME_MAX_AGE.
+    Args:
+        temp_dir: Thư mục temp gốc
+    Returns:
+        int: Số workspace đã đưa vào hàng đợi xóa
+    """
+    roots = [Path(temp_dir)]
+    if scratch_manager.enabled:
+        roots.append(scratch_manager.root)
+    count = 0
+    for root in roots:
+        jobs_dir = root / JOBS_DIR
+        if not jobs_dir.is_dir():
+            continue
+        orphaned = [path for path in jobs_dir.iterdir()
+                    if path.is_dir() and not _owner_alive(path) and not _resume_pending(path)]
+        temp_reaper.discard_many(orphaned)
+        if orphaned:
+            logging.info(f"Sweeping {len(orphaned)} orphaned job workspaces in {jobs_dir}")
+        count += len(orphaned)
+    return count
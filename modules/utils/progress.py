@@ -0,0 +1,219 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# Tracker của job đang chạy trong context hiện tại (ffmpeg runner đọc từ đây)
+_current_tracker: ContextVar[Optional["ProgressTracker"]] = ContextVar("progress_tracker", default=None)
+
+def get_progress() -> Optional["ProgressTracker"]:
+    """Tracker của job hiện tại, None nếu code không chạy trong job nào"""
+    return _current_tracker.get()
+
+def progress_stage(name: str, duration: Optional[float] = None):
+    """tracker.stage() của job hiện tại, hoặc context rỗng nếu không có tracker"""
+    tracker = get_progress()
+    return tracker.stage(name, duration) if tracker else nullcontext()
+
+class ProgressTracker:
+    """
+    Tính tiến độ tổng của 1 task từ tiến độ từng lệnh ffmpeg
+
+    Mỗi task gồm các stage có trọng số (vd. background 0.3, subtitle 0.5, ...).
+    ffmpeg runner báo out_time/fps/speed của lệnh đang chạy; tracker quy ra % của
+    stage hiện tại, cộng dồn theo trọng số thành % tổng, ước lượng ETA rồi ghi
+    (có giới hạn tần suất) vào task history để status endpoint/SSE trả về.
+    """
+
+    # Khoảng cách tối thiểu giữa 2 lần ghi task history (giây)
+    WRITE_INTERVAL = 1.0
+
+    def __init__(self, task_id: str, task_history, stage_weights: Dict[str, float]):
+        """
+        Args:
+            task_id: ID của task
+            task_history: TaskHistoryManager dùng để ghi tiến độ
+            stage_weights: {stage: trọng số} theo thứ tự chạy
+        """
+        self.task_id = task_id
+        self.task_history = task_history
+        total = sum(stage_weights.values()) or 1.0
+        self.stage_weights = {name: weight / total for name, weight in stage_weights.items()}
+        self.completed_weight = 0.0
+        self.stage_name: Optional[str] = None
+        self.stage_duration: Optional[float] = None
+        self.stage_fraction = 0.0
+        self.item_index = 0
+        self.item_count = 1
+        self.speed: Optional[float] = None
+        self.fps: Optional[float] = None
+        self.started_at = time.time()
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """Gắn tracker vào context hiện tại trong lúc chạy job"""
+        token = _current_tracker.set(self)
+        try:
+            yield self
+        finally:
+            _current_tracker.reset(token)
+
+    def set_item(self, index: int, count: int):
+        """Batch: đang xử lý item thứ index trên tổng count, các stage được tính lại từ đầu"""
+        with self._lock:
+            self.item_index = index
+            self.item_count = max(1, count)
+            self.completed_weight = 0.0
+            self.stage_name = None
+            self.stage_fraction = 0.0
+        self._write(force=True)
+
+    @contextmanager
+    def stage(self, name: str, duration: Optional[float] = None):
+        """
+        Đánh dấu 1 stage đang chạy
+        Args:
+            name: Tên stage (có trong stage_weights)
+            duration: Độ dài (giây) video đầu ra của stage, để quy out_time ra %
+        """
+        with self._lock:
+            self.stage_name = name
+            self.stage_duration = duration
+            self.stage_fraction = 0.0
+        self._write(force=True)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.completed_weight += self.stage_weights.get(name, 0.0)
+                self.stage_name = None
+                self.stage_fraction = 0.0
+            self._write(force=True)
+
+    def update(self, out_time: Optional[float] = None, expected_duration: Optional[float] = None,
+               fps: Optional[float] = None, speed: Optional[float] = None):
+        """
+        Cập nhật từ output -progress của ffmpeg
+        Args:
+            out_time: Thời điểm (giây) ffmpeg đã encode tới
+            expected_duration: Độ dài đầu ra của lệnh (mặc định là duration của stage)
+            fps: Tốc độ encode (frame/giây)
+            speed: Hệ số realtime (vd. 2.5 = nhanh gấp 2.5 lần realtime)
+        """
+        with self._lock:
+            duration = expected_duration or self.stage_duration
+            if out_time is not None and duration:
+                # Stage có nhiều lệnh ffmpeg: giữ % không giảm
+                self.stage_fraction = max(self.stage_fraction, min(1.0, out_time / duration))
+            if fps is not None:
+                self.fps = fps
+            if speed is not None:
+                self.speed = speed
+        self._write()
+
+    def percent(self) -> float:
+        """% tổng (0-100)"""
+        within_item = self.completed_weight
+        if self.stage_name:
+            within_item += self.stage_weights.get(self.stage_name, 0.0) * self.stage_fraction
+        return min(100.0, 100.0 * (self.item_index + min(within_item, 1.0)) / self.item_count)
+
+    def eta_seconds(self) -> Optional[float]:
+        """Ước lượng thời gian còn lại theo tốc độ trung bình từ lúc bắt đầu"""
+        percent = self.percent()
+        if percent <= 0:
+            return None
+        elapsed = time.time() - self.started_at
+        return max(0.0, elapsed * (100.0 - percent) / percent)
+
+    def snapshot(self) -> Dict:
+        """Các field tiến độ ghi vào task"""
+        eta = self.eta_seconds()
+        return {
+            "progress": int(self.percent()),
+            "stage": self.stage_name,
+            "speed": round(self.speed, 2) if self.speed is not None else None,
+            "fps": round(self.fps, 1) if self.fps is not None else None,
+            "eta_seconds": int(eta) if eta is not None else None,
+            "item": self.item_index + 1 if self.item_count > 1 else None,
+            "item_count": self.item_count if self.item_count > 1 else None
+        }
+
+    def _write(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_write < self.WRITE_INTERVAL:
+            return
+        self._last_write = now
+        try:
+            self.task_history.merge_task(self.task_id, self.snapshot(), create=False)
+        except Exception as e:
+            logging.debug(f"Could not write progress for task {self.task_id}: {e}")
+
+class ItemProgressTracker(ProgressTracker):
+    """Tiến độ của 1 item trong batch chạy song song, ghi qua tracker của batch"""
+
+    def __init__(self, batch: "BatchProgressTracker", index: int):
+        super().__init__(batch.task_id, batch.task_history, batch.stage_weights)
+        self.batch = batch
+        self.index = index
+
+    def _write(self, force: bool = False):
+        self.batch._write(force)
+
+class BatchProgressTracker(ProgressTracker):
+    """
+    Tiến độ tổng của batch có nhiều item chạy cùng lúc
+
+    Mỗi item đang chạy có ItemProgressTracker riêng (gắn vào context của thread xử lý
+    item đó); % tổng = (số item đã xong + tổng % các item đang chạy) / số item.
+    """
+
+    def __init__(self, task_id: str, task_history, stage_weights: Dict[str, float], item_count: int):
+        super().__init__(task_id, task_history, stage_weights)
+        self.item_count = max(1, item_count)
+        self.completed_items = 0
+        self._items: Dict[int, ItemProgressTracker] = {}
+
+    @contextmanager
+    def item(self, index: int):
+        """Gắn tracker của item index vào context hiện tại trong lúc xử lý item"""
+        child = ItemProgressTracker(self, index)
+        with self._lock:
+            self._items[index] = child
+        try:
+            with child.activate():
+                yield child
+        finally:
+            with self._lock:
+                self._items.pop(index, None)
+                self.completed_items += 1
+            self._write(force=True)
+
+    def _active(self):
+        with self._lock:
+            return list(self._items.values())
+
+    def percent(self) -> float:
+        running = sum(child.percent() / 100.0 for child in self._active())
+        return min(100.0, 100.0 * (self.completed_items + running) / self.item_count)
+
+    def snapshot(self) -> Dict:
+        active = self._active()
+        eta = self.eta_seconds()
+        speeds = [child.speed for child in active if child.speed is not None]
+        fps = [child.fps for child in active if child.fps is not None]
+        stages = sorted({child.stage_name for child in active if child.stage_name})
+        return {
+            "progress": int(self.percent()),
+            "stage": ", ".join(stages) or None,
+            "speed": round(sum(speeds), 2) if speeds else None,
+            "fps": round(sum(fps), 1) if fps else None,
+            "eta_seconds": int(eta) if eta is not None else None,
+            "item": self.completed_items + len(active),
+            "item_count": self.item_count,
+            "active_items": len(active)
+        }
@@ -0,0 +1,168 @@
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+import psutil
+from pathlib import Path
+from typing import Dict, Optional
+from api.core.config import Settings
+
+# Mặc định, ghi đè bằng common.scratch trong config/settings.json
+DEFAULT_SCRATCH_SETTINGS = {
+    "dir": "",                  # Thư mục scratch nhanh (tmpfs, RAM disk, SSD local); rỗng = tắt
+    "budget_mb": 4096,          # Tổng dung lượng các job đang chạy được giữ trên scratch
+    "min_free_mb": 512,         # Luôn chừa lại trên ổ scratch
+    "intermediate_mbps": 16     # Bitrate ước lượng của file video trung gian
+}
+
+# Audio đã normalize: PCM 24-bit, 34 kHz, stereo (bytes/giây)
+NORMALIZED_AUDIO_BYTES_PER_SECOND = 34000 * 3 * 2
+
+class ScratchReservation:
+    """Phần dung lượng scratch đã giữ cho 1 job"""
+
+    def __init__(self, manager: "ScratchManager", reservation_id: str, root: Path, size_bytes: int):
+        self.manager = manager
+        self.reservation_id = reservation_id
+        self.root = root
+        self.size_bytes = size_bytes
+
+    def release(self):
+        self.manager.release(self.reservation_id)
+
+class ScratchManager:
+    """
+    Tầng scratch nhanh cho file trung gian (concat, WAV đã normalize, đoạn hook, ...)
+
+    Mỗi job ước lượng dung lượng file trung gian trước khi chạy. Nếu tổng phần đã giữ
+    của các job đang chạy cộng thêm ước lượng này vẫn nằm trong budget (và ổ còn đủ
+    chỗ), workspace của job được đặt trên scratch; ngược lại job dùng temp trên đĩa.
+    Phần đã giữ được ghi trong SQLite ngay trên thư mục scratch nên mọi render worker
+    process cùng chia 1 budget; phần giữ của process đã chết được bỏ qua.
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self._settings = settings
+        self._local = threading.local()
+        self.reload()
+
+    def reload(self):
+        """Load lại cấu hình từ settings"""
+        self.config = dict(DEFAULT_SCRATCH_SETTINGS)
+        try:
+            settings = self._settings or Settings()
+            self.config.update(settings.get_common_settings().get("scratch", {}))
+        except Exception as e:
+            logging.error(f"Error loading scratch settings: {e}")
+        self.root = Path(self.config["dir"]) if self.config.get("dir") else None
+        self.budget_bytes = int(float(self.config["budget_mb"]) * 1024 * 1024)
+        self.min_free_bytes = int(float(self.config["min_free_mb"]) * 1024 * 1024)
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None and self.budget_bytes > 0
+
+    def estimate_bytes(self, duration: float, video_copies: int = 3, audio_copies: int = 0) -> int:
+        """
+        Ước lượng dung lượng file trung gian của 1 job
+        Args:
+            duration: Độ dài video (giây)
+            video_copies: Số bản video trung gian tồn tại cùng lúc (nền, đoạn cắt, concat, ...)
+            audio_copies: Số file WAV đã normalize
+        Returns:
+            int: Số byte (đã cộng 20% dự phòng)
+        """
+        video_rate = float(self.config["intermediate_mbps"]) * 1_000_000 / 8
+        size = duration * (video_copies * video_rate + audio_copies * NORMALIZED_AUDIO_BYTES_PER_SECOND)
+        return int(size * 1.2)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection riêng cho từng thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.root / "scratch.db"), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reservations (
+                    reservation_id TEXT PRIMARY KEY,
+                    size_bytes INTEGER NOT NULL,
+                    pid INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def reserve(self, size_bytes: int) -> Optional[ScratchReservation]:
+        """
+        Giữ size_bytes trên scratch cho 1 job
+        Returns:
+            ScratchReservation, hoặc None nếu scratch tắt/không đủ chỗ (job dùng temp trên đĩa)
+        """
+        if not self.enabled or size_bytes <= 0:
+            return None
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._prune_dead(conn)
+                used = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) AS used FROM reservations").fetchone()["used"]
+                free = shutil.disk_usage(self.root).free
+                if used + size_bytes > self.budget_bytes or free - size_bytes < self.min_free_bytes:
+                    conn.execute("ROLLBACK")
+                    logging.info(
+                        f"Scratch full ({used / 1e6:.0f}MB used + {size_bytes / 1e6:.0f}MB needed, "
+                        f"budget {self.budget_bytes / 1e6:.0f}MB, free {free / 1e6:.0f}MB), spilling job to disk"
+                    )
+                    return None
+                reservation_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO reservations (reservation_id, size_bytes, pid, created_at) VALUES (?, ?, ?, ?)",
+                    (reservation_id, size_bytes, os.getpid(), time.time())
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            logging.warning(f"Scratch unavailable ({self.root}), using disk: {e}")
+            return None
+        logging.debug(f"Reserved {size_bytes / 1e6:.0f}MB on scratch {self.root}")
+        return ScratchReservation(self, reservation_id, self.root, size_bytes)
+
+    def release(self, reservation_id: str):
+        """Trả lại phần đã giữ (gọi sau khi workspace đã được xóa)"""
+        try:
+            self._connect().execute("DELETE FROM reservations WHERE reservation_id = ?", (reservation_id,))
+        except Exception as e:
+            logging.warning(f"Could not release scratch reservation {reservation_id}: {e}")
+
+    def usage(self) -> Dict:
+        """Dung lượng scratch đang được giữ"""
+        if not self.enabled:
+            return {"enabled": False}
+        row = self._connect().execute(
+            "SELECT COUNT(*) AS jobs, COALESCE(SUM(size_bytes), 0) AS used FROM reservations"
+        ).fetchone()
+        return {
+            "enabled": True,
+            "dir": str(self.root),
+            "jobs": row["jobs"],
+            "reserved_bytes": row["used"],
+            "budget_bytes": self.budget_bytes
+        }
+
+    def _prune_dead(self, conn: sqlite3.Connection):
+        """Bỏ phần giữ của process đã chết (crash, bị kill)"""
+        rows = conn.execute("SELECT reservation_id, pid FROM reservations").fetchall()
+        dead = [row["reservation_id"] for row in rows if not psutil.pid_exists(row["pid"])]
+        for reservation_id in dead:
+            conn.execute("DELETE FROM reservations WHERE reservation_id = ?", (reservation_id,))
+
+# Shared scratch manager instance
+scratch_manager = ScratchManager()
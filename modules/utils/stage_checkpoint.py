@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Any, Optional, Sequence, Tuple
+
+# Thư mục con của workspace chứa marker các stage đã xong
+CHECKPOINT_DIR = ".stages"
+
+# Tăng khi đổi định dạng marker (marker cũ bị bỏ qua)
+CHECKPOINT_VERSION = 1
+
+class StageCheckpoints:
+    """
+    Marker hoàn thành của các stage pipeline trong workspace của 1 job
+
+    Mỗi stage xong ghi {workspace}/.stages/{stage}.done (giá trị trả về + danh sách
+    file đầu ra) sau khi đầu ra đã ghi xong. Lần chạy lại (thử lại job, restart sau
+    crash) dùng lại kết quả các stage đầu tiên còn marker hợp lệ và đầu ra còn đủ,
+    rồi chạy lại từ stage chưa xong đầu tiên; marker của các stage sau đó bị xóa vì
+    đầu vào của chúng sẽ đổi.
+    """
+
+    def __init__(self, root: Path):
+        """
+        Args:
+            root: Thư mục workspace của job
+        """
+        self.root = Path(root).absolute()
+        self.dir = self.root / CHECKPOINT_DIR
+        self._replaying = True
+        self._replayed = set()
+
+    def has_progress(self) -> bool:
+        """Đã có stage nào xong chưa"""
+        return self.dir.is_dir() and any(self.dir.glob("*.done"))
+
+    def resume(self, name: str, outputs: Sequence[Path] = ()) -> Tuple[bool, Any]:
+        """
+        Kết quả đã lưu của 1 stage
+        Args:
+            name: Tên stage
+            outputs: File đầu ra của stage (phải còn tồn tại)
+        Returns:
+            (True, giá trị trả về đã lưu) nếu stage đã xong, (False, None) nếu phải chạy
+        """
+        if not self._replaying:
+            return False, None
+        marker = self._load(name, outputs)
+        if marker is not None:
+            self._replayed.add(name)
+            logging.info(f"Stage '{name}' already done in {self.root.name}, resuming after it")
+            return True, self._decode(marker["value"])
+        # Stage chưa xong đầu tiên: các stage sau chạy lại hết, marker cũ của chúng không còn đúng
+        self._replaying = False
+        self._invalidate_rest()
+        return False, None
+
+    def complete(self, name: str, value: Any = None, outputs: Sequence[Path] = ()):
+        """
+        Ghi marker sau khi stage xong (ghi file tạm rồi rename: crash giữa chừng không để lại marker hỏng)
+        Args:
+            name: Tên stage
+            value: Giá trị trả về của stage (JSON được; Path được lưu tương đối theo workspace)
+            outputs: File đầu ra của stage
+        """
+        marker = {
+            "version": CHECKPOINT_VERSION,
+            "stage": name,
+            "value": self._encode(value),
+            "outputs": [self._encode(Path(path)) for path in outputs],
+            "completed_at": time.time()
+        }
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            marker_path = self._marker(name)
+            tmp_path = marker_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(marker, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, marker_path)
+        except (OSError, TypeError, ValueError) as e:
+            # Không ghi được marker chỉ làm mất khả năng resume, không làm hỏng job
+            logging.warning(f"Could not checkpoint stage '{name}' in {self.root}: {e}")
+
+    def _marker(self, name: str) -> Path:
+        return self.dir / f"{name}.done"
+
+    def _load(self, name: str, outputs: Sequence[Path]) -> Optional[dict]:
+        try:
+            marker = json.loads(self._marker(name).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable checkpoint '{name}' in {self.root}: {e}")
+            return None
+        if marker.get("version") != CHECKPOINT_VERSION:
+            return None
+        # Đầu ra đã lưu, file trong giá trị trả về và đầu ra yêu cầu lần này phải còn đủ
+        files = [self._decode(path) for path in marker.get("outputs", [])] + [Path(path) for path in outputs]
+        files += self._paths(self._decode(marker.get("value")))
+        for path in files:
+            if not path.is_file() or path.stat().st_size == 0:
+                logging.info(f"Checkpoint '{name}' in {self.root.name} is stale: missing {path.name}")
+                return None
+        return marker
+
+    def _invalidate_rest(self):
+        """Xóa marker của mọi stage chưa được dùng lại trong lần chạy này"""
+        if not self.dir.is_dir():
+            return
+        for marker_path in self.dir.glob("*.done"):
+            if marker_path.stem not in self._replayed:
+                try:
+                    marker_path.unlink()
+                except OSError as e:
+                    logging.warning(f"Could not remove stale checkpoint {marker_path}: {e}")
+
+    def _encode(self, value: Any) -> Any:
+        if isinstance(value, Path):
+            path = value.absolute()
+            try:
+                return {"path": str(path.relative_to(self.root)), "relative": True}
+            except ValueError:
+                return {"path": str(path), "relative": False}
+        if isinstance(value, (list, tuple)):
+            return [self._encode(item) for item in value]
+        if isinstance(value, dict):
+            return {"dict": {str(key): self._encode(item) for key, item in value.items()}}
+        return value
+
+    def _decode(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._decode(item) for item in value]
+        if isinstance(value, dict):
+            if "path" in value:
+                return self.root / value["path"] if value.get("relative") else Path(value["path"])
+            return {key: self._decode(item) for key, item in value.get("dict", {}).items()}
+        return value
+
+    def _paths(self, value: Any) -> list:
+        """Các Path nằm trong 1 giá trị đã decode"""
+        if isinstance(value, Path):
+            return [value]
+        if isinstance(value, list):
+            return [path for item in value for path in self._paths(item)]
+        if isinstance(value, dict):
+            return [path for item in value.values() for path in self._paths(item)]
+        return []
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Optional, Set
+from .task_history_manager import TERMINAL_STATUSES, TaskHistoryManager
+
+class TaskEventBus:
+    """
+    Đẩy thay đổi trạng thái task tới các client đang chờ (SSE, WebSocket, long-poll)
+
+    Render worker chạy ở process khác và ghi trạng thái vào TaskHistoryManager.
+    Bus chạy 1 vòng lặp duy nhất trong process API, đọc các thay đổi mới theo seq
+    rồi phát tới queue của từng subscriber. Số client đang chờ không làm tăng
+    số lần đọc DB: 100 client hay 1 client đều chỉ là 1 query mỗi chu kỳ.
+    """
+
+    def __init__(self, task_history: TaskHistoryManager, poll_interval: float = 0.5):
+        """
+        Args:
+            task_history: Nơi lưu trạng thái task
+            poll_interval: Chu kỳ (giây) kiểm tra thay đổi mới
+        """
+        self.task_history = task_history
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._last_seq = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Chạy vòng lặp phát sự kiện (gọi trong event loop của API)"""
+        if self._task and not self._task.done():
+            return
+        self._last_seq = self.task_history.current_seq()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """Đăng ký nhận cập nhật của 1 task"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(task_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[task_id]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                changes = await loop.run_in_executor(None, self.task_history.changes_since, self._last_seq)
+                for seq, task_id, task in changes:
+                    self._last_seq = max(self._last_seq, seq)
+                    for queue in list(self._subscribers.get(task_id, ())):
+                        queue.put_nowait(task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Task event bus error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def wait_for_task(self, task_id: str, timeout: float = 1800) -> dict:
+        """
+        Đợi task kết thúc (completed/error/cancelled) mà không poll DB riêng cho từng client
+        Args:
+            task_id: ID của task
+            timeout: Thời gian chờ tối đa (giây)
+        Returns:
+            dict: Task data
+        Raises:
+            asyncio.TimeoutError: Nếu quá thời gian timeout
+            ValueError: Nếu task không tồn tại
+        """
+        task = None
+        async for task in self.stream(task_id, timeout):
+            pass
+        return task
+
+    async def stream(self, task_id: str, timeout: float = 1800) -> AsyncIterator[dict]:
+        """
+        Phát trạng thái hiện tại rồi từng cập nhật của task cho tới khi kết thúc
+        Args:
+            task_id: ID của task
+            timeout: Thời gian chờ tối đa (giây)
+        Yields:
+            dict: Task data sau mỗi lần thay đổi
+        """
+        queue = self.subscribe(task_id)
+        try:
+            # Đọc trạng thái sau khi đã subscribe để không lỡ thay đổi nào
+            task = self.task_history.get_task(task_id)
+            if task.get('status') == 'not_found':
+                raise ValueError(f"Task {task_id} not found")
+            yield task
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while task.get('status') not in TERMINAL_STATUSES:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"Task {task_id} timeout after {timeout} seconds")
+                task = await asyncio.wait_for(queue.get(), remaining)
+                yield task
+        finally:
+            self.unsubscribe(task_id, queue)
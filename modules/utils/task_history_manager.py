@@ -1,231 +1,302 @@
 import json
 import logging
+import sqlite3
+import threading
 from pathlib import Path
 from datetime import datetime, timedelta
 import os
-import uuid
-import asyncio
-from typing import Optional
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Trạng thái kết thúc của task (không đổi sang trạng thái khác nữa)
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+# Ghi task + cấp seq mới trong cùng 1 câu lệnh (atomic giữa các process)
+UPSERT_TASK_SQL = (
+    "INSERT INTO tasks (task_id, status, data, created_at, updated_at, seq) "
+    "VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks)) "
+    "ON CONFLICT(task_id) DO UPDATE SET status = excluded.status, data = excluded.data, "
+    "updated_at = excluded.updated_at, seq = excluded.seq"
+)
+
+# Mỗi file DB chỉ cần 1 thread dọn dẹp trong mỗi process
+_retention_threads: Dict[str, threading.Thread] = {}
+_retention_lock = threading.Lock()
 
 class TaskHistoryManager:
+    """
+    Lưu lịch sử task trong SQLite (WAL)
+
+    Mỗi task là 1 row nên cập nhật trạng thái chỉ ghi đúng row đó, không đọc/ghi
+    lại toàn bộ lịch sử. Nhiều thread/process (API, render worker) ghi đồng thời an toàn.
+    Task cũ hơn max_history_days được xóa định kỳ bởi 1 thread nền.
+    File task_history.json cũ (nếu có) được chuyển sang DB ở lần chạy đầu tiên.
+
+    Mỗi lần ghi, task nhận seq mới (tăng dần) để TaskEventBus chỉ cần 1 query
+    "seq > seq đã thấy" là biết mọi thay đổi, kể cả từ render worker process khác.
+    """
+
+    # Chu kỳ dọn task cũ (giây)
+    RETENTION_INTERVAL = 3600
+
     def __init__(self, base_path):
-        self.history_file = Path(base_path) / "task_history.json"
+        self.db_path = Path(base_path) / "task_history.db"
+        self.history_file = Path(base_path) / "task_history.json"  # Chỉ dùng để migrate
         self.max_history_days = 30  # Giữ lịch sử trong 30 ngày
-        self.task_events = {}  # Store events for task completion
-        self.max_wait_time = 30 * 60  # 30 minutes timeout
-        
-        # Tạo file mới nếu chưa tồn tại hoặc bị lỗi
-        self._initialize_history_file()
-    
-    def _initialize_history_file(self):
-        """Khởi tạo file history, xử lý các trường hợp file lỗi"""
+        self._local = threading.local()
+
+        self._initialize_db()
+        self._migrate_json_history()
+        self._start_retention_thread()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection riêng cho từng thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _initialize_db(self):
+        """Tạo bảng và index nếu chưa có"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT,
+                data TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                seq INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # DB tạo trước khi có cột seq
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(tasks)").fetchall()]
+        if "seq" not in columns:
+            conn.execute("ALTER TABLE tasks ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_seq ON tasks (seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at)")
+
+    def _migrate_json_history(self):
+        """Chuyển task_history.json cũ sang SQLite (1 lần, file cũ được đổi tên thành .migrated)"""
+        if not self.history_file.exists():
+            return
         try:
-            if self.history_file.exists():
-                # Thử đọc file hiện tại
-                try:
-                    with open(self.history_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # Initialize task events for existing tasks
-                        for task_id, task_data in data.items():
-                            if task_data.get('status') == 'processing':
-                                self.task_events[task_id] = asyncio.Event()
-                except (json.JSONDecodeError, UnicodeDecodeError):
-                    # Nếu file lỗi, backup và tạo mới
-                    backup_path = self.history_file.with_suffix('.json.bak')
-                    try:
-                        os.rename(self.history_file, backup_path)
-                        logging.warning(f"Corrupted history file backed up to {backup_path}")
-                    except Exception as e:
-                        logging.error(f"Failed to backup corrupted history file: {e}")
-                        # Nếu không backup được thì xóa luôn
-                        os.remove(self.history_file)
-                    
-                    # Tạo file mới
-                    self._create_new_history_file()
-            else:
-                # Tạo file mới nếu chưa tồn tại
-                self._create_new_history_file()
-                
-        except Exception as e:
-            logging.error(f"Error initializing task history: {e}")
-            # Đảm bảo luôn có file history hợp lệ
-            self._create_new_history_file()
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError, OSError) as e:
+            logging.warning(f"Could not read old history file {self.history_file}: {e}")
+            history = {}
 
-    def _create_new_history_file(self):
-        """Tạo file history mới với nội dung rỗng"""
         try:
-            self.history_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f, indent=2)
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for task_id, task_data in (history or {}).items():
+                    if not isinstance(task_data, dict):
+                        continue
+                    now = datetime.now().isoformat()
+                    created_at = task_data.get('created_at') or now
+                    conn.execute(
+                        "INSERT OR IGNORE INTO tasks (task_id, status, data, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (task_id, task_data.get('status'), json.dumps(task_data, ensure_ascii=False),
+                         created_at, task_data.get('updated_at') or created_at)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            os.replace(self.history_file, self.history_file.with_suffix('.json.migrated'))
+            logging.info(f"Migrated {len(history or {})} tasks from {self.history_file} to {self.db_path}")
         except Exception as e:
-            logging.error(f"Error creating new history file: {e}")
-            raise
-    
+            logging.error(f"Failed to migrate task history: {e}")
+
+    def _start_retention_thread(self):
+        """Thread nền xóa task quá cũ (1 thread cho mỗi DB trong process)"""
+        key = str(self.db_path.resolve())
+        with _retention_lock:
+            thread = _retention_threads.get(key)
+            if thread and thread.is_alive():
+                return
+            thread = threading.Thread(target=self._retention_loop, name="task-history-retention", daemon=True)
+            _retention_threads[key] = thread
+            thread.start()
+
+    def _retention_loop(self):
+        while True:
+            try:
+                self.cleanup_old_tasks()
+            except Exception as e:
+                logging.error(f"Error cleaning up task history: {e}")
+            time.sleep(self.RETENTION_INTERVAL)
+
+    def cleanup_old_tasks(self) -> int:
+        """
+        Xóa các task quá cũ (dùng index created_at)
+        Returns:
+            int: Số task đã xóa
+        """
+        cutoff = (datetime.now() - timedelta(days=self.max_history_days)).isoformat()
+        cursor = self._connect().execute("DELETE FROM tasks WHERE created_at < ?", (cutoff,))
+        if cursor.rowcount:
+            logging.info(f"Removed {cursor.rowcount} tasks older than {self.max_history_days} days")
+        return cursor.rowcount
+
     def create_task(self, task_id: str, initial_status: dict):
         """Create a new task with initial status"""
         logging.info(f"Creating new task {task_id} with status {initial_status}")
-        self.task_events[task_id] = asyncio.Event()
         self.save_task(task_id, initial_status)
-        
+
     def save_task(self, task_id: str, task_data: dict):
-        """Lưu thông tin task vào file history"""
-        logging.info(f"Saving task {task_id} with data {task_data}")
+        """Lưu (ghi đè) thông tin 1 task"""
+        logging.debug(f"Saving task {task_id} with data {task_data}")
         try:
-            # Đọc history hiện tại
-            history = self._read_history()
-            logging.debug(f"Current history: {history}")
-            
             # Thêm timestamp
             task_data['updated_at'] = datetime.now().isoformat()
             if 'created_at' not in task_data:
                 task_data['created_at'] = task_data['updated_at']
-            
-            # Check if task is complete
-            old_status = history.get(task_id, {}).get('status')
-            new_status = task_data.get('status')
-            
-            # Lưu task
-            history[task_id] = task_data
-            
-            # Xóa các task quá cũ
-            self._cleanup_old_tasks(history)
-            
-            # Ghi lại file
-            self._write_history(history)
-            logging.info(f"Task {task_id} saved successfully")
-            
-            # Set event if task is complete
-            if old_status == 'processing' and new_status in ['completed', 'error']:
-                if task_id in self.task_events:
-                    self.task_events[task_id].set()
-                    
+
+            self._connect().execute(
+                UPSERT_TASK_SQL,
+                (task_id, task_data.get('status'), json.dumps(task_data, ensure_ascii=False, default=str),
+                 task_data['created_at'], task_data['updated_at'])
+            )
+
         except Exception as e:
             logging.error(f"Error saving task history: {e}")
-            # Nếu có lỗi, thử khởi tạo lại file và lưu
-            try:
-                self._initialize_history_file()
-                history = {task_id: task_data}
-                self._write_history(history)
-                logging.info(f"Task {task_id} saved after recovery")
-            except Exception as e2:
-                logging.error(f"Failed to recover and save task: {e2}")
-    
-    async def wait_for_task(self, task_id: str, timeout: int = 1800) -> dict:
-        """Đợi cho đến khi task hoàn thành hoặc có lỗi
+
+    def current_seq(self) -> int:
+        """seq lớn nhất hiện tại (mốc bắt đầu cho subscriber mới)"""
+        row = self._connect().execute("SELECT COALESCE(MAX(seq), 0) AS seq FROM tasks").fetchone()
+        return row["seq"]
+
+    def changes_since(self, seq: int, limit: int = 500) -> List[Tuple[int, str, dict]]:
+        """
+        Các task thay đổi sau mốc seq (dùng index seq)
         Args:
-            task_id (str): ID của task
-            timeout (int): Thời gian timeout tính bằng giây, mặc định 30 phút
+            seq (int): seq đã thấy gần nhất
+            limit (int): Số thay đổi tối đa mỗi lần đọc
         Returns:
-            dict: Task data
-        Raises:
-            asyncio.TimeoutError: Nếu quá thời gian timeout
+            list: [(seq, task_id, task_data)] theo thứ tự seq tăng dần
         """
-        import asyncio
-        import time
-        
-        start_time = time.time()
-        check_interval = 1  # Check mỗi giây
-        
-        while True:
-            # Check if timeout
-            if time.time() - start_time > timeout:
-                raise asyncio.TimeoutError(f"Task {task_id} timeout after {timeout} seconds")
-                
-            # Get current status
-            task = self.get_task(task_id)
-            if task.get('status') == 'not_found':
-                raise ValueError(f"Task {task_id} not found")
-                
-            # Return if task is completed or has error
-            if task.get('status') in ['completed', 'error']:
-                return task
-                
-            # Wait before next check
-            await asyncio.sleep(check_interval)
-    
+        rows = self._connect().execute(
+            "SELECT seq, task_id, data FROM tasks WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+        ).fetchall()
+        return [(row["seq"], row["task_id"], json.loads(row["data"])) for row in rows]
+
     def get_task(self, task_id: str) -> dict:
-        """Lấy thông tin task từ history"""
+        """Lấy thông tin task (tra theo primary key)"""
         try:
-            history = self._read_history()
-            return history.get(task_id, {"status": "not_found"})
+            row = self._connect().execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return {"status": "not_found"}
+            return json.loads(row["data"])
         except Exception as e:
             logging.error(f"Error reading task history: {e}")
             return {"status": "not_found"}
-    
-    def _read_history(self) -> dict:
-        """Đọc file history"""
+
+    def merge_task(self, task_id: str, fields: dict, create: bool = True) -> Optional[dict]:
+        """
+        Gộp các field vào task (đọc-sửa-ghi trong 1 transaction để các worker không ghi đè nhau)
+        Args:
+            task_id (str): ID của task
+            fields (dict): Các field cần cập nhật
+            create (bool): Tạo task mới nếu chưa có
+        Returns:
+            dict: Task sau khi cập nhật, None nếu task không tồn tại và create=False
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            if not self.history_file.exists():
-                self._create_new_history_file()
-                return {}
-                
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, UnicodeDecodeError):
-            # Nếu file lỗi, khởi tạo lại
-            self._initialize_history_file()
-            return {}
-        except Exception as e:
-            logging.error(f"Error reading history file: {e}")
-            return {}
-    
-    def _write_history(self, history: dict):
-        """Ghi file history"""
+            row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None and not create:
+                conn.execute("ROLLBACK")
+                return None
+
+            task = json.loads(row["data"]) if row else {"task_id": task_id}
+            if task.get('status') == 'cancelled' and fields.get('status', 'cancelled') != 'cancelled':
+                # Task đã hủy giữ nguyên trạng thái, worker kết thúc muộn không ghi đè được
+                fields = {key: value for key, value in fields.items() if key not in ('status', 'message', 'error')}
+            task.update(fields)
+            task['updated_at'] = datetime.now().isoformat()
+            task.setdefault('created_at', task['updated_at'])
+
+            conn.execute(
+                UPSERT_TASK_SQL,
+                (task_id, task.get('status'), json.dumps(task, ensure_ascii=False, default=str),
+                 task['created_at'], task['updated_at'])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return task
+
+    def cancel_task(self, task_id: str, fields: Optional[dict] = None) -> Optional[dict]:
+        """
+        Hủy task nếu chưa kết thúc: kiểm tra trạng thái và ghi 'cancelled' trong cùng
+        1 transaction, job vừa xong (completed/error) không bị báo nhầm là đã hủy
+        Args:
+            task_id (str): ID của task
+            fields (dict): Các field ghi thêm khi hủy (message, cancelled_at, ...)
+        Returns:
+            dict: Task sau khi xử lý (giữ nguyên nếu đã kết thúc), None nếu task không tồn tại
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            # Ghi trực tiếp vào file history
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=2, ensure_ascii=False)
-            logging.info(f"Task history saved to {self.history_file}")
-            
-        except Exception as e:
-            logging.error(f"Error writing history file: {e}")
+            row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+
+            task = json.loads(row["data"])
+            if task.get('status') in TERMINAL_STATUSES:
+                conn.execute("ROLLBACK")
+                return task
+
+            task.update(fields or {})
+            task['status'] = 'cancelled'
+            task['updated_at'] = datetime.now().isoformat()
+            task.setdefault('created_at', task['updated_at'])
+
+            conn.execute(
+                UPSERT_TASK_SQL,
+                (task_id, task['status'], json.dumps(task, ensure_ascii=False, default=str),
+                 task['created_at'], task['updated_at'])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
             raise
-    
-    def _cleanup_old_tasks(self, history: dict):
-        """Xóa các task quá cũ"""
-        now = datetime.now()
-        history_copy = history.copy()
-        
-        for task_id, task_data in history_copy.items():
-            try:
-                # Dùng created_at thay vì saved_at
-                created_at = datetime.fromisoformat(task_data.get('created_at', now.isoformat()))
-                if now - created_at > timedelta(days=self.max_history_days):
-                    del history[task_id]
-            except (ValueError, TypeError) as e:
-                logging.warning(f"Invalid date format for task {task_id}: {e}")
-                # Giữ lại task nếu không parse được ngày
-                
+        return task
+
     def update_task_status(self, task_id: str, status: str, message: str = None, error: str = None, data: dict = None):
         """Update task status
         Args:
             task_id (str): ID của task
-            status (str): Status mới (completed, error, processing)
+            status (str): Status mới (completed, error, processing, cancelled)
             message (str, optional): Message mới. Defaults to None.
             error (str, optional): Error message nếu có lỗi. Defaults to None.
             data (dict, optional): Additional task data. Defaults to None.
         """
         logging.info(f"Updating task {task_id} status to {status}")
+        fields = {'status': status}
+        if message:
+            fields['message'] = message
+        if error:
+            fields['error'] = error
+        if data:
+            fields.update(data)
         try:
-            # Get current task
-            task = self.get_task(task_id)
-            if task.get('status') == 'not_found':
+            if self.merge_task(task_id, fields, create=False) is None:
                 logging.error(f"Cannot update non-existent task {task_id}")
-                return
-                
-            # Update task data
-            task['status'] = status
-            if message:
-                task['message'] = message
-            if error:
-                task['error'] = error
-            if data:
-                task.update(data)
-                
-            # Save updated task
-            self.save_task(task_id, task)
-            logging.info(f"Task {task_id} status updated successfully")
-            
         except Exception as e:
             logging.error(f"Error updating task status: {e}")
             raise
@@ -0,0 +1,127 @@
+import os
+import time
+import heapq
+import atexit
+import shutil
+import logging
+import threading
+import itertools
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+class TempReaper:
+    """
+    Xóa file/thư mục tạm ở thread nền, ngoài luồng render
+
+    Render thread chỉ đưa đường dẫn vào hàng đợi rồi đi tiếp. File đang bị khóa
+    (Windows: ffmpeg/antivirus chưa nhả handle) được thử lại với backoff tăng dần
+    trên thread của reaper, render không phải sleep chờ.
+    """
+
+    # Backoff giữa các lần thử lại (giây): RETRY_DELAY * 2^attempt, tối đa MAX_RETRY_DELAY
+    RETRY_DELAY = 0.5
+    MAX_RETRY_DELAY = 30.0
+    MAX_ATTEMPTS = 10
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, str, int]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._callbacks: Dict[str, List[Callable[[], None]]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def discard(self, path: Union[str, Path, None], on_done: Optional[Callable[[], None]] = None):
+        """
+        Đưa 1 file/thư mục vào hàng đợi xóa (không chờ)
+        Args:
+            path: File/thư mục cần xóa
+            on_done: Gọi trên thread của reaper khi đã xóa xong (hoặc đã bỏ cuộc)
+        """
+        if not path:
+            return
+        if on_done:
+            with self._condition:
+                self._callbacks.setdefault(str(path), []).append(on_done)
+        self._schedule(str(path), 0, 0.0)
+
+    def discard_many(self, paths: Iterable[Union[str, Path, None]]):
+        """Đưa nhiều file/thư mục vào hàng đợi xóa"""
+        for path in paths:
+            self.discard(path)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Chờ hàng đợi xóa hết (dùng khi thoát process)
+        Returns:
+            bool: True nếu đã xóa hết trong thời gian timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _schedule(self, path: str, attempt: int, delay: float):
+        with self._condition:
+            if attempt == 0:
+                self._pending += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), path, attempt))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="temp-reaper", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                _, _, path, attempt = heapq.heappop(self._heap)
+
+            if self._delete(Path(path)) or attempt + 1 >= self.MAX_ATTEMPTS:
+                if attempt + 1 >= self.MAX_ATTEMPTS and Path(path).exists():
+                    logging.warning(f"Could not delete {path} after {self.MAX_ATTEMPTS} attempts")
+                with self._condition:
+                    callbacks = self._callbacks.pop(path, [])
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logging.warning(f"Temp reaper callback for {path} failed: {e}")
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify_all()
+            else:
+                delay = min(self.MAX_RETRY_DELAY, self.RETRY_DELAY * (2 ** attempt))
+                logging.debug(f"Failed to delete {path}, retrying in {delay}s...")
+                self._schedule(path, attempt + 1, delay)
+
+    def _delete(self, path: Path) -> bool:
+        """Xóa 1 đường dẫn, True nếu đã xóa hết (hoặc không còn tồn tại)"""
+        try:
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return True
+        except PermissionError:
+            return False
+        except Exception as e:
+            logging.warning(f"Error deleting {path}: {e}")
+            return True
+        if path.exists():
+            return False
+        logging.debug(f"Successfully deleted {path}")
+        return True
+
+# Shared reaper instance
+temp_reaper = TempReaper()
+
+# Cố xóa nốt hàng đợi khi process thoát (workspace sót lại được dọn ở lần khởi động sau)
+atexit.register(temp_reaper.flush, 5.0)
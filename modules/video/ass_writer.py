@@ -0,0 +1,208 @@
+import re
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+
+# Regex biên dịch sẵn cho parser SRT
+_TIMING_RE = re.compile(
+    r'(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})'
+)
+_HTML_TAG_RE = re.compile(r'<\s*(/?)\s*([ibus])\s*>', re.IGNORECASE)
+_OTHER_TAG_RE = re.compile(r'<[^>]*>')
+_BLOCK_JOIN_RE = re.compile(r'\}\{')
+_LEADING_BLOCK_RE = re.compile(r'^\{([^{}]*)\}')
+_ASS_DIALOGUE_RE = re.compile(
+    r'^Dialogue:\s*[^,]*,\s*(\d+):(\d{1,2}):(\d{1,2})\.(\d{1,3})\s*,\s*(\d+):(\d{1,2}):(\d{1,2})\.(\d{1,3})\s*,'
+)
+
+# Style mặc định (giống mặc định của pysubs2 trước đây)
+DEFAULT_STYLE = {
+    'fontname': 'Arial',
+    'fontsize': 20,
+    'primarycolor': '&HFFFFFF&',
+    'secondarycolor': '&H0000FF&',
+    'outlinecolor': '&H000000&',
+    'backcolor': '&H000000&',
+    'bold': 0,
+    'italic': 0,
+    'underline': 0,
+    'strikeout': 0,
+    'scalex': 100,
+    'scaley': 100,
+    'spacing': 0,
+    'angle': 0,
+    'borderstyle': 1,
+    'outline': 2,
+    'shadow': 2,
+    'alignment': 2,
+    'marginl': 10,
+    'marginr': 10,
+    'marginv': 10,
+    'encoding': 1
+}
+
+STYLE_FIELDS = [
+    ('Name', None), ('Fontname', 'fontname'), ('Fontsize', 'fontsize'),
+    ('PrimaryColour', 'primarycolor'), ('SecondaryColour', 'secondarycolor'),
+    ('OutlineColour', 'outlinecolor'), ('BackColour', 'backcolor'),
+    ('Bold', 'bold'), ('Italic', 'italic'), ('Underline', 'underline'), ('StrikeOut', 'strikeout'),
+    ('ScaleX', 'scalex'), ('ScaleY', 'scaley'), ('Spacing', 'spacing'), ('Angle', 'angle'),
+    ('BorderStyle', 'borderstyle'), ('Outline', 'outline'), ('Shadow', 'shadow'),
+    ('Alignment', 'alignment'), ('MarginL', 'marginl'), ('MarginR', 'marginr'),
+    ('MarginV', 'marginv'), ('Encoding', 'encoding')
+]
+
+def _to_ms(hours: str, minutes: str, seconds: str, fraction: str) -> int:
+    """Thời gian SRT (phần lẻ 1-3 chữ số) -> mili giây"""
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(fraction.ljust(3, '0'))
+
+def _ass_to_ms(hours: str, minutes: str, seconds: str, centiseconds: str) -> int:
+    """Thời gian ASS (h:mm:ss.cc) -> mili giây"""
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(centiseconds.ljust(2, '0')[:2]) * 10
+
+def iter_srt_cues(stream: TextIO) -> Iterator[Tuple[int, int, str]]:
+    """
+    Đọc từng cue SRT từ stream, không load cả file vào bộ nhớ
+    Args:
+        stream: File SRT đã mở ở chế độ text
+    Yields:
+        (start_ms, end_ms, text) với các dòng text nối bằng '\\n'
+    """
+    start = end = None
+    lines = []
+    for raw_line in stream:
+        line = raw_line.rstrip('\r\n')
+        timing = _TIMING_RE.search(line)
+        if timing:
+            # Cue mới bắt đầu (kể cả khi thiếu dòng trống ngăn cách)
+            if start is not None:
+                # Dòng số thứ tự của cue mới (ngay trước dòng timing) đã bị gom vào text của cue trước
+                if lines and lines[-1].strip().isdigit():
+                    lines.pop()
+                yield start, end, '\n'.join(lines).strip('\n')
+            groups = timing.groups()
+            start = _to_ms(*groups[:4])
+            end = _to_ms(*groups[4:])
+            lines = []
+        elif start is not None:
+            if line.strip() == '' and lines and lines[-1] == '':
+                continue
+            lines.append(line)
+    if start is not None:
+        # Hết file: dòng số cuối cùng là text thật của cue (không có dòng timing theo sau)
+        yield start, end, '\n'.join(lines).strip('\n')
+
+def iter_ass_cues(stream: TextIO) -> Iterator[Tuple[int, int]]:
+    """
+    Đọc thời gian các dòng Dialogue của file ASS
+    Args:
+        stream: File ASS đã mở ở chế độ text
+    Yields:
+        (start_ms, end_ms)
+    """
+    for line in stream:
+        match = _ASS_DIALOGUE_RE.match(line)
+        if match:
+            groups = match.groups()
+            yield _ass_to_ms(*groups[:4]), _ass_to_ms(*groups[4:])
+
+def ms_to_ass_time(ms: int) -> str:
+    """Mili giây -> h:mm:ss.cc (định dạng thời gian ASS)"""
+    cs = max(0, int(round(ms / 10.0)))
+    hours, cs = divmod(cs, 360000)
+    minutes, cs = divmod(cs, 6000)
+    seconds, cs = divmod(cs, 100)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}.{cs:02d}"
+
+def to_ass_color(color: str) -> str:
+    """&HBBGGRR& -> &H00BBGGRR (định dạng màu của V4+ Styles)"""
+    value = str(color).strip()
+    if value.startswith('&H'):
+        value = value[2:]
+    value = value.rstrip('&')
+    return f"&H{value.upper().zfill(8)}"
+
+def srt_text_to_ass(text: str) -> str:
+    """Chuyển text SRT sang ASS: <i>/<b>/<u>/<s> -> override tag, bỏ tag HTML khác, xuống dòng -> \\N"""
+    text = _HTML_TAG_RE.sub(lambda m: "{\\%s%d}" % (m.group(2).lower(), 0 if m.group(1) else 1), text)
+    text = _OTHER_TAG_RE.sub('', text)
+    text = _BLOCK_JOIN_RE.sub('', text)  # Gộp các block override liền nhau
+    return text.replace('\r', '').replace('\n', '\\N')
+
+class AssStreamWriter:
+    """
+    Ghi file ASS từng dòng một: header + style ghi trước, mỗi cue ghi thành 1 dòng Dialogue
+    Bộ nhớ dùng không phụ thuộc số cue.
+    """
+
+    def __init__(self, stream: TextIO, style: Optional[Dict] = None):
+        """
+        Args:
+            stream: File đầu ra đã mở ở chế độ text
+            style: Các field style đã chuẩn hóa (tên field kiểu pysubs2: fontname, fontsize, ...)
+        """
+        self.stream = stream
+        self.style = dict(DEFAULT_STYLE)
+        self.style.update(style or {})
+        self.count = 0
+
+    def _format_style(self) -> str:
+        values = []
+        for name, field in STYLE_FIELDS:
+            if field is None:
+                values.append("Default")
+            elif field.endswith('color'):
+                values.append(to_ass_color(self.style[field]))
+            else:
+                values.append(str(self.style[field]))
+        return "Style: " + ",".join(values)
+
+    def write_header(self):
+        """Ghi [Script Info], [V4+ Styles] và dòng Format của [Events]"""
+        self.stream.write(
+            "[Script Info]\n"
+            "WrapStyle: 0\n"
+            "ScaledBorderAndShadow: yes\n"
+            "Collisions: Normal\n"
+            "ScriptType: v4.00+\n"
+            "\n"
+            "[V4+ Styles]\n"
+            "Format: " + ", ".join(name for name, _ in STYLE_FIELDS) + "\n"
+            + self._format_style() + "\n"
+            "\n"
+            "[Events]\n"
+            "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+        )
+
+    def write_cue(self, start_ms: int, end_ms: int, text: str):
+        """Ghi 1 cue: thêm tag alignment, gộp với block override đầu dòng nếu có"""
+        alignment = "\\an%d" % int(self.style['alignment'])
+        leading = _LEADING_BLOCK_RE.match(text)
+        if leading:
+            text = "{%s%s}%s" % (alignment, leading.group(1), text[leading.end():])
+        else:
+            text = "{%s}%s" % (alignment, text)
+        self.stream.write(
+            f"Dialogue: 0,{ms_to_ass_time(start_ms)},{ms_to_ass_time(end_ms)},Default,,0,0,0,,{text}\n"
+        )
+        self.count += 1
+
+def convert_srt_stream(input_path: Path, output: TextIO, style: Optional[Dict] = None,
+                       offset_ms: int = 0) -> int:
+    """
+    Convert SRT -> ASS kiểu streaming
+    Args:
+        input_path: File SRT
+        output: File ASS đầu ra (text mode)
+        style: Field style đã chuẩn hóa
+        offset_ms: Cộng thêm vào thời gian mỗi cue
+    Returns:
+        int: Số cue đã ghi
+    """
+    writer = AssStreamWriter(output, style)
+    writer.write_header()
+    with open(input_path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        for start_ms, end_ms, text in iter_srt_cues(f):
+            writer.write_cue(start_ms + offset_ms, end_ms + offset_ms, srt_text_to_ass(text))
+    logging.info(f"Converted {writer.count} cues from {input_path}")
+    return writer.count
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+import psutil
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+from api.core.config import Settings
+from api.core.paths import path_manager
+from .encoding_profiles import encoding_profiles
+
+class BakedBackgroundCache:
+    """
+    Cache các clip nền đã burn sẵn bộ overlay (overlay1 + overlay2 đã gộp)
+
+    Key = (clip gốc: đường dẫn, size, mtime) + hash ảnh overlay đã gộp.
+    Khi request dùng lại bộ overlay quen thuộc, VideoProcessor ghép thẳng các
+    clip đã bake và bước render cuối chỉ còn burn subtitle.
+    Dung lượng cache bị giới hạn, file dùng lâu nhất (theo mtime) bị xóa trước.
+    Clip đang được một job dùng (có lease trong leases/, kể cả của process khác)
+    không bị xóa cho tới khi job đó xong.
+
+    Cấu hình trong config/settings.json:
+        workflows.video_maker.baked_overlay_cache: {"enabled": bool, "max_size_gb": float}
+    """
+
+    DEFAULT_MAX_SIZE_GB = 20.0
+
+    def __init__(self, cache_dir: Optional[Path] = None, max_size_gb: Optional[float] = None,
+                 enabled: Optional[bool] = None):
+        """
+        Args:
+            cache_dir: Thư mục cache, mặc định là <base_path>/cache/baked_backgrounds
+            max_size_gb: Dung lượng tối đa (GB), mặc định lấy từ settings
+            enabled: Bật/tắt cache, mặc định lấy từ settings
+        """
+        try:
+            config = Settings().get_workflow_settings("video_maker").get("baked_overlay_cache", {})
+        except Exception as e:
+            logging.error(f"Error loading baked overlay cache settings: {e}")
+            config = {}
+
+        self.enabled = bool(config.get("enabled", False)) if enabled is None else enabled
+        max_size_gb = max_size_gb if max_size_gb is not None else config.get("max_size_gb", self.DEFAULT_MAX_SIZE_GB)
+        self.max_size_bytes = int(float(max_size_gb) * 1024 ** 3)
+        self.cache_dir = Path(cache_dir) if cache_dir else path_manager.get_path("common", "cache") / "baked_backgrounds"
+        self.leases_dir = self.cache_dir / "leases"
+        self.leases_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def lease(self) -> "BakedCacheLease":
+        """
+        Lease cho 1 job: giữ các clip đã bake tới khi job xong
+        Returns:
+            BakedCacheLease: Dùng với with, truyền vào get_or_bake
+        """
+        return BakedCacheLease(self)
+
+    def cache_key(self, clip_path: Path, overlay_hash: str) -> str:
+        """Key cache của (clip, bộ overlay)"""
+        clip_path = Path(clip_path).resolve()
+        stat = clip_path.stat()
+        key = json.dumps({
+            "clip": str(clip_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "overlay": overlay_hash
+        }, sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def lookup(self, clip_path: Path, overlay_hash: str) -> Optional[Path]:
+        """Tìm clip đã bake, cập nhật mtime để đánh dấu vừa dùng"""
+        baked_path = self.cache_dir / f"{self.cache_key(clip_path, overlay_hash)}.mp4"
+        if baked_path.exists():
+            try:
+                os.utime(baked_path, None)
+            except OSError:
+                pass
+            return baked_path
+        return None
+
+    def get_or_bake(self, clip_path: Path, overlay: Tuple[Path, int, int],
+                    lease: Optional["BakedCacheLease"] = None) -> Path:
+        """
+        Lấy clip đã bake overlay, bake mới nếu chưa có
+        Args:
+            clip_path: Clip nền gốc
+            overlay: (ảnh overlay đã gộp, x, y) từ OverlayCompositor
+            lease: Lease của job đang dùng clip (clip không bị evict tới khi lease kết thúc)
+        Returns:
+            Path: Clip đã burn overlay
+        """
+        overlay_path, overlay_x, overlay_y = overlay
+        overlay_hash = Path(overlay_path).stem  # OverlayCompositor đặt tên file theo hash nội dung
+        if lease is not None:
+            # Giữ trước khi tra cache để process khác không xóa mất giữa lookup và lúc dùng
+            lease.pin(self.cache_key(clip_path, overlay_hash))
+        cached = self.lookup(clip_path, overlay_hash)
+        if cached:
+            logging.debug(f"Baked background cache hit: {clip_path}")
+            return cached
+
+        baked_path = self.cache_dir / f"{self.cache_key(clip_path, overlay_hash)}.mp4"
+        tmp_path = baked_path.with_name(f"{baked_path.stem}_{uuid.uuid4().hex[:8]}.tmp.mp4")
+
+        def build_cmd(video_codec: List[str]) -> List[str]:
+            return [
+                'ffmpeg', '-y',
+                '-i', str(clip_path),
+                '-i', str(overlay_path),
+                '-filter_complex', f"[0:v][1:v]overlay={overlay_x}:{overlay_y}[v]",
+                '-map', '[v]',
+                '-map', '0:a?',
+                '-c:a', 'copy'
+            ] + video_codec + [str(tmp_path)]
+
+        try:
+            encoding_profiles.run_encode(build_cmd, "overlay_bake")
+            tmp_path.replace(baked_path)
+            logging.info(f"Baked overlays into background {clip_path} -> {baked_path}")
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        self.evict()
+        return baked_path
+
+    def pinned_keys(self) -> Set[str]:
+        """Key các clip đang có lease còn sống, xóa lease của process đã chết"""
+        pinned = set()
+        for lease_file in self.leases_dir.glob("*.lease"):
+            key = lease_file.name.split(".", 1)[0]
+            if _lease_alive(lease_file):
+                pinned.add(key)
+                continue
+            try:
+                lease_file.unlink()
+                logging.debug(f"Removed stale baked background lease: {lease_file}")
+            except OSError:
+                pass
+        return pinned
+
+    def is_pinned(self, key: str) -> bool:
+        """Clip có đang được job nào giữ không"""
+        return any(_lease_alive(lease_file) for lease_file in self.leases_dir.glob(f"{key}.*.lease"))
+
+    def evict(self):
+        """Xóa các clip dùng lâu nhất cho tới khi cache nhỏ hơn giới hạn (bỏ qua clip đang có lease)"""
+        with self._lock:
+            pinned = self.pinned_keys()
+            entries = []
+            total_size = 0
+            for path in self.cache_dir.glob("*.mp4"):
+                if path.name.endswith(".tmp.mp4"):
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+            if total_size <= self.max_size_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size_bytes:
+                    break
+                # Kiểm tra lại ngay trước khi xóa: job khác có thể vừa lấy lease
+                if path.stem in pinned or self.is_pinned(path.stem):
+                    continue
+                try:
+                    path.unlink()
+                    total_size -= size
+                    logging.info(f"Evicted baked background: {path}")
+                except OSError as e:
+                    logging.warning(f"Could not evict baked background {path}: {e}")
+
+class BakedCacheLease:
+    """
+    Lease của 1 job trên BakedBackgroundCache
+
+    Mỗi clip job lấy từ cache có 1 file leases/<key>.<lease_id>.lease (ghi pid +
+    create_time của process), evict() bỏ qua các clip này kể cả khi chạy ở worker
+    process khác. Lease của process đã chết (crash, bị kill) bị coi là hết hạn.
+    Hết job (thoát with) thì bỏ lease và evict phần vượt giới hạn.
+    """
+
+    def __init__(self, cache: BakedBackgroundCache):
+        self.cache = cache
+        self.lease_id = uuid.uuid4().hex[:12]
+        self._files: List[Path] = []
+
+    def pin(self, key: str):
+        """Giữ clip có key này tới khi lease kết thúc"""
+        lease_file = self.cache.leases_dir / f"{key}.{self.lease_id}.lease"
+        if lease_file in self._files:
+            return
+        process = psutil.Process()
+        lease_file.write_text(
+            json.dumps({"pid": process.pid, "create_time": process.create_time()}),
+            encoding='utf-8'
+        )
+        self._files.append(lease_file)
+
+    def release(self):
+        """Bỏ toàn bộ lease của job"""
+        for lease_file in self._files:
+            try:
+                lease_file.unlink(missing_ok=True)
+            except OSError as e:
+                logging.warning(f"Could not remove baked background lease {lease_file}: {e}")
+        self._files.clear()
+
+    def __enter__(self) -> "BakedCacheLease":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pinned = bool(self._files)
+        self.release()
+        if pinned:
+            # Các lần bake trong job có thể đã vượt giới hạn vì clip đang giữ không xóa được
+            try:
+                self.cache.evict()
+            except Exception as e:
+                logging.warning(f"Could not evict baked backgrounds: {e}")
+        return False
+
+def _lease_alive(lease_file: Path) -> bool:
+    """Process giữ lease còn sống không (so cả create_time để tránh pid bị dùng lại)"""
+    try:
+        owner = json.loads(lease_file.read_text(encoding='utf-8'))
+        process = psutil.Process(int(owner["pid"]))
+        return abs(process.create_time() - float(owner.get("create_time", 0))) < 1.0
+    except FileNotFoundError:
+        return False
+    except (psutil.Error, OSError, KeyError, ValueError, TypeError):
+        return False
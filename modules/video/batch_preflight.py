@@ -0,0 +1,248 @@
+import json
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from .subtitle_processor import SubtitleProcessor
+from .error_policy import PERMANENT, classify_ffmpeg_output, mark_input_error
+from ..utils.job_queue import input_fingerprint
+
+# Các file cần có trong 1 nhóm batch
+REQUIRED_FILES = ('hook_audio', 'main_audio', 'subtitle', 'thumbnail')
+
+# Số file probe song song (ffprobe chủ yếu chờ I/O)
+PREFLIGHT_WORKERS = 8
+
+# Timeout của 1 lần ffprobe (giây)
+PROBE_TIMEOUT = 30
+
+# Số video nền probe thử để chắc thư mục nền dùng được
+BACKGROUND_SAMPLE = 3
+
+def find_batch_groups(folder_path: Path) -> List[Tuple[str, Dict[str, Path]]]:
+    """
+    Gom các file trong thư mục thành nhóm theo tên gốc
+      {name}_hook.mp3|wav, {name}_audio.mp3|wav, {name}.srt|ass, {name}_hook.png
+    Args:
+        folder_path: Thư mục đầu vào
+    Returns:
+        List[Tuple[str, Dict[str, Path]]]: [(tên nhóm, {loại file: đường dẫn})] các nhóm đủ file,
+        theo thứ tự tên
+    """
+    file_groups: Dict[str, Dict[str, Path]] = {}
+    for file in Path(folder_path).iterdir():
+        if not file.is_file():
+            continue
+        name = file.name.lower()
+        stem = file.stem.lower()
+
+        # Loại bỏ các hậu tố đặc biệt để lấy tên gốc
+        for suffix in ['_hook', '_audio']:
+            if stem.endswith(suffix):
+                stem = stem[:-len(suffix)]
+
+        group = file_groups.setdefault(stem, {})
+        if name.endswith('_hook.png'):
+            group['thumbnail'] = file
+        elif name.endswith(('_hook.wav', '_hook.mp3')):
+            group['hook_audio'] = file
+        elif name.endswith(('_audio.wav', '_audio.mp3')):
+            group['main_audio'] = file
+        elif file.suffix.lower() in ('.srt', '.ass'):
+            group['subtitle'] = file
+
+    return [
+        (name, group) for name, group in sorted(file_groups.items())
+        if all(key in group for key in REQUIRED_FILES)
+    ]
+
+def group_fingerprint(group: Dict[str, Path], settings: Optional[Dict] = None) -> Optional[str]:
+    """
+    Dấu vân tay nội dung các file của 1 nhóm + cài đặt render của batch (để quarantine)
+    Args:
+        settings: Cài đặt render đã resolve (preset, tỉ lệ, thư mục nền, draft)
+    """
+    return input_fingerprint((group.get(key) for key in REQUIRED_FILES), settings)
+
+def probe_media(path: Path) -> Dict:
+    """
+    Đọc duration và loại stream của 1 file media bằng ffprobe
+    Returns:
+        Dict: {'duration': float, 'streams': ['audio', 'video', ...]}
+    Raises:
+        ValueError: File không đọc được; file hỏng/sai định dạng được gắn PERMANENT
+            (mark_input_error), timeout/lỗi khác thì không
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration:stream=codec_type',
+        '-of', 'json',
+        str(path)
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise ValueError(f"ffprobe timed out after {PROBE_TIMEOUT}s")
+    if result.returncode != 0:
+        message = (result.stderr or '').strip().splitlines()
+        error = ValueError(message[-1] if message else f"ffprobe exited with code {result.returncode}")
+        if classify_ffmpeg_output(result.stderr) == PERMANENT:
+            mark_input_error(error, path)
+        raise error
+    try:
+        info = json.loads(result.stdout or '{}')
+        duration = float(info.get('format', {}).get('duration') or 0)
+    except (ValueError, TypeError):
+        raise mark_input_error(ValueError("ffprobe returned no duration"), path)
+    return {
+        'duration': duration,
+        'streams': [stream.get('codec_type') for stream in info.get('streams', [])]
+    }
+
+class PreflightResult:
+    """Kết quả kiểm tra 1 nhóm file"""
+
+    def __init__(self, name: str, group: Dict[str, Path]):
+        self.name = name
+        self.group = group
+        self.problems: List[str] = []
+        self.hook_duration = 0.0
+        self.audio_duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def reason(self) -> str:
+        return "; ".join(self.problems)
+
+class BatchPreflight:
+    """
+    Kiểm tra toàn bộ batch trước khi render
+
+    Probe song song mọi file đầu vào (audio hỏng, thumbnail không mở được, phụ đề
+    rỗng hoặc lệch thời gian so với audio, thư mục nền không dùng được) để loại
+    nhóm lỗi ngay từ đầu thay vì khi tới lượt encode.
+    """
+
+    def __init__(self, subtitle_processor: Optional[SubtitleProcessor] = None, workers: int = PREFLIGHT_WORKERS,
+                 quarantine=None, render_settings: Optional[Dict] = None):
+        """
+        Args:
+            subtitle_processor: Dùng để kiểm tra thời gian phụ đề
+            workers: Số file probe song song
+            quarantine: JobQueue (hoặc object có quarantined(fingerprint)) để loại nhóm đã
+                lỗi permanent ở lần chạy trước; None = không kiểm tra
+            render_settings: Cài đặt render của batch, gộp vào dấu vân tay (group_fingerprint)
+        """
+        self.subtitle_processor = subtitle_processor or SubtitleProcessor()
+        self.workers = max(1, workers)
+        self.quarantine = quarantine
+        self.render_settings = render_settings
+
+    def check(
+        self,
+        groups: List[Tuple[str, Dict[str, Path]]],
+        bg_path: Optional[Path] = None
+    ) -> Tuple[List[Tuple[str, Dict[str, Path]]], List[PreflightResult]]:
+        """
+        Kiểm tra các nhóm file
+        Args:
+            groups: [(tên nhóm, {loại file: đường dẫn})]
+            bg_path: Thư mục video nền (None = không kiểm tra)
+        Returns:
+            (nhóm hợp lệ, kết quả của các nhóm bị loại)
+        """
+        if not groups:
+            return [], []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(groups) + 1),
+                                thread_name_prefix="preflight") as pool:
+            background = pool.submit(self.check_background, bg_path) if bg_path is not None else None
+            results = list(pool.map(lambda entry: self.check_group(*entry), groups))
+            background_problem = background.result() if background else None
+
+        if background_problem:
+            # Không có nền thì không nhóm nào render được
+            for result in results:
+                result.problems.append(background_problem)
+
+        accepted = [(result.name, result.group) for result in results if result.ok]
+        rejected = [result for result in results if not result.ok]
+        for result in rejected:
+            logging.warning(f"Preflight rejected group {result.name}: {result.reason()}")
+        logging.info(f"Preflight: {len(accepted)} groups ok, {len(rejected)} rejected")
+        return accepted, rejected
+
+    def check_group(self, name: str, group: Dict[str, Path]) -> PreflightResult:
+        """Kiểm tra 1 nhóm file"""
+        result = PreflightResult(name, group)
+        for key in REQUIRED_FILES:
+            path = group.get(key)
+            if path is None:
+                result.problems.append(f"missing {key}")
+            elif not Path(path).is_file():
+                result.problems.append(f"{key} not found: {Path(path).name}")
+            elif Path(path).stat().st_size == 0:
+                result.problems.append(f"{key} is empty: {Path(path).name}")
+        if result.problems:
+            return result
+
+        if self.quarantine is not None:
+            entry = self.quarantine.quarantined(group_fingerprint(group, self.render_settings))
+            if entry:
+                result.problems.append(f"quarantined after permanent failure: {entry['error']}")
+                return result
+
+        result.hook_duration = self._check_audio(result, 'hook_audio')
+        result.audio_duration = self._check_audio(result, 'main_audio')
+        self._check_thumbnail(result)
+
+        problems = self.subtitle_processor.check_subtitle_timing(group['subtitle'], result.audio_duration)
+        result.problems.extend(f"subtitle: {problem}" for problem in problems)
+        return result
+
+    def check_background(self, bg_path: Path) -> Optional[str]:
+        """
+        Thư mục nền có video đọc được không
+        Returns:
+            str: Lý do nếu không dùng được, None nếu ổn
+        """
+        bg_path = Path(bg_path)
+        if not bg_path.is_dir():
+            return f"background folder not found: {bg_path}"
+        videos = sorted(bg_path.glob('*.mp4'))
+        if not videos:
+            return f"no background videos (*.mp4) in {bg_path}"
+        errors = []
+        for video in videos[:BACKGROUND_SAMPLE]:
+            try:
+                info = probe_media(video)
+                if info['duration'] > 0 and 'video' in info['streams']:
+                    return None
+                errors.append(f"{video.name}: no video stream")
+            except ValueError as e:
+                errors.append(f"{video.name}: {e}")
+        return f"background videos unreadable ({'; '.join(errors)})"
+
+    def _check_audio(self, result: PreflightResult, key: str) -> float:
+        path = result.group[key]
+        try:
+            info = probe_media(path)
+        except ValueError as e:
+            result.problems.append(f"{key} unreadable ({path.name}): {e}")
+            return 0.0
+        if 'audio' not in info['streams']:
+            result.problems.append(f"{key} has no audio stream: {path.name}")
+        elif info['duration'] <= 0:
+            result.problems.append(f"{key} has zero duration: {path.name}")
+        return info['duration']
+
+    def _check_thumbnail(self, result: PreflightResult):
+        path = result.group['thumbnail']
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except Exception as e:
+            result.problems.append(f"thumbnail unreadable ({path.name}): {e}")
@@ -0,0 +1,392 @@
+import copy
+import logging
+import subprocess
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from api.core.config import Settings
+from .ffmpeg_runner import FFmpegError, run_ffmpeg
+from .error_policy import PERMANENT, classify_ffmpeg_output, is_gpu_error
+
+# Profile mặc định (nguồn duy nhất), config/settings.json -> common.encoding.profiles chỉ chứa phần ghi đè
+# Mỗi profile có tham số encoder cho GPU (NVENC) và bản CPU (libx264) dùng khi không có GPU
+DEFAULT_PROFILES: Dict[str, Dict[str, List[str]]] = {
+    "draft": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p1',
+            '-rc', 'vbr',
+            '-cq', '32',
+            '-b:v', '0',
+            '-pix_fmt', 'yuv420p'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-crf', '32',
+            '-pix_fmt', 'yuv420p'
+        ]
+    },
+    "intermediate": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p4',
+            '-rc', 'vbr',
+            '-cq', '18',
+            '-b:v', '0'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-crf', '18'
+        ]
+    },
+    "final": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p4',
+            '-tune', 'hq',
+            '-rc', 'vbr',
+            '-cq', '20',
+            '-b:v', '4M',
+            '-maxrate', '6M',
+            '-bufsize', '8M',
+            '-profile:v', 'high',
+            '-g', '60',
+            '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-crf', '23',
+            '-maxrate', '6M',
+            '-bufsize', '8M',
+            '-profile:v', 'high',
+            '-g', '60',
+            '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart'
+        ]
+    },
+    "archive": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p7',
+            '-rc:v', 'vbr_hq',
+            '-cq:v', '18',
+            '-b:v', '0',
+            '-profile:v', 'high',
+            '-pix_fmt', 'yuv420p'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'slow',
+            '-crf', '18',
+            '-profile:v', 'high',
+            '-pix_fmt', 'yuv420p'
+        ]
+    },
+    # Các profile dưới đây giữ nguyên tham số encode trước khi có registry
+    # (chất lượng đầu ra không đổi); đổi sang draft/final/... trong common.encoding.stages nếu muốn
+    "hook_thumbnail": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p4',
+            '-tune', 'hq',
+            '-rc', 'cbr',        # CBR 4Mbps
+            '-b:v', '4M',
+            '-minrate', '4M',
+            '-maxrate', '4M',
+            '-bufsize', '4M',
+            '-profile:v', 'high',
+            '-g', '60'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-crf', '23',
+            '-b:v', '4M',
+            '-maxrate', '5M',
+            '-bufsize', '8M',
+            '-profile:v', 'high',
+            '-g', '60',
+            '-movflags', '+faststart'
+        ]
+    },
+    "hook_subtitle": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'slow',
+            '-profile:v', 'high',
+            '-level', '4.2',
+            '-rc', 'vbr_hq',
+            '-cq', '19',
+            '-b:v', '0',
+            '-maxrate', '20M',
+            '-bufsize', '40M',
+            '-pix_fmt', 'yuv420p'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'slow',
+            '-crf', '19',
+            '-maxrate', '20M',
+            '-bufsize', '40M',
+            '-profile:v', 'high',
+            '-level', '4.2',
+            '-pix_fmt', 'yuv420p'
+        ]
+    },
+    "hook_concat": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p4',
+            '-tune', 'hq',
+            '-rc', 'vbr',
+            '-cq', '20',
+            '-b:v', '4M',
+            '-maxrate', '6M',
+            '-bufsize', '8M',
+            '-profile:v', 'high',
+            '-g', '30',
+            '-keyint_min', '30'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-crf', '23',
+            '-maxrate', '6M',
+            '-bufsize', '8M',
+            '-profile:v', 'high',
+            '-g', '30',
+            '-keyint_min', '30'
+        ]
+    },
+    "video_final": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p7',
+            '-rc', 'vbr',
+            '-cq', '20',
+            '-b:v', '0'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-crf', '23'
+        ]
+    },
+    "subtitle_burn": {
+        "gpu": [
+            '-c:v', 'h264_nvenc',
+            '-preset', 'p4',
+            '-b:v', '2500k'
+        ],
+        "cpu": [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-crf', '23',
+            '-b:v', '2500k'
+        ]
+    }
+}
+
+# Stage của pipeline -> tên profile
+DEFAULT_STAGES: Dict[str, str] = {
+    "ingest": "archive",          # VideoCutter: chuẩn hóa và cắt video raw
+    "smart_cut": "intermediate",  # SmartCutter: encode lại GOP ở biên
+    "background": "intermediate", # HookBackgroundProcessor: scale video nền 9:16
+    "video_concat": "intermediate",  # VideoProcessor: nối các clip nền
+    "video_final": "video_final", # VideoProcessor: overlay + subtitle
+    "overlay_bake": "intermediate",  # BakedBackgroundCache: burn overlay vào clip nền
+    "hook_thumbnail": "hook_thumbnail",  # HookVideoProcessor: thumbnail + fade
+    "hook_subtitle": "hook_subtitle",    # HookVideoProcessor: phần chính + subtitle
+    "hook_concat": "hook_concat",        # HookVideoProcessor: nối hook + phần chính
+    "subtitle_burn": "subtitle_burn"     # SubtitleProcessor.create_ass_subtitle
+}
+
+DEFAULT_VIDEO_SETTINGS = {
+    "width": 1920,
+    "height": 1080,
+    "fps": 30
+}
+
+# Chế độ draft: render nhanh để xem thử preset
+DEFAULT_DRAFT_SETTINGS = {
+    "height": 480,      # Cạnh ngắn của khung hình (480p)
+    "fps": 15,
+    "duration": None    # Chỉ render N giây đầu (None = toàn bộ)
+}
+
+class EncodingProfiles:
+    """
+    Registry các encoding profile (draft, intermediate, final, archive và profile riêng của vài stage)
+
+    Đọc từ config/settings.json:
+        common.encoding.use_gpu: "auto" | true | false
+        common.encoding.profiles: {"<name>": {"gpu": [...], "cpu": [...]}}
+        common.encoding.stages: {"<stage>": "<profile name>"}
+        common.encoding.draft: {"height", "fps", "duration"}
+        workflows.video_maker.video_settings: {"width", "height", "fps"}
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self._settings = settings
+        self._gpu_available: Optional[bool] = None
+        self._gpu_lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Load lại profiles từ settings"""
+        try:
+            settings = self._settings or Settings()
+            encoding = settings.get_common_settings().get("encoding", {})
+            video_settings = settings.get_workflow_settings("video_maker").get("video_settings", {})
+        except Exception as e:
+            logging.error(f"Error loading encoding settings: {e}")
+            encoding, video_settings = {}, {}
+
+        self.profiles = copy.deepcopy(DEFAULT_PROFILES)
+        for name, profile in encoding.get("profiles", {}).items():
+            merged = self.profiles.setdefault(name, {})
+            merged.update({key: list(map(str, args)) for key, args in profile.items() if key in ("gpu", "cpu")})
+            if "cpu" not in merged:
+                # Profile nào cũng phải có bản CPU
+                logging.warning(f"Encoding profile '{name}' has no CPU variant, using 'final' CPU args")
+                merged["cpu"] = list(self.profiles["final"]["cpu"])
+
+        self.stages = dict(DEFAULT_STAGES)
+        self.stages.update(encoding.get("stages", {}))
+        self.use_gpu = encoding.get("use_gpu", "auto")
+
+        self.video_settings = dict(DEFAULT_VIDEO_SETTINGS)
+        self.video_settings.update(video_settings)
+
+        self.draft_settings = dict(DEFAULT_DRAFT_SETTINGS)
+        self.draft_settings.update(encoding.get("draft", {}))
+
+    def gpu_available(self) -> bool:
+        """Check NVENC support once per process"""
+        if self.use_gpu is False or self.use_gpu == "false":
+            return False
+        with self._gpu_lock:
+            if self._gpu_available is None:
+                try:
+                    result = subprocess.run(
+                        ['ffmpeg', '-hide_banner', '-encoders'],
+                        capture_output=True,
+                        text=True,
+                        check=True
+                    )
+                    self._gpu_available = 'h264_nvenc' in result.stdout
+                except Exception:
+                    self._gpu_available = False
+                logging.info(f"NVENC available: {self._gpu_available}")
+            return self._gpu_available
+
+    def profile_for_stage(self, stage: str, draft: bool = False) -> str:
+        """Lấy tên profile cho một stage (mọi stage dùng profile 'draft' khi render draft)"""
+        profile = "draft" if draft else self.stages.get(stage, "final")
+        if profile not in self.profiles:
+            logging.warning(f"Unknown encoding profile '{profile}' for stage '{stage}', using 'final'")
+            profile = "final"
+        return profile
+
+    def video_args(self, profile: str, gpu: Optional[bool] = None) -> List[str]:
+        """
+        Lấy tham số encoder của một profile
+        Args:
+            profile: Tên profile
+            gpu: True/False để ép GPU/CPU, None = tự động
+        Returns:
+            List[str]: Tham số ffmpeg
+        """
+        entry = self.profiles.get(profile) or self.profiles["final"]
+        if gpu is None:
+            gpu = self.gpu_available()
+        if gpu and "gpu" in entry:
+            return list(entry["gpu"])
+        return list(entry["cpu"])
+
+    def stage_args(self, stage: str, gpu: Optional[bool] = None, draft: bool = False) -> List[str]:
+        """Lấy tham số encoder cho một stage"""
+        return self.video_args(self.profile_for_stage(stage, draft), gpu)
+
+    def encoding_settings(self, stage: str, gpu: Optional[bool] = None, draft: bool = False) -> dict:
+        """Tham số encoder dạng {'hwaccel': [...], 'video_codec': [...]} như các processor đang dùng"""
+        return {
+            'hwaccel': [],
+            'video_codec': self.stage_args(stage, gpu, draft)
+        }
+
+    def draft_size(self, is_vertical: bool = False) -> Tuple[int, int]:
+        """
+        Kích thước khung hình draft, giữ tỉ lệ của video_settings
+        Args:
+            is_vertical: True nếu là video dọc (9:16)
+        Returns:
+            Tuple[int, int]: (width, height), luôn chẵn
+        """
+        short_side = int(self.draft_settings.get("height", 480))
+        width = int(self.video_settings.get("width", 1920))
+        height = int(self.video_settings.get("height", 1080))
+        long_side = int(round(short_side * max(width, height) / min(width, height) / 2)) * 2
+        short_side -= short_side % 2
+        return (short_side, long_side) if is_vertical else (long_side, short_side)
+
+    def draft_duration(self, duration: Optional[float] = None) -> Optional[float]:
+        """Độ dài draft: giá trị truyền vào, nếu không có thì lấy trong settings"""
+        duration = duration or self.draft_settings.get("duration")
+        return float(duration) if duration else None
+
+    @staticmethod
+    def draft_output_path(output_path: Path) -> Path:
+        """Thêm hậu tố _draft vào tên file đầu ra để không ghi đè bản final"""
+        output_path = Path(output_path)
+        if output_path.stem.endswith("_draft"):
+            return output_path
+        return output_path.with_name(f"{output_path.stem}_draft{output_path.suffix}")
+
+    @staticmethod
+    def as_kwargs(args: List[str]) -> Dict[str, Optional[str]]:
+        """Chuyển ['-c:v', 'libx264', ...] thành kwargs cho ffmpeg-python"""
+        kwargs = {}
+        i = 0
+        while i < len(args):
+            key = args[i].lstrip('-')
+            if i + 1 < len(args) and not args[i + 1].startswith('-'):
+                kwargs[key] = args[i + 1]
+                i += 2
+            else:
+                kwargs[key] = None
+                i += 1
+        return kwargs
+
+    def run_encode(self, build_cmd: Callable[[List[str]], List[str]], stage: str,
+                   draft: bool = False, **run_kwargs):
+        """
+        Chạy lệnh encode cho một stage, tự chuyển sang CPU nếu GPU encode lỗi
+        Args:
+            build_cmd: Hàm nhận tham số encoder và trả về lệnh ffmpeg đầy đủ
+            stage: Tên stage
+            draft: Dùng profile 'draft' thay cho profile của stage
+            run_kwargs: Tham số thêm cho run_ffmpeg (vd. expected_duration)
+        """
+        use_gpu = self.gpu_available()
+        cmd = build_cmd(self.stage_args(stage, use_gpu, draft))
+        logging.info(f"Running FFmpeg command ({stage}): {' '.join(cmd)}")
+        try:
+            return run_ffmpeg(cmd, stage, **run_kwargs)
+        except FFmpegError as e:
+            # Chỉ fallback khi encoder lỗi; lệnh bị treo/quá timeout thì chạy lại bằng CPU cũng vô ích
+            if not use_gpu or e.reason != 'exit':
+                raise
+            # Đầu vào không decode được (không liên quan GPU): encode lại bằng CPU vẫn lỗi
+            if not is_gpu_error(e.stderr) and classify_ffmpeg_output(e.stderr) == PERMANENT:
+                raise
+            logging.warning(f"GPU encoding failed for stage '{stage}', falling back to CPU: {e.stderr}")
+            cmd = build_cmd(self.stage_args(stage, False, draft))
+            return run_ffmpeg(cmd, stage, **run_kwargs)
+
+# Shared registry instance
+encoding_profiles = EncodingProfiles()
@@ -0,0 +1,200 @@
+import re
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, TypeVar
+from api.core.config import Settings
+from ..utils.cancellation import TaskCancelledError, sleep_unless_cancelled
+from ..utils.job_workspace import current_workspace
+
+# Loại lỗi
+TRANSIENT = "transient"   # Thiếu tài nguyên, I/O, timeout: thử lại có thể thành công
+PERMANENT = "permanent"   # File đầu vào hỏng (probe/decode lỗi, xem mark_input_error): thử lại vẫn lỗi
+
+# Mặc định, ghi đè bằng common.retry trong config/settings.json
+DEFAULT_RETRY_SETTINGS = {
+    "max_attempts": 3,    # Tổng số lần chạy 1 stage khi lỗi transient
+    "base_delay": 2.0,    # Chờ base_delay * 2^(lần thử - 1) giây trước lần thử tiếp
+    "max_delay": 30.0
+}
+
+# stderr ffmpeg => lỗi của GPU/NVENC (chạy lại bằng CPU sẽ được)
+_GPU_PATTERNS = re.compile(
+    r"nvenc|cuda|cuvid|nvcuda|hwaccel|OpenEncodeSessionEx|No capable devices found|"
+    r"Driver does not support the required nvenc API",
+    re.IGNORECASE
+)
+
+# stderr ffmpeg => thiếu tài nguyên/lỗi I/O tạm thời
+_TRANSIENT_PATTERNS = re.compile(
+    r"No space left on device|Cannot allocate memory|out of memory|Resource temporarily unavailable|"
+    r"Device or resource busy|Input/output error|Too many open files|Broken pipe|Connection (reset|refused|timed out)|"
+    r"Permission denied|being used by another process",
+    re.IGNORECASE
+)
+
+# stderr ffmpeg => không decode/probe được file đầu vào (file hỏng, sai định dạng)
+# Thiếu file, sai tham số, thiếu filter/encoder là lỗi của lệnh/môi trường, không phải của đầu vào
+_PERMANENT_PATTERNS = re.compile(
+    r"Invalid data found when processing input|moov atom not found|does not contain any stream|"
+    r"could not find codec parameters|Invalid duration",
+    re.IGNORECASE
+)
+
+T = TypeVar("T")
+
+def is_gpu_error(stderr: Optional[str]) -> bool:
+    """stderr của ffmpeg cho thấy lỗi nằm ở GPU encode/decode"""
+    return bool(stderr and _GPU_PATTERNS.search(stderr))
+
+def classify_ffmpeg_output(stderr: Optional[str]) -> str:
+    """
+    Phân loại lỗi ffmpeg (exit code != 0) theo stderr: PERMANENT khi ffmpeg không
+    decode được đầu vào. Chỉ biết file nào hỏng ở chỗ gọi (xem mark_input_error).
+    Returns:
+        str: TRANSIENT hoặc PERMANENT (không nhận ra thì coi là TRANSIENT)
+    """
+    if not stderr:
+        return TRANSIENT
+    if _TRANSIENT_PATTERNS.search(stderr):
+        return TRANSIENT
+    if _PERMANENT_PATTERNS.search(stderr):
+        return PERMANENT
+    return TRANSIENT
+
+def classify_error(error: BaseException) -> str:
+    """
+    Phân loại lỗi của 1 stage pipeline
+
+    Chỉ lỗi đã được gắn loại (mark_error/mark_input_error ở chỗ probe/decode file đầu
+    vào) là PERMANENT; loại exception (ValueError, FileNotFoundError, ...) hay stderr
+    của ffmpeg không cho biết lỗi nằm ở đầu vào hay ở preset/môi trường nên coi là TRANSIENT.
+    Args:
+        error: Exception (lỗi bọc ngoài như HTTPException được xét theo lỗi gốc)
+    Returns:
+        str: TRANSIENT hoặc PERMANENT
+    """
+    kind = getattr(error, "error_kind", None)
+    if kind:
+        return kind
+
+    cause = error.__cause__ or error.__context__
+    if cause is not None and cause is not error:
+        return classify_error(cause)
+    return TRANSIENT
+
+def mark_error(error: BaseException, kind: str) -> BaseException:
+    """Gắn loại lỗi vào exception (để tầng ngoài không phân loại lại)"""
+    try:
+        error.error_kind = kind
+    except AttributeError:
+        pass
+    return error
+
+def mark_input_error(error: BaseException, input_path) -> BaseException:
+    """
+    Gắn PERMANENT cho lỗi probe/decode 1 file đầu vào (file hỏng, không phải lỗi môi trường)
+    Args:
+        error: Exception
+        input_path: File đầu vào không đọc được
+    Returns:
+        error (để raise tiếp)
+    """
+    mark_error(error, PERMANENT)
+    try:
+        error.input_path = str(input_path)
+    except AttributeError:
+        pass
+    return error
+
+def is_input_failure(error: BaseException) -> bool:
+    """ffmpeg thoát lỗi vì không decode được đầu vào (không tính timeout/treo)"""
+    return getattr(error, "reason", "exit") == "exit" and classify_ffmpeg_output(getattr(error, "stderr", None)) == PERMANENT
+
+def failed_input(error: BaseException) -> Optional[str]:
+    """File đầu vào gây lỗi permanent (mark_input_error), xét cả lỗi gốc; None nếu không có"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        input_path = getattr(error, "input_path", None)
+        if input_path:
+            return input_path
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+def get_retry_settings() -> Dict:
+    """Cấu hình retry (common.retry)"""
+    retry_settings = dict(DEFAULT_RETRY_SETTINGS)
+    try:
+        retry_settings.update(Settings().get_common_settings().get("retry", {}))
+    except Exception as e:
+        logging.error(f"Error loading retry settings: {e}")
+    return retry_settings
+
+class RetryPolicy:
+    """Số lần thử và backoff mũ có trần cho lỗi transient"""
+
+    def __init__(self, max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None):
+        settings = get_retry_settings()
+        self.max_attempts = max(1, int(max_attempts if max_attempts is not None else settings["max_attempts"]))
+        self.base_delay = float(base_delay if base_delay is not None else settings["base_delay"])
+        self.max_delay = float(max_delay if max_delay is not None else settings["max_delay"])
+
+    def delay(self, attempt: int) -> float:
+        """Thời gian chờ sau lần thử thứ attempt (bắt đầu từ 1)"""
+        return min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+
+def run_stage(name: str, fn: Callable[..., T], *args, policy: Optional[RetryPolicy] = None,
+              outputs: Sequence[Path] = (), **kwargs) -> T:
+    """
+    Chạy 1 bước của pipeline, chỉ thử lại bước này khi lỗi transient
+
+    Lỗi permanent (file đầu vào hỏng) raise ngay; lỗi transient được thử
+    lại với backoff mũ tới policy.max_attempts lần. Exception raise ra ngoài có
+    error_kind = TRANSIENT/PERMANENT và pipeline_stage = tên bước lỗi.
+
+    Trong workspace resumable, bước đã xong ở lần chạy trước (marker + đầu ra còn đủ)
+    không chạy lại mà trả về giá trị đã lưu; bước xong được ghi marker.
+    Args:
+        name: Tên bước (để log, tên checkpoint; duy nhất trong 1 job)
+        fn: Hàm thực hiện bước
+        policy: RetryPolicy, mặc định theo settings
+        outputs: File bước này ghi ra (để kiểm tra checkpoint còn dùng được)
+    Returns:
+        Giá trị trả về của fn
+    """
+    workspace = current_workspace()
+    checkpoints = workspace.stages if workspace is not None else None
+    if checkpoints is not None:
+        done, value = checkpoints.resume(name, outputs)
+        if done:
+            return value
+
+    policy = policy or RetryPolicy()
+    attempt = 1
+    while True:
+        try:
+            value = fn(*args, **kwargs)
+            if checkpoints is not None:
+                checkpoints.complete(name, value, outputs)
+            return value
+        except TaskCancelledError:
+            raise
+        except Exception as e:
+            kind = classify_error(e)
+            mark_error(e, kind)
+            if getattr(e, "pipeline_stage", None) is None:
+                try:
+                    e.pipeline_stage = name
+                except AttributeError:
+                    pass
+            if kind == PERMANENT or attempt >= policy.max_attempts:
+                logging.error(f"Stage '{name}' failed ({kind}, attempt {attempt}/{policy.max_attempts}): {e}")
+                raise
+            delay = policy.delay(attempt)
+            logging.warning(
+                f"Stage '{name}' failed ({kind}, attempt {attempt}/{policy.max_attempts}), "
+                f"retrying in {delay:.1f}s: {e}"
+            )
+            sleep_unless_cancelled(delay)
+            attempt += 1
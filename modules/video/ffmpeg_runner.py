@@ -0,0 +1,285 @@
+import os
+import re
+import time
+import logging
+import subprocess
+import threading
+import psutil
+from collections import deque
+from typing import Dict, List, Optional
+from api.core.config import Settings
+from ..utils.progress import get_progress
+from ..utils.cancellation import TaskCancelledError, get_cancel_token
+
+_DURATION_ARG_RE = re.compile(r'^(?:(\d+):)?(?:(\d+):)?(\d+(?:\.\d+)?)$')
+
+# Mặc định, có thể ghi đè trong config/settings.json -> common.ffmpeg_runner
+DEFAULT_RUNNER_SETTINGS = {
+    "stderr_lines": 200,        # Số dòng stderr cuối cùng được giữ lại
+    "timeout_factor": 4.0,      # Timeout = độ dài đầu ra * timeout_factor + timeout_grace
+    "timeout_grace": 120,       # Giây
+    "default_timeout": 3600,    # Timeout khi không biết độ dài đầu ra (giây)
+    "stall_timeout": 180        # Kill nếu ffmpeg không tiến thêm trong N giây
+}
+
+def parse_time(value: str) -> Optional[float]:
+    """'HH:MM:SS.ms' hoặc số giây -> giây"""
+    match = _DURATION_ARG_RE.match(str(value).strip())
+    if not match:
+        return None
+    parts = [p for p in match.groups() if p is not None]
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def expected_output_duration(cmd: List[str]) -> Optional[float]:
+    """Độ dài đầu ra lấy từ tham số -t của lệnh (nếu có)"""
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == '-t':
+            return parse_time(cmd[i + 1])
+    return None
+
+def with_progress_args(cmd: List[str]) -> List[str]:
+    """Thêm -progress pipe:1 -nostats ngay sau 'ffmpeg'"""
+    if not cmd or '-progress' in cmd:
+        return list(cmd)
+    return [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+
+def parse_progress_block(block: Dict[str, str]) -> Dict[str, Optional[float]]:
+    """
+    Chuyển 1 block key=value của -progress thành số
+    Returns:
+        dict: out_time (giây), fps, speed (hệ số realtime)
+    """
+    out_time = None
+    if block.get('out_time_us', 'N/A') not in ('N/A', ''):
+        out_time = int(block['out_time_us']) / 1_000_000
+    elif block.get('out_time_ms', 'N/A') not in ('N/A', ''):
+        # out_time_ms thực chất là micro giây (lỗi đặt tên lâu đời của ffmpeg)
+        out_time = int(block['out_time_ms']) / 1_000_000
+    elif block.get('out_time'):
+        out_time = parse_time(block['out_time'])
+
+    fps = None
+    try:
+        fps = float(block['fps']) if block.get('fps') not in (None, 'N/A', '') else None
+    except ValueError:
+        pass
+
+    speed = None
+    raw_speed = block.get('speed', '').rstrip('x').strip()
+    if raw_speed and raw_speed != 'N/A':
+        try:
+            speed = float(raw_speed)
+        except ValueError:
+            pass
+    return {"out_time": out_time, "fps": fps, "speed": speed}
+
+def kill_process_tree(process: subprocess.Popen):
+    """Kill ffmpeg và mọi process con của nó"""
+    try:
+        children = psutil.Process(process.pid).children(recursive=True)
+    except psutil.Error:
+        children = []
+    for child in children:
+        try:
+            child.kill()
+        except psutil.Error:
+            pass
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+class FFmpegResult:
+    """Kết quả 1 lần chạy ffmpeg"""
+
+    def __init__(self, cmd: List[str], returncode: int, wall_time: float, log_tail: List[str],
+                 stage: Optional[str] = None, reason: Optional[str] = None):
+        """
+        Args:
+            cmd: Lệnh đã chạy
+            returncode: Exit code
+            wall_time: Thời gian chạy (giây)
+            log_tail: Các dòng stderr cuối cùng
+            stage: Tên stage
+            reason: None nếu ffmpeg tự kết thúc, 'timeout', 'stall' hoặc 'cancelled' nếu bị kill
+        """
+        self.cmd = cmd
+        self.returncode = returncode
+        self.wall_time = wall_time
+        self.log_tail = log_tail
+        self.stage = stage
+        self.reason = reason
+        self.stdout = ''
+
+    @property
+    def stderr(self) -> str:
+        """Phần cuối log (giữ tương thích với CompletedProcess.stderr)"""
+        return ''.join(self.log_tail)
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and self.reason is None
+
+class FFmpegError(subprocess.CalledProcessError):
+    """ffmpeg lỗi, quá timeout hoặc bị treo; stderr chỉ chứa phần cuối log"""
+
+    def __init__(self, result: FFmpegResult):
+        super().__init__(result.returncode, result.cmd, output='', stderr=result.stderr)
+        self.result = result
+        self.stage = result.stage
+        self.reason = result.reason or 'exit'
+        self.wall_time = result.wall_time
+
+    def __str__(self) -> str:
+        last_line = self.result.log_tail[-1].strip() if self.result.log_tail else ''
+        if self.reason == 'exit':
+            summary = f"exit code {self.returncode}"
+        else:
+            summary = f"killed ({self.reason}) after {self.wall_time:.0f}s"
+        return f"FFmpeg {self.stage or 'ffmpeg'} failed: {summary}" + (f": {last_line}" if last_line else "")
+
+class FFmpegRunner:
+    """
+    Chạy mọi lệnh ffmpeg của pipeline
+
+    - stderr được đọc liên tục vào ring buffer (chỉ giữ N dòng cuối), RAM không tăng theo độ dài log
+    - Timeout tỉ lệ với độ dài đầu ra (-t, duration của stage hoặc expected_duration)
+    - Watchdog kill ffmpeg nếu -progress không tiến thêm trong stall_timeout giây
+    - Job bị hủy (CancelToken của context hiện tại) => kill cả cây process, raise TaskCancelledError
+    - Tiến độ được báo cho ProgressTracker của job hiện tại (nếu có)
+
+    Đọc từ config/settings.json -> common.ffmpeg_runner (xem DEFAULT_RUNNER_SETTINGS)
+    """
+
+    # Chu kỳ kiểm tra của watchdog (giây)
+    WATCHDOG_INTERVAL = 1.0
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self._settings = settings
+        self.reload()
+
+    def reload(self):
+        """Load lại cấu hình từ settings"""
+        self.config = dict(DEFAULT_RUNNER_SETTINGS)
+        try:
+            settings = self._settings or Settings()
+            self.config.update(settings.get_common_settings().get("ffmpeg_runner", {}))
+        except Exception as e:
+            logging.error(f"Error loading ffmpeg runner settings: {e}")
+
+    def timeout_for(self, expected_duration: Optional[float]) -> float:
+        """Timeout (giây) cho lệnh có độ dài đầu ra expected_duration"""
+        if not expected_duration:
+            return float(self.config["default_timeout"])
+        return expected_duration * float(self.config["timeout_factor"]) + float(self.config["timeout_grace"])
+
+    def run(self, cmd: List[str], stage: Optional[str] = None, expected_duration: Optional[float] = None,
+            check: bool = True, timeout: Optional[float] = None,
+            env: Optional[Dict[str, str]] = None) -> FFmpegResult:
+        """
+        Chạy 1 lệnh ffmpeg với -progress pipe:1
+
+        Args:
+            cmd: Lệnh ffmpeg đầy đủ
+            stage: Tên stage (để log)
+            expected_duration: Độ dài đầu ra (giây), mặc định lấy từ -t hoặc duration của stage
+            check: Raise FFmpegError nếu ffmpeg lỗi, quá timeout hoặc bị treo
+            timeout: Ghi đè timeout tính từ expected_duration
+            env: Biến môi trường thêm cho ffmpeg (vd. FONTCONFIG_FILE), ghi đè lên môi trường hiện tại
+        Returns:
+            FFmpegResult: exit code, thời gian chạy, phần cuối log
+        Raises:
+            FFmpegError: Khi check=True và lệnh không thành công
+            TaskCancelledError: Khi job hiện tại bị hủy
+        """
+        cmd = with_progress_args(cmd)
+        tracker = get_progress()
+        cancel_token = get_cancel_token()
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        expected_duration = (
+            expected_duration
+            or expected_output_duration(cmd)
+            or (tracker.stage_duration if tracker else None)
+        )
+        timeout = timeout or self.timeout_for(expected_duration)
+        stall_timeout = float(self.config["stall_timeout"])
+
+        started = time.monotonic()
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, encoding='utf-8', errors='replace', bufsize=1,
+            env={**os.environ, **env} if env else None
+        )
+
+        # Đọc stderr ở thread riêng để pipe không bị đầy khi đang đọc stdout
+        log_tail = deque(maxlen=int(self.config["stderr_lines"]))
+        stderr_thread = threading.Thread(target=lambda: log_tail.extend(process.stderr), daemon=True)
+        stderr_thread.start()
+
+        state = {"last_progress": started, "position": None, "reason": None}
+        finished = threading.Event()
+
+        def watchdog():
+            while not finished.wait(self.WATCHDOG_INTERVAL):
+                now = time.monotonic()
+                if now - started > timeout:
+                    state["reason"] = "timeout"
+                elif now - state["last_progress"] > stall_timeout:
+                    state["reason"] = "stall"
+                elif cancel_token and cancel_token.is_cancelled():
+                    state["reason"] = "cancelled"
+                else:
+                    continue
+                logging.error(f"FFmpeg {stage or 'ffmpeg'} {state['reason']} after {now - started:.0f}s, killing pid {process.pid}")
+                kill_process_tree(process)
+                return
+
+        watchdog_thread = threading.Thread(target=watchdog, name="ffmpeg-watchdog", daemon=True)
+        watchdog_thread.start()
+
+        try:
+            block: Dict[str, str] = {}
+            for line in process.stdout:
+                key, sep, value = line.strip().partition('=')
+                if not sep:
+                    continue
+                block[key] = value
+                if key != 'progress':
+                    continue
+                # Chỉ tính là "còn chạy" khi vị trí đầu ra hoặc kích thước file tăng
+                position = (block.get('out_time_us'), block.get('total_size'))
+                if position != state["position"]:
+                    state["position"] = position
+                    state["last_progress"] = time.monotonic()
+                if tracker:
+                    tracker.update(expected_duration=expected_duration, **parse_progress_block(block))
+                block = {}
+            returncode = process.wait()
+        finally:
+            finished.set()
+            if process.poll() is None:
+                kill_process_tree(process)
+                process.wait()
+            stderr_thread.join()
+
+        result = FFmpegResult(cmd, returncode, time.monotonic() - started, list(log_tail), stage, state["reason"])
+        if result.reason == "cancelled":
+            raise TaskCancelledError(f"Task cancelled during {stage or 'ffmpeg'}")
+        logging.debug(f"FFmpeg {stage or 'ffmpeg'} finished in {result.wall_time:.1f}s (exit code {returncode})")
+        if check and not result.ok:
+            logging.error(f"FFmpeg failed ({stage or 'ffmpeg'}), exit code {returncode}: {''.join(result.log_tail[-5:])}")
+            raise FFmpegError(result)
+        return result
+
+# Shared runner instance
+ffmpeg_runner = FFmpegRunner()
+
+def run_ffmpeg(cmd: List[str], stage: Optional[str] = None, expected_duration: Optional[float] = None,
+               check: bool = True, timeout: Optional[float] = None,
+               env: Optional[Dict[str, str]] = None) -> FFmpegResult:
+    """Chạy lệnh ffmpeg bằng runner dùng chung (xem FFmpegRunner.run)"""
+    return ffmpeg_runner.run(cmd, stage, expected_duration=expected_duration, check=check, timeout=timeout, env=env)
@@ -3,9 +3,15 @@ from pathlib import Path
 import logging
 import subprocess
 import random
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from ..file.file_manager import FileManager
 from ..utils.task_history_manager import TaskHistoryManager
+from .smart_cut import SmartCutter
+from .encoding_profiles import encoding_profiles
+from .ffmpeg_runner import run_ffmpeg
+from ..utils.cancellation import TaskCancelledError
+from ..utils.job_workspace import workspace_dir
+from ..utils.temp_reaper import temp_reaper
 
 class HookBackgroundProcessor:
     def __init__(self, base_path: Path):
@@ -20,6 +26,9 @@ class HookBackgroundProcessor:
         self.input_9_16_dir = base_path / 'Input_9_16'
         self.input_9_16_dir.mkdir(exist_ok=True)
         
+        self.smart_cutter = SmartCutter()
+        self._size_cache = {}
+        
     def get_video_duration(self, video_path: Path) -> float:
         """Get video duration in seconds"""
         try:
@@ -59,16 +68,8 @@ class HookBackgroundProcessor:
             if current_duration + video_duration > total_duration:
                 # Cut the last video to fit
                 cut_duration = total_duration - current_duration
-                cut_video = self.temp_dir / f"cut_{len(selected_videos):04d}.mp4"
-                
-                cmd = [
-                    'ffmpeg', '-y',
-                    '-i', str(video),
-                    '-t', str(cut_duration),
-                    '-c', 'copy',
-                    str(cut_video)
-                ]
-                subprocess.run(cmd, check=True)
+                cut_video = workspace_dir(self.temp_dir) / f"cut_{len(selected_videos):04d}.mp4"
+                self.smart_cutter.cut(video, 0, cut_duration, cut_video)
                 
                 selected_videos.append(cut_video)
                 current_duration += cut_duration
@@ -89,7 +90,7 @@ class HookBackgroundProcessor:
             
         try:
             # Create concat file
-            concat_file = self.temp_dir / "concat.txt"
+            concat_file = workspace_dir(self.temp_dir) / "concat.txt"
             with open(concat_file, 'w', encoding='utf-8') as f:
                 for video in video_paths:
                     f.write(f"file '{video.absolute()}'\n")
@@ -106,33 +107,96 @@ class HookBackgroundProcessor:
                 .overwrite_output()
             )
             
-            stream.run(capture_stdout=True, capture_stderr=True)
+            run_ffmpeg(stream.compile(), "background")
             
             # Cleanup concat file
-            if concat_file.exists():
-                concat_file.unlink()
+            temp_reaper.discard(concat_file)
                 
-        except ffmpeg.Error as e:
-            logging.error(f"Error concatenating videos: {e.stderr.decode() if e.stderr else str(e)}")
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error concatenating videos: {e.stderr}")
             raise
         except Exception as e:
             logging.error(f"Error concatenating videos: {e}")
             raise
             
+    def get_video_size(self, video_path: Path) -> Tuple[int, int]:
+        """Get video dimensions (width, height), cached per file"""
+        key = str(Path(video_path).resolve())
+        if key in self._size_cache:
+            return self._size_cache[key]
+        try:
+            cmd = [
+                'ffprobe',
+                '-v', 'error',
+                '-select_streams', 'v:0',
+                '-show_entries', 'stream=width,height',
+                '-of', 'csv=s=x:p=0',
+                str(video_path)
+            ]
+            output = subprocess.check_output(cmd).decode('utf-8').strip()
+            width, height = map(int, output.split('x'))
+        except Exception as e:
+            logging.error(f"Error getting video dimensions: {e}")
+            width, height = 0, 0
+        self._size_cache[key] = (width, height)
+        return width, height
+
+    def _cut_part(self, video: Path, output: Path, start: float = 0, 
+                  duration: float = None, is_vertical: bool = False):
+        """
+        Cut [start, start + duration) of a background video into output.
+        - Clips that already have the target size are smart-cut (frame accurate,
+          only the boundary GOPs are re-encoded)
+        - Vertical clips that are not 1080x1920 yet are scaled with a full re-encode
+        """
+        needs_scale = is_vertical and self.get_video_size(video) != (1080, 1920)
+        
+        if needs_scale:
+            def build_cmd(video_codec: List[str]) -> List[str]:
+                cmd = ['ffmpeg', '-y']
+                if start:
+                    cmd.extend(['-ss', str(start)])
+                cmd.extend(['-i', str(video)])
+                if duration is not None:
+                    cmd.extend(['-t', str(duration)])
+                cmd.extend(['-vf', 'scale=1080:1920', '-r', '30'])
+                return cmd + video_codec + [str(output)]
+            encoding_profiles.run_encode(build_cmd, "background")
+        elif duration is None and not start:
+            # Whole clip: plain remux
+            cmd = [
+                'ffmpeg', '-y',
+                '-i', str(video),
+                '-c', 'copy',
+                str(output)
+            ]
+            run_ffmpeg(cmd, "background")
+        else:
+            if duration is None:
+                duration = self.get_video_duration(video) - start
+            self.smart_cutter.cut(video, start, duration, output)
+            
     def process_background_videos(
         self,
         hook_duration: float,
         audio_duration: float,
         temp_dir: Path,
         is_vertical: bool = False,
-        bg_path: Path = None  # <-- cho phép truyền bg_path
-    ) -> Tuple[Path, Path]:
+        bg_path: Path = None,  # <-- cho phép truyền bg_path
+        include_hook: bool = True
+    ) -> Tuple[Optional[Path], Path]:
         """
         Process background videos for hook and main parts.
         Nếu bg_path != None => dùng bg_path
         Ngược lại => dùng self.input_9_16_dir hoặc self.input_16_9_dir.
+        include_hook=False => không cắt nền cho phần hook (hook_output = None),
+        phần chính bắt đầu từ đầu video đầu tiên.
         """
+        hook_output = main_output = None
+        temp_parts = []
         try:
+            if not include_hook:
+                hook_duration = 0
             total_duration = hook_duration + audio_duration
 
             # Nếu bg_path được truyền thì dùng thư mục này:
@@ -183,7 +247,7 @@ class HookBackgroundProcessor:
                             break
             
             # Now we have enough videos, let's process them
-            hook_output = temp_dir / "hook_background.mp4"
+            hook_output = temp_dir / "hook_background.mp4" if include_hook else None
             main_output = temp_dir / "main_background.mp4"
             
             # Process first video for hook part
@@ -191,85 +255,23 @@ class HookBackgroundProcessor:
             first_duration = self.get_video_duration(first_video)
             
             # Cut first video into hook part
-            if is_vertical:
-                cmd = [
-                    'ffmpeg', '-y',
-                    '-i', str(first_video),
-                    '-t', str(hook_duration),
-                    '-vf', 'scale=1080:1920',
-                    '-r', '30',
-                    '-c:v', 'h264_nvenc',
-                    '-preset', 'p4',
-                    '-b:v', '4M',
-                    str(hook_output)
-                ]
-            else:
-                cmd = [
-                    'ffmpeg', '-y',
-                    '-i', str(first_video),
-                    '-t', str(hook_duration),
-                    '-c', 'copy',
-                    str(hook_output)
-                ]
-            subprocess.run(cmd, check=True)
+            if include_hook:
+                self._cut_part(first_video, hook_output, 0, hook_duration, is_vertical)
             
             # If first video has enough duration for main part
             remaining_first = first_duration - hook_duration
             if remaining_first >= audio_duration:
                 # Cut remaining part for main
-                if is_vertical:
-                    cmd = [
-                        'ffmpeg', '-y',
-                        '-i', str(first_video),
-                        '-ss', str(hook_duration),
-                        '-t', str(audio_duration),
-                        '-vf', 'scale=1080:1920',
-                        '-r', '30',
-                        '-c:v', 'h264_nvenc',
-                        '-preset', 'p4',
-                        '-b:v', '4M',
-                        str(main_output)
-                    ]
-                else:
-                    cmd = [
-                        'ffmpeg', '-y',
-                        '-i', str(first_video),
-                        '-ss', str(hook_duration),
-                        '-t', str(audio_duration),
-                        '-c', 'copy',
-                        str(main_output)
-                    ]
-                subprocess.run(cmd, check=True)
+                self._cut_part(first_video, main_output, hook_duration, audio_duration, is_vertical)
             else:
                 # Need to use more videos for main part
-                temp_parts = []
                 current_main_duration = 0
                 
                 # Use remaining part of first video
                 if remaining_first > 0:
                     temp_part = temp_dir / f"main_part_0.mp4"
-                    if is_vertical:
-                        cmd = [
-                            'ffmpeg', '-y',
-                            '-i', str(first_video),
-                            '-ss', str(hook_duration),
-                            '-vf', 'scale=1080:1920',
-                            '-r', '30',
-                            '-c:v', 'h264_nvenc',
-                            '-preset', 'p4',
-                            '-b:v', '4M',
-                            str(temp_part)
-                        ]
-                    else:
-                        cmd = [
-                            'ffmpeg', '-y',
-                            '-i', str(first_video),
-                            '-ss', str(hook_duration),
-                            '-c', 'copy',
-                            str(temp_part)
-                        ]
-                    subprocess.run(cmd, check=True)
                     temp_parts.append(temp_part)
+                    self._cut_part(first_video, temp_part, hook_duration, remaining_first, is_vertical)
                     current_main_duration += remaining_first
                 
                 # Process remaining videos
@@ -281,63 +283,28 @@ class HookBackgroundProcessor:
                         break
                         
                     temp_part = temp_dir / f"main_part_{i}.mp4"
+                    temp_parts.append(temp_part)
                     if video_duration > remaining_needed:
                         # Cut video to needed duration
-                        if is_vertical:
-                            cmd = [
-                                'ffmpeg', '-y',
-                                '-i', str(video),
-                                '-t', str(remaining_needed),
-                                '-vf', 'scale=1080:1920',
-                                '-r', '30',
-                                '-c:v', 'h264_nvenc',
-                                '-preset', 'p4',
-                                '-b:v', '4M',
-                                str(temp_part)
-                            ]
-                        else:
-                            cmd = [
-                                'ffmpeg', '-y',
-                                '-i', str(video),
-                                '-t', str(remaining_needed),
-                                '-c', 'copy',
-                                str(temp_part)
-                            ]
+                        self._cut_part(video, temp_part, 0, remaining_needed, is_vertical)
                     else:
                         # Use whole video
-                        if is_vertical:
-                            cmd = [
-                                'ffmpeg', '-y',
-                                '-i', str(video),
-                                '-vf', 'scale=1080:1920',
-                                '-r', '30',
-                                '-c:v', 'h264_nvenc',
-                                '-preset', 'p4',
-                                '-b:v', '4M',
-                                str(temp_part)
-                            ]
-                        else:
-                            cmd = [
-                                'ffmpeg', '-y',
-                                '-i', str(video),
-                                '-c', 'copy',
-                                str(temp_part)
-                            ]
+                        self._cut_part(video, temp_part, 0, None, is_vertical)
                     
-                    subprocess.run(cmd, check=True)
-                    temp_parts.append(temp_part)
                     current_main_duration += min(video_duration, remaining_needed)
                 
                 # Concatenate all parts for main video
                 self.concatenate_videos(temp_parts, main_output)
                 
                 # Cleanup temp parts
-                for temp_part in temp_parts:
-                    if temp_part.exists():
-                        temp_part.unlink()
+                temp_reaper.discard_many(temp_parts)
             
             return hook_output, main_output
             
+        except TaskCancelledError:
+            # Bị hủy: xóa các đoạn nền đã cắt (kể cả file đang ghi dở)
+            temp_reaper.discard_many([hook_output, main_output, *temp_parts])
+            raise
         except Exception as e:
             logging.error(f"Error processing background videos: {e}")
             raise
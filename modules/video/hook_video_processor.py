@@ -1,18 +1,68 @@
 import os
+import json
+import hashlib
 from pathlib import Path
 import logging
 import subprocess
 import time
 import random
 import psutil
-from typing import Dict, List, Optional
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Optional, Tuple
 from ..file.file_manager import FileManager
 from .subtitle_processor import SubtitleProcessor
 from .hook_background_processor import HookBackgroundProcessor
+from .encoding_profiles import encoding_profiles
+from .ffmpeg_runner import run_ffmpeg
+from .batch_preflight import REQUIRED_FILES, BatchPreflight, find_batch_groups, group_fingerprint
+from .error_policy import PERMANENT, classify_error, failed_input, is_input_failure, mark_input_error, run_stage
+from ..utils.progress import ProgressTracker, BatchProgressTracker, get_progress, progress_stage
+from ..utils.batch_executor import BatchResult, StagedBatchExecutor
+from ..utils.cancellation import TaskCancelledError
+from ..utils.job_workspace import JobWorkspace, workspace_dir, sweep_orphaned_workspaces
+from ..utils.job_queue import input_fingerprint
+from ..utils.scratch_manager import scratch_manager
+from ..utils.temp_reaper import temp_reaper
 import ffmpeg
+from PIL import Image
 from api.core.paths import path_manager
 from fastapi import HTTPException
 
+# Trọng số tiến độ của từng bước trong 1 video hook (theo thời gian chạy thực tế)
+HOOK_STAGE_WEIGHTS = {
+    "audio": 0.05,
+    "background": 0.25,
+    "hook": 0.1,
+    "subtitle": 0.5,
+    "concat": 0.1
+}
+
+class PreparedHookVideo:
+    """Kết quả bước chuẩn bị của 1 video hook (đầu vào của bước encode)"""
+
+    def __init__(self, workspace: JobWorkspace, thumbnail_path: Path, subtitle_settings: Dict,
+                 is_vertical: bool, draft: bool):
+        self.workspace = workspace
+        self.thumbnail_path = thumbnail_path
+        self.subtitle_settings = subtitle_settings
+        self.is_vertical = is_vertical
+        self.draft = draft
+        self.hook_norm_wav: Optional[Path] = None
+        self.main_norm_wav: Optional[Path] = None
+        self.hook_duration = 0.0
+        self.audio_duration = 0.0
+        self.main_max_duration: Optional[float] = None
+        self.subtitle_path: Optional[Path] = None
+        self.hook_from_still = False
+        self.hook_bg: Optional[Path] = None
+        self.main_bg: Optional[Path] = None
+        self.temp_files: List[Path] = []
+
+    def add_temp_files(self, temp_files: List[Path], *paths: Path):
+        """Đăng ký file tạm vào danh sách của job và của bước chuẩn bị"""
+        temp_files.extend(paths)
+        self.temp_files.extend(paths)
+
 class HookVideoProcessor:
     """Class xử lý video hook"""
     
@@ -38,59 +88,13 @@ class HookVideoProcessor:
         # Dùng base_path từ path_manager để đảm bảo đúng đường dẫn
         self.background_processor = HookBackgroundProcessor(path_manager.base_path)
         self.subtitle_processor = SubtitleProcessor()
+        self._thumbnail_cover_cache = {}
+        # Dọn workspace của job từ lần chạy trước bị crash/kill
+        sweep_orphaned_workspaces(self.temp_dir)
         
-    def _safe_delete_file(self, file_path: Path, max_retries: int = 5, initial_delay: float = 0.5):
-        """Safely delete a file with retries and exponential backoff
-        
-        Args:
-            file_path (Path): Path to the file to delete
-            max_retries (int): Maximum number of retry attempts
-            initial_delay (float): Initial delay between retries
-        """
-        if not file_path or not file_path.exists():
-            return
-
-        delay = initial_delay
-        for attempt in range(max_retries):
-            try:
-                # Thử xóa file
-                os.remove(str(file_path))
-                logging.debug(f"Successfully deleted {file_path}")
-                return True
-            except PermissionError:
-                if attempt < max_retries - 1:
-                    logging.debug(f"Failed to delete {file_path}, retrying in {delay}s...")
-                    time.sleep(delay)
-                    delay *= 2
-                else:
-                    logging.warning(f"Could not delete {file_path} after {max_retries} attempts")
-            except FileNotFoundError:
-                logging.debug(f"File already deleted: {file_path}")
-                return True
-            except Exception as e:
-                logging.warning(f"Error deleting {file_path}: {e}")
-                return False
-        return False
-
-    def _cleanup_temp_files(self, temp_files: Optional[List[Path]] = None):
-        """Clean up temporary files safely"""
-        if temp_files is None:
-            # If no specific files provided, clean up entire temp directory
-            temp_files = list(self.temp_dir.glob('*'))
-            logging.info(f"Cleaning up all files in temp directory: {len(temp_files)} files")
-        
-        for file_path in temp_files:
-            try:
-                if not isinstance(file_path, Path):
-                    file_path = Path(file_path)
-                
-                if file_path.exists():
-                    logging.debug(f"Attempting to delete temp file: {file_path}")
-                    self._safe_delete_file(file_path)
-                else:
-                    logging.debug(f"Temp file already deleted or not found: {file_path}")
-            except Exception as e:
-                logging.error(f"Error while cleaning up temp file {file_path}: {e}")
+    def _cleanup_temp_files(self, temp_files: List[Path]):
+        """Giao file tạm cho TempReaper xóa ở thread nền (render không chờ)"""
+        temp_reaper.discard_many(temp_files)
 
     def get_video_duration(self, video_path: Path) -> float:
         """Get video duration in seconds"""
@@ -183,52 +187,14 @@ class HookVideoProcessor:
 
     def check_gpu_support(self) -> bool:
         """Check if GPU encoding is supported"""
-        try:
-            result = subprocess.run(
-                ['ffmpeg', '-hide_banner', '-encoders'],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            return 'h264_nvenc' in result.stdout
-        except Exception:
-            return False
+        return encoding_profiles.gpu_available()
             
-    def get_encoding_settings(self, is_vertical: bool = False) -> dict:
-        """Get optimized encoding settings for hook videos"""
-        base_settings = {
-            'hwaccel': [],  # Let CPU handle decode and filters
-        }
-        
-        if self.check_gpu_support():
-            base_settings['video_codec'] = [
-                '-c:v', 'h264_nvenc',
-                '-preset', 'p4',     # Optimized quality preset
-                '-tune', 'hq',       # High quality tuning
-                '-rc', 'cbr',        # Constant bitrate for consistent quality
-                '-b:v', '4M',        # 4Mbps bitrate
-                '-minrate', '4M',    # Force constant bitrate
-                '-maxrate', '4M',    # Force constant bitrate
-                '-bufsize', '4M',    # Match bitrate for CBR
-                '-profile:v', 'high',# High profile for better quality
-                '-r', '30',          # 30fps
-                '-g', '60'           # Keyframe every 2 seconds
-            ]
-        else:
-            base_settings['video_codec'] = [
-                '-c:v', 'libx264',
-                '-preset', 'medium',  # Balance between speed and quality
-                '-crf', '23',        # Constant quality factor
-                '-b:v', '4M',        # Target bitrate
-                '-maxrate', '5M',    # Maximum bitrate
-                '-bufsize', '8M',    # Buffer size
-                '-profile:v', 'high',# High profile for better quality
-                '-r', '30',          # 30fps
-                '-g', '60',          # Keyframe every 2 seconds
-                '-movflags', '+faststart'  # Enable fast start for web playback
-            ]
-            
-        return base_settings
+    def get_encoding_settings(self, is_vertical: bool = False, stage: str = "hook_thumbnail",
+                              gpu: Optional[bool] = None) -> dict:
+        """Get encoding settings for a hook pipeline stage from the profile registry"""
+        settings = encoding_profiles.encoding_settings(stage, gpu)
+        settings['video_codec'].extend(['-r', '30'])  # 30fps cho mọi phần của video hook
+        return settings
 
     def normalize_audio(self, input_path: Path, output_path: Path):
         """Normalize audio to 24bit 34khz stereo"""
@@ -241,9 +207,12 @@ class HookVideoProcessor:
                 '-ac', '2',              # stereo
                 str(output_path)
             ]
-            subprocess.run(cmd, check=True)
+            run_ffmpeg(cmd, "normalize_audio")
         except Exception as e:
             logging.error(f"Error normalizing audio: {e}")
+            if is_input_failure(e):
+                # Bước đầu tiên decode file audio của người dùng: file hỏng thì không thử lại
+                mark_input_error(e, input_path)
             raise
 
     def get_audio_duration(self, audio_path: Path) -> float:
@@ -263,60 +232,115 @@ class HookVideoProcessor:
             return 0.0
 
     def _add_thumbnail_with_fade(self, video_path: Path, thumbnail_path: Path, 
-                               audio_path: Path, output_path: Path, is_vertical: bool = False):
-        """Add thumbnail with fade effect to video"""
+                               audio_path: Path, output_path: Path, is_vertical: bool = False,
+                               draft: bool = False):
+        """Add thumbnail with fade effect to video (draft: thu nhỏ sau khi overlay)"""
         try:
-            # Get encoding settings
-            encoding_settings = self.get_encoding_settings(is_vertical)
             video_duration = self.get_video_duration(video_path)
+            fps = 30
             
             # Complex filter for overlay and fade effects
             filter_complex = [
                 "[0:v][1:v]overlay=0:0:enable='between(t,0,{})'".format(video_duration),
                 f"fade=t=in:st=0:d=0.5,fade=t=out:st={video_duration-0.5}:d=0.5[v]"
             ]
+            if draft:
+                draft_width, draft_height = encoding_profiles.draft_size(is_vertical)
+                fps = encoding_profiles.draft_settings.get('fps', 15)
+                filter_complex[-1] = filter_complex[-1][:-len('[v]')] + f",scale={draft_width}:{draft_height}[v]"
 
-            command = [
-                'ffmpeg',
-                '-i', str(video_path),
-                '-i', str(thumbnail_path),
-                '-i', str(audio_path),
-                '-filter_complex', ','.join(filter_complex),
-                '-map', '[v]',
-                '-map', '2:a'
-            ]
+            def build_cmd(video_codec: List[str]) -> List[str]:
+                return [
+                    'ffmpeg', '-y',
+                    '-i', str(video_path),
+                    '-i', str(thumbnail_path),
+                    '-i', str(audio_path),
+                    '-filter_complex', ','.join(filter_complex),
+                    '-map', '[v]',
+                    '-map', '2:a',
+                    '-t', f"{video_duration:.3f}"
+                ] + video_codec + ['-r', str(fps), '-c:a', 'aac', str(output_path)]
 
-            # Add encoding settings
-            command.extend(encoding_settings['video_codec'])
-
-            # Add audio codec
-            command.extend(['-c:a', 'aac'])
-            command.append(str(output_path))
-            
-            # Log the command for debugging
-            logging.info(f"Running FFmpeg command: {' '.join(command)}")
-            
-            subprocess.run(command, check=True, capture_output=True, text=True)
+            # GPU nếu có, tự chuyển sang CPU nếu NVENC lỗi
+            encoding_profiles.run_encode(build_cmd, "hook_thumbnail", draft=draft)
             
         except subprocess.CalledProcessError as e:
-            logging.error(f"Error adding thumbnail with fade: {e}")
-            # Try without hardware acceleration
-            try:
-                # Remove NVENC specific options
-                command = [c for c in command if not any(x in c.lower() for x in ['nvenc', 'tune', 'rc', 'bufsize'])]
-                # Add CPU encoder settings
-                command.extend(['-c:v', 'libx264', '-preset', 'medium'])
-                subprocess.run(command, check=True, capture_output=True, text=True)
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Error adding thumbnail with fade (CPU fallback): {e}")
-                raise
+            logging.error(f"Error adding thumbnail with fade: {e.stderr}")
+            raise
         except Exception as e:
             logging.error(f"Error adding thumbnail with fade: {e}")
             raise
 
+    def _thumbnail_covers_frame(self, thumbnail_path: Path, is_vertical: bool = False) -> bool:
+        """
+        Kiểm tra thumbnail có che kín khung hình không (đủ kích thước và không có pixel trong suốt)
+        Args:
+            thumbnail_path: Ảnh thumbnail
+            is_vertical: True nếu là video dọc (9:16)
+        Returns:
+            bool: True nếu video nền bên dưới không bao giờ nhìn thấy
+        """
+        frame_width, frame_height = (1080, 1920) if is_vertical else (1920, 1080)
+        try:
+            thumbnail_path = Path(thumbnail_path)
+            stat = thumbnail_path.stat()
+            key = (str(thumbnail_path.resolve()), stat.st_mtime, stat.st_size, is_vertical)
+            if key in self._thumbnail_cover_cache:
+                return self._thumbnail_cover_cache[key]
+
+            with Image.open(thumbnail_path) as image:
+                # Overlay đặt tại 0:0 nên chỉ vùng frame_width x frame_height là nhìn thấy
+                covers = image.width >= frame_width and image.height >= frame_height
+                if covers and (image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info):
+                    alpha = image.convert('RGBA').getchannel('A').crop((0, 0, frame_width, frame_height))
+                    covers = alpha.getextrema()[0] == 255
+
+            self._thumbnail_cover_cache[key] = covers
+            logging.info(f"Thumbnail {thumbnail_path.name} covers full frame: {covers}")
+            return covers
+        except Exception as e:
+            logging.warning(f"Could not inspect thumbnail {thumbnail_path}: {e}")
+            return False
+
+    def _render_still_hook(self, thumbnail_path: Path, audio_path: Path, output_path: Path,
+                           duration: float, is_vertical: bool = False, draft: bool = False):
+        """Tạo phần hook chỉ từ ảnh thumbnail (-loop 1 + fade), không cần decode video nền"""
+        try:
+            frame_width, frame_height = (1080, 1920) if is_vertical else (1920, 1080)
+            fps = 30
+            video_filter = (
+                f"[0:v]crop={frame_width}:{frame_height}:0:0,setsar=1,format=yuv420p,"
+                f"fade=t=in:st=0:d=0.5,fade=t=out:st={max(duration - 0.5, 0):.3f}:d=0.5"
+            )
+            if draft:
+                draft_width, draft_height = encoding_profiles.draft_size(is_vertical)
+                fps = encoding_profiles.draft_settings.get('fps', 15)
+                video_filter += f",scale={draft_width}:{draft_height}"
+            video_filter += "[v]"
+
+            def build_cmd(video_codec: List[str]) -> List[str]:
+                return [
+                    'ffmpeg', '-y',
+                    '-loop', '1',
+                    '-framerate', str(fps),
+                    '-i', str(thumbnail_path),
+                    '-i', str(audio_path),
+                    '-filter_complex', video_filter,
+                    '-map', '[v]',
+                    '-map', '1:a',
+                    '-t', f"{duration:.3f}"
+                ] + video_codec + ['-r', str(fps), '-c:a', 'aac', str(output_path)]
+
+            encoding_profiles.run_encode(build_cmd, "hook_thumbnail", draft=draft)
+
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error rendering still hook: {e.stderr}")
+            raise
+
     def _process_video_with_subtitle(self, video_path: str, audio_path: str, 
                                    subtitle_path: str, output_path: str, 
-                                   subtitle_settings: dict, is_vertical: bool = False):
+                                   subtitle_settings: dict, is_vertical: bool = False,
+                                   draft: bool = False, max_duration: Optional[float] = None):
         """Process video with subtitle
         
         Args:
@@ -326,6 +350,8 @@ class HookVideoProcessor:
             output_path (str): Path to output video
             subtitle_settings (dict): Subtitle settings
             is_vertical (bool): Whether the video is vertical
+            draft (bool): Render nhanh ở độ phân giải draft
+            max_duration (float): Giới hạn độ dài đầu ra (giây)
         """
         try:
             # Convert SRT to ASS if needed
@@ -346,45 +372,36 @@ class HookVideoProcessor:
                 logging.error(f"Subtitle file not found: {subtitle_path}")
                 raise FileNotFoundError(f"Subtitle file not found: {subtitle_path}")
 
-            # Chuẩn hóa đường dẫn subtitle
-            subtitle_path_str = str(subtitle_path).replace("\\", "/").replace(":", "\\:")
+            # Filter ass (fontsdir chỉ chứa font cần dùng, fontconfig chỉ nạp fontsdir)
+            ass_filter = self.subtitle_processor.ass_filter(subtitle_path)
+            ass_env = self.subtitle_processor.ass_env(subtitle_path)
 
             # Chuẩn bị lệnh FFmpeg
-            cmd = [
-                'ffmpeg', '-y',
-                '-i', str(video_path),
-                '-i', str(audio_path)
-            ]
+            if draft:
+                draft_width, draft_height = encoding_profiles.draft_size(is_vertical)
+                draft_fps = encoding_profiles.draft_settings.get('fps', 15)
+                vf_filter = f'scale={draft_width}:{draft_height},fps={draft_fps},setpts=PTS-STARTPTS'
+            else:
+                vf_filter = 'scale=1080:1920,fps=30,setpts=PTS-STARTPTS' if is_vertical else 'scale=1920:1080,fps=30,setpts=PTS-STARTPTS'
+            duration_args = ['-t', f"{max_duration:.3f}"] if max_duration else []
 
-            # Sử dụng GPU cho encode cuối
-            vf_filter = 'scale=1080:1920,fps=30,setpts=PTS-STARTPTS' if is_vertical else 'scale=1920:1080,fps=30,setpts=PTS-STARTPTS'
-            cmd.extend([
-                '-filter_complex', 
-                f'[0:v]{vf_filter},ass=\'{subtitle_path_str}\'[final]',
-                '-map', '[final]',
-                '-map', '1:a'
-            ])
-
-            # Add encoding settings
-            cmd.extend([
-                '-c:v', 'h264_nvenc',
-                '-preset', 'slow',
-                '-profile:v', 'high',
-                '-level', '4.2',
-                '-rc', 'vbr_hq',
-                '-cq', '19',
-                '-b:v', '0',
-                '-maxrate', '20M',
-                '-bufsize', '40M',
-                '-pix_fmt', 'yuv420p',
-                '-c:a', 'aac',
-                '-b:a', '192k',
-                str(output_path)
-            ])
+            def build_cmd(video_codec: List[str]) -> List[str]:
+                return [
+                    'ffmpeg', '-y',
+                    '-i', str(video_path),
+                    '-i', str(audio_path),
+                    '-filter_complex',
+                    f'[0:v]{vf_filter},{ass_filter}[final]',
+                    '-map', '[final]',
+                    '-map', '1:a'
+                ] + duration_args + video_codec + [
+                    '-c:a', 'aac',
+                    '-b:a', '192k',
+                    str(output_path)
+                ]
 
-            logging.info(f"Running FFmpeg command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            logging.info(f"FFmpeg output: {result.stdout}")
+            # Encode cuối theo profile của stage hook_subtitle (GPU nếu có)
+            encoding_profiles.run_encode(build_cmd, "hook_subtitle", draft=draft, env=ass_env)
             
             if not os.path.exists(output_path):
                 logging.error(f"Output file not created: {output_path}")
@@ -406,7 +423,7 @@ class HookVideoProcessor:
         """
         try:
             # Tạo file danh sách để nối video
-            concat_list_path = str(Path(self.temp_dir) / 'concat_list.txt')
+            concat_list_path = str(workspace_dir(self.temp_dir) / 'concat_list.txt')
             with open(concat_list_path, 'w') as f:
                 for video_path in video_paths:
                     f.write(f"file '{video_path}'\n")
@@ -425,10 +442,10 @@ class HookVideoProcessor:
             logging.info(f"FFmpeg concatenate command: {' '.join(cmd)}")
 
             # Chạy lệnh
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            result = run_ffmpeg(cmd, "hook_concat")
             
             # Xóa file danh sách tạm
-            os.unlink(concat_list_path)
+            temp_reaper.discard(concat_list_path)
             
             logging.info(f"Successfully concatenated videos to: {output_path}")
             return output_path
@@ -452,8 +469,10 @@ class HookVideoProcessor:
         main_audio_path: Path,
         subtitle_path: Path,
         thumbnail_path: Path,
-        preset_name: str,
-        is_vertical: bool = False
+        preset_name,
+        is_vertical: bool = False,
+        draft: bool = False,
+        draft_duration: Optional[float] = None
     ):
         """
         Xử lý video hook trong background
@@ -463,8 +482,10 @@ class HookVideoProcessor:
             main_audio_path (Path): Đường dẫn file audio chính
             subtitle_path (Path): Đường dẫn file phụ đề
             thumbnail_path (Path): Đường dẫn file thumbnail
-            preset_name (str): Tên preset cài đặt phụ đề
+            preset_name (str | dict): Tên preset hoặc dict cài đặt phụ đề đã load
             is_vertical (bool): True nếu là video dọc (9:16)
+            draft (bool): Render nhanh để xem thử
+            draft_duration (float): Chỉ render N giây đầu khi draft
         """
         try:
             from ..utils.settings_manager import SettingsManager
@@ -474,28 +495,43 @@ class HookVideoProcessor:
             settings_manager = SettingsManager()  # SettingsManager uses path_manager internally
             task_history = TaskHistoryManager(path_manager.base_path)
             
-            # Load settings từ preset
-            subtitle_settings = settings_manager.load_preset(preset_name)
+            # Load settings từ preset (API có thể truyền thẳng dict settings)
+            if isinstance(preset_name, dict):
+                subtitle_settings = preset_name
+            else:
+                subtitle_settings = settings_manager.load_preset(preset_name)
             if not subtitle_settings:
                 raise ValueError(f"Không tìm thấy preset: {preset_name}")
 
-            # Xử lý video với settings đã load
-            self.process_hook_video(
-                hook_audio=hook_audio_path,
-                audio_path=main_audio_path,
-                thumbnail_path=thumbnail_path,
-                subtitle_path=subtitle_path,
-                subtitle_settings=subtitle_settings,
-                is_vertical=is_vertical
-            )
+            output_path = self.final_dir / f"{Path(main_audio_path).stem}_{int(time.time())}.mp4"
+
+            # Xử lý video với settings đã load, tiến độ ffmpeg ghi vào task
+            tracker = ProgressTracker(task_id, task_history, HOOK_STAGE_WEIGHTS)
+            with tracker.activate():
+                output_path = self.process_hook_video(
+                    hook_audio=hook_audio_path,
+                    audio_path=main_audio_path,
+                    thumbnail_path=thumbnail_path,
+                    subtitle_path=subtitle_path,
+                    output_path=output_path,
+                    subtitle_settings=subtitle_settings,
+                    is_vertical=is_vertical,
+                    draft=draft,
+                    draft_duration=draft_duration
+                )
             
             # Update task status to completed after video processing
             task_history.update_task_status(
                 task_id,
                 "completed",
-                message="Video processing completed"
+                message="Video processing completed",
+                data={"output_path": str(output_path), "draft": draft, "progress": 100, "stage": None, "eta_seconds": 0}
             )
             
+        except TaskCancelledError:
+            # Status 'cancelled' đã được ghi khi hủy
+            logging.info(f"Hook task {task_id} cancelled")
+            raise
         except Exception as e:
             logging.error(f"Lỗi khi xử lý video hook: {e}")
             # Update task status to error
@@ -515,8 +551,10 @@ class HookVideoProcessor:
         output_path: Path,
         subtitle_settings: Dict,
         is_vertical: bool = False,
-        bg_path: Path = None  # <-- Thêm tham số này
-    ) -> bool:
+        bg_path: Path = None,  # <-- Thêm tham số này
+        draft: bool = False,
+        draft_duration: Optional[float] = None
+    ) -> Path:
         """
         Process video with hook audio and background videos.
 
@@ -529,157 +567,366 @@ class HookVideoProcessor:
             subtitle_settings: Subtitle settings dict
             is_vertical: Whether the video is vertical
             bg_path: Thư mục chứa các video nền (nếu có)
+            draft: Render nhanh để xem thử (480p, fps thấp), file đầu ra có hậu tố _draft
+            draft_duration: Chỉ render N giây đầu khi draft (None = lấy theo settings)
+        Returns:
+            Path: Đường dẫn video đầu ra
+        """
+        # Mỗi video có thư mục làm việc riêng (temp/jobs/<id> hoặc trên scratch), xóa khi xong;
+        # id theo đầu vào nên lần chạy lại sau lỗi/crash tiếp tục từ stage chưa xong
+        size_estimate = self._scratch_estimate(hook_audio, audio_path, draft, draft_duration)
+        resume_key = self._resume_key(
+            [hook_audio, audio_path, thumbnail_path, subtitle_path],
+            subtitle_settings, is_vertical, bg_path, draft, draft_duration
+        )
+        with JobWorkspace(self.temp_dir, job_id=resume_key, size_estimate=size_estimate,
+                          resumable=resume_key is not None) as workspace:
+            return self._render_hook_video(
+                workspace, hook_audio, audio_path, thumbnail_path, subtitle_path, output_path,
+                subtitle_settings, is_vertical, bg_path, draft, draft_duration
+            )
+
+    def _scratch_estimate(self, hook_audio: Path, audio_path: Path, draft: bool,
+                          draft_duration: Optional[float]) -> Optional[int]:
+        """
+        Ước lượng dung lượng file trung gian của 1 video hook (None nếu scratch tắt)
+
+        Cùng lúc tồn tại: 2 WAV đã normalize, video nền (đoạn cắt + bản concat),
+        hook_with_thumbnail và main_with_subtitle.
+        """
+        if not scratch_manager.enabled:
+            return None
+        duration = self.get_audio_duration(hook_audio) + self.get_audio_duration(audio_path)
+        if draft:
+            duration = min(duration, encoding_profiles.draft_duration(draft_duration) or duration)
+        if duration <= 0:
+            return None
+        return scratch_manager.estimate_bytes(duration, video_copies=3, audio_copies=2)
+
+    def _resume_key(self, input_paths: List[Path], subtitle_settings: Dict, is_vertical: bool,
+                    bg_path: Optional[Path], draft: bool, draft_duration: Optional[float]) -> Optional[str]:
+        """
+        Id workspace cố định theo nội dung đầu vào + cài đặt render (None nếu không đọc được đầu vào)
+        """
+        fingerprint = input_fingerprint(input_paths)
+        if not fingerprint:
+            return None
+        options = json.dumps(
+            [subtitle_settings, is_vertical, str(bg_path) if bg_path else None, draft, draft_duration],
+            sort_keys=True, default=str
+        )
+        return "hook_" + hashlib.sha1(f"{fingerprint}:{options}".encode()).hexdigest()[:16]
+
+    def _render_hook_video(
+        self,
+        workspace: JobWorkspace,
+        hook_audio: Path,
+        audio_path: Path,
+        thumbnail_path: Path,
+        subtitle_path: Path,
+        output_path: Path,
+        subtitle_settings: Dict,
+        is_vertical: bool,
+        bg_path: Optional[Path],
+        draft: bool,
+        draft_duration: Optional[float],
+        prepared: Optional["PreparedHookVideo"] = None
+    ) -> Path:
+        """
+        process_hook_video trong workspace của job, mọi file trung gian ghi vào workspace
+
+        Mỗi bước tự thử lại khi lỗi transient (run_stage), lỗi permanent raise ngay.
+        Workspace resumable được giữ lại khi lỗi (cùng các file trung gian đã xong).
+        Args:
+            prepared: Kết quả bước chuẩn bị đã chạy trước (batch), None = tự chuẩn bị
         """
+        temp_files = []
         try:
-            retry_count = 1
-            retry_delay = 5
-            success = False
-            temp_files = []
-            
-            for attempt in range(retry_count + 1):
-                try:
-                    temp_dir = self.temp_dir
-                    
-                    # Step 1: Normalize audio
-                    hook_norm_wav = Path(temp_dir) / self.get_temp_filename("normalized_hook", "wav")
-                    main_norm_wav = Path(temp_dir) / self.get_temp_filename("normalized_main", "wav")
-                    
-                    self.normalize_audio(hook_audio, hook_norm_wav)
-                    self.normalize_audio(audio_path, main_norm_wav)
-                    
-                    if hook_norm_wav.exists():
-                        temp_files.append(hook_norm_wav)
-                    if main_norm_wav.exists():
-                        temp_files.append(main_norm_wav)
-                    
-                    # Step 2: Get audio durations
-                    hook_duration = self.get_audio_duration(hook_norm_wav)
-                    audio_duration = self.get_audio_duration(main_norm_wav)
-                    
-                    # Step 3: Process background videos - truyền bg_path nếu có
-                    hook_bg, main_bg = self.background_processor.process_background_videos(
-                        hook_duration=hook_duration,
-                        audio_duration=audio_duration,
-                        temp_dir=temp_dir,
-                        is_vertical=is_vertical,
-                        bg_path=bg_path  # <--- QUAN TRỌNG
-                    )
-                    
-                    hook_bg_path = Path(hook_bg)
-                    main_bg_path = Path(main_bg)
-                    if hook_bg_path.exists():
-                        temp_files.append(hook_bg_path)
-                    if main_bg_path.exists():
-                        temp_files.append(main_bg_path)
-                    
-                    # Step 4: Add thumbnail with fade
-                    hook_with_thumb = Path(temp_dir) / self.get_temp_filename("hook_with_thumbnail", "mp4")
-                    self._add_thumbnail_with_fade(
-                        video_path=hook_bg, 
-                        thumbnail_path=thumbnail_path, 
-                        audio_path=hook_norm_wav, 
-                        output_path=hook_with_thumb, 
-                        is_vertical=is_vertical
-                    )
-                    if hook_with_thumb.exists():
-                        temp_files.append(hook_with_thumb)
-                    
-                    # Step 5: Process main part with subtitle
-                    main_with_sub = Path(temp_dir) / self.get_temp_filename("main_with_subtitle", "mp4")
-                    self._process_video_with_subtitle(
-                        video_path=str(main_bg), 
-                        audio_path=str(main_norm_wav), 
-                        subtitle_path=str(subtitle_path), 
-                        output_path=str(main_with_sub), 
-                        subtitle_settings=subtitle_settings, 
-                        is_vertical=is_vertical
-                    )
-                    if main_with_sub.exists():
-                        temp_files.append(main_with_sub)
-                    
-                    # Step 6: Concatenate final video
-                    self._concatenate_videos([hook_with_thumb, main_with_sub], output_path, is_vertical)
-                    success = True
-                    break
-
-                except Exception as e:
-                    logging.error(f"Attempt {attempt + 1} failed: {e}")
-                    if attempt < retry_count:
-                        logging.info(f"Retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
-                    else:
-                        raise
+            if draft:
+                output_path = encoding_profiles.draft_output_path(output_path)
 
+            if prepared is None:
+                prepared = self._prepare_hook_video(
+                    workspace, hook_audio, audio_path, thumbnail_path, subtitle_path,
+                    subtitle_settings, is_vertical, bg_path, draft, draft_duration, temp_files
+                )
+            else:
+                temp_files.extend(prepared.temp_files)
+            self._encode_hook_video(prepared, output_path, temp_files)
+
+        except TaskCancelledError:
+            logging.info(f"Hook video cancelled: {output_path}")
+            # Xóa file đầu ra đang ghi dở
+            temp_files.append(Path(output_path))
+            raise
         except Exception as e:
-            logging.error(f"Error in video processing: {e}")
+            logging.error(f"Error in video processing ({classify_error(e)}): {e}")
+            if workspace.stages is not None:
+                # Giữ file của các stage đã xong để lần chạy lại tiếp tục từ stage lỗi
+                workspace.retain()
+                temp_files.clear()
             raise
         finally:
             # Cleanup temp files
             logging.info(f"Cleaning up {len(temp_files)} temp files: {[str(f) for f in temp_files]}")
             self._cleanup_temp_files(temp_files)
 
+        return output_path
+
+    def _prepare_hook_video(
+        self,
+        workspace: JobWorkspace,
+        hook_audio: Path,
+        audio_path: Path,
+        thumbnail_path: Path,
+        subtitle_path: Path,
+        subtitle_settings: Dict,
+        is_vertical: bool,
+        bg_path: Optional[Path],
+        draft: bool,
+        draft_duration: Optional[float],
+        temp_files: List[Path]
+    ) -> "PreparedHookVideo":
+        """
+        Bước chuẩn bị (chủ yếu I/O): normalize audio, đo độ dài, SRT -> ASS, cắt video nền
+        Args:
+            temp_files: File tạm được đăng ký vào đây trước khi ghi (để luôn được dọn)
+        Returns:
+            PreparedHookVideo: Đầu vào của _encode_hook_video
+        """
+        if draft:
+            draft_duration = encoding_profiles.draft_duration(draft_duration)
+        temp_dir = workspace.path
+        prepared = PreparedHookVideo(workspace, thumbnail_path, subtitle_settings, is_vertical, draft)
 
-    def _concatenate_videos(self, video_paths: List[Path], output_path: Path, is_vertical: bool = False):
+        # Step 1: Normalize audio
+        # Tên file cố định trong workspace (checkpoint của lần chạy trước trỏ tới đúng file)
+        prepared.hook_norm_wav = Path(temp_dir) / "normalized_hook.wav"
+        prepared.main_norm_wav = Path(temp_dir) / "normalized_main.wav"
+        # Đăng ký file tạm trước khi ghi để bị hủy giữa chừng cũng được dọn
+        prepared.add_temp_files(temp_files, prepared.hook_norm_wav, prepared.main_norm_wav)
+        
+        with progress_stage("audio"):
+            run_stage("normalize_hook_audio", self.normalize_audio, hook_audio, prepared.hook_norm_wav,
+                      outputs=[prepared.hook_norm_wav])
+            run_stage("normalize_main_audio", self.normalize_audio, audio_path, prepared.main_norm_wav,
+                      outputs=[prepared.main_norm_wav])
+        
+        # Step 2: Get audio durations
+        hook_duration = self.get_audio_duration(prepared.hook_norm_wav)
+        audio_duration = self.get_audio_duration(prepared.main_norm_wav)
+        if draft and draft_duration:
+            # Giữ nguyên phần hook, cắt phần chính cho vừa draft_duration
+            audio_duration = min(audio_duration, max(draft_duration - hook_duration, 1.0))
+            prepared.main_max_duration = audio_duration
+        prepared.hook_duration = hook_duration
+        prepared.audio_duration = audio_duration
+
+        # SRT -> ASS trước khi encode (file ASS nằm trong cache, không phải file tạm)
+        prepared.subtitle_path = run_stage("subtitle_ass", self._convert_subtitle, subtitle_path, subtitle_settings, is_vertical)
+        
+        # Thumbnail che kín khung hình => phần hook không cần video nền
+        prepared.hook_from_still = self._thumbnail_covers_frame(thumbnail_path, is_vertical)
+        
+        # Step 3: Process background videos - truyền bg_path nếu có
+        with progress_stage("background", audio_duration if prepared.hook_from_still else hook_duration + audio_duration):
+            hook_bg, main_bg = run_stage(
+                "background",
+                self.background_processor.process_background_videos,
+                hook_duration=hook_duration,
+                audio_duration=audio_duration,
+                temp_dir=temp_dir,
+                is_vertical=is_vertical,
+                bg_path=bg_path,  # <--- QUAN TRỌNG
+                include_hook=not prepared.hook_from_still
+            )
+        
+        prepared.hook_bg = hook_bg
+        prepared.main_bg = Path(main_bg)
+        if hook_bg and Path(hook_bg).exists():
+            prepared.add_temp_files(temp_files, Path(hook_bg))
+        if prepared.main_bg.exists():
+            prepared.add_temp_files(temp_files, prepared.main_bg)
+        return prepared
+
+    def _encode_hook_video(self, prepared: "PreparedHookVideo", output_path: Path, temp_files: List[Path]):
+        """Bước encode (CPU/GPU): hook + thumbnail, phần chính + phụ đề, nối thành video cuối"""
+        temp_dir = prepared.workspace.path
+
+        # Step 4: Add thumbnail with fade
+        hook_with_thumb = Path(temp_dir) / "hook_with_thumbnail.mp4"
+        temp_files.append(hook_with_thumb)
+        with progress_stage("hook", prepared.hook_duration):
+            if prepared.hook_from_still:
+                run_stage(
+                    "hook",
+                    self._render_still_hook,
+                    thumbnail_path=prepared.thumbnail_path,
+                    audio_path=prepared.hook_norm_wav,
+                    output_path=hook_with_thumb,
+                    duration=prepared.hook_duration,
+                    is_vertical=prepared.is_vertical,
+                    draft=prepared.draft,
+                    outputs=[hook_with_thumb]
+                )
+            else:
+                run_stage(
+                    "hook",
+                    self._add_thumbnail_with_fade,
+                    video_path=prepared.hook_bg, 
+                    thumbnail_path=prepared.thumbnail_path, 
+                    audio_path=prepared.hook_norm_wav, 
+                    output_path=hook_with_thumb, 
+                    is_vertical=prepared.is_vertical,
+                    draft=prepared.draft,
+                    outputs=[hook_with_thumb]
+                )
+        
+        # Step 5: Process main part with subtitle
+        main_with_sub = Path(temp_dir) / "main_with_subtitle.mp4"
+        temp_files.append(main_with_sub)
+        with progress_stage("subtitle", prepared.audio_duration):
+            run_stage(
+                "subtitle",
+                self._process_video_with_subtitle,
+                video_path=str(prepared.main_bg), 
+                audio_path=str(prepared.main_norm_wav), 
+                subtitle_path=str(prepared.subtitle_path), 
+                output_path=str(main_with_sub), 
+                subtitle_settings=prepared.subtitle_settings, 
+                is_vertical=prepared.is_vertical,
+                draft=prepared.draft,
+                max_duration=prepared.main_max_duration,
+                outputs=[main_with_sub]
+            )
+        
+        # Step 6: Concatenate final video
+        with progress_stage("concat", prepared.hook_duration + prepared.audio_duration):
+            run_stage(
+                "concat",
+                self._concatenate_videos,
+                [hook_with_thumb, main_with_sub], output_path, prepared.is_vertical, prepared.draft,
+                outputs=[output_path]
+            )
+
+    def _convert_subtitle(self, subtitle_path: Path, subtitle_settings: Dict, is_vertical: bool) -> Path:
+        """SRT -> ASS (file khác giữ nguyên)"""
+        if Path(subtitle_path).suffix.lower() != '.srt':
+            return Path(subtitle_path)
+        ass_path = self.subtitle_processor.convert_srt_to_ass(
+            Path(subtitle_path), 
+            subtitle_settings, 
+            0,  # No start offset needed
+            is_vertical
+        )
+        if not ass_path or not ass_path.exists():
+            logging.error(f"Failed to convert SRT to ASS: {subtitle_path}")
+            raise ValueError(f"Failed to convert SRT to ASS: {subtitle_path}")
+        return ass_path
+
+    def render_batch(
+        self,
+        groups: List[Tuple[str, Dict[str, Path]]],
+        output_dir: Path,
+        subtitle_settings: Dict,
+        is_vertical: bool = False,
+        bg_path: Optional[Path] = None,
+        draft: bool = False,
+        draft_duration: Optional[float] = None,
+        on_done: Optional[Callable[[BatchResult], None]] = None
+    ) -> List[BatchResult]:
+        """
+        Render nhiều nhóm file: chuẩn bị các nhóm kế tiếp trong lúc encode nhóm hiện tại
+        Args:
+            groups: [(tên nhóm, {'hook_audio', 'main_audio', 'subtitle', 'thumbnail'})]
+            output_dir: Thư mục ghi video đầu ra ({tên nhóm}_{timestamp}.mp4)
+            on_done: Gọi mỗi khi 1 nhóm xong (BatchResult.value = đường dẫn video)
+        Returns:
+            List[BatchResult]: Kết quả theo thứ tự groups
+        Raises:
+            TaskCancelledError: Job bị hủy (các nhóm đã xong đã được báo qua on_done)
+        """
+        tracker = get_progress()
+        executor = StagedBatchExecutor(name="hook-batch")
+        logging.info(
+            f"Rendering {len(groups)} hook groups: {executor.encode_workers} encoding, "
+            f"{executor.prepare_workers} preparing, up to {executor.queue_size} queued"
+        )
+
+        def prepare_group(index: int, entry, stack: ExitStack) -> PreparedHookVideo:
+            name, group = entry
+            if isinstance(tracker, BatchProgressTracker):
+                stack.enter_context(tracker.item(index))
+            size_estimate = self._scratch_estimate(group['hook_audio'], group['main_audio'], draft, draft_duration)
+            resume_key = self._resume_key(
+                [group[key] for key in REQUIRED_FILES], subtitle_settings, is_vertical, bg_path, draft, draft_duration
+            )
+            workspace = stack.enter_context(JobWorkspace(
+                self.temp_dir, job_id=resume_key, size_estimate=size_estimate, resumable=resume_key is not None
+            ))
+            temp_files = []
+            # Workspace bị xóa khi stack đóng (giữ lại nếu lỗi và resume được), file tạm chỉ cần dọn khi prepare lỗi
+            try:
+                return self._prepare_hook_video(
+                    workspace, group['hook_audio'], group['main_audio'], group['thumbnail'],
+                    group['subtitle'], subtitle_settings, is_vertical, bg_path, draft, draft_duration,
+                    temp_files
+                )
+            except TaskCancelledError:
+                self._cleanup_temp_files(temp_files)
+                raise
+            except Exception:
+                if workspace.stages is not None:
+                    workspace.retain()
+                else:
+                    self._cleanup_temp_files(temp_files)
+                raise
+
+        def encode_group(index: int, entry, prepared: PreparedHookVideo) -> Path:
+            name, group = entry
+            # Generate output filename
+            output_path = Path(output_dir) / f"{name}_{int(time.time())}.mp4"
+            return self._render_hook_video(
+                prepared.workspace, group['hook_audio'], group['main_audio'], group['thumbnail'],
+                group['subtitle'], output_path, subtitle_settings, is_vertical, bg_path,
+                draft, draft_duration, prepared=prepared
+            )
+
+        return executor.run(groups, prepare_group, encode_group, on_done=on_done)
+
+    def _concatenate_videos(self, video_paths: List[Path], output_path: Path, is_vertical: bool = False,
+                            draft: bool = False):
         """Concatenate multiple videos into one with re-encoding for smooth transitions"""
         try:
             # Create temp file for video list
-            temp_file = self.temp_dir / "video_list.txt"
+            temp_file = workspace_dir(self.temp_dir) / "video_list.txt"
             with open(temp_file, 'w') as f:
                 for video_path in video_paths:
                     # Convert Windows path to ffmpeg format
                     safe_path = str(video_path.absolute()).replace('\\', '/')
                     f.write(f"file '{safe_path}'\n")
             
-            # Get encoding settings
-            encoding_settings = self.get_encoding_settings(is_vertical)
-            
-            # Prepare FFmpeg command with re-encoding
-            cmd = [
-                'ffmpeg', '-y',
-                '-safe', '0',
-                '-f', 'concat',
-                '-i', str(temp_file)
-            ]
-            
-            # Add hardware acceleration if available
-            cmd.extend(encoding_settings['hwaccel'])
-            
-            # Add video encoding settings
-            cmd.extend([
-                '-c:v', 'h264_nvenc',  # Use NVIDIA encoder
-                '-preset', 'p4',        # High quality preset
-                '-tune', 'hq',          # High quality tuning
-                '-rc', 'vbr',          # Variable bitrate
-                '-cq', '20',           # Constant quality factor
-                '-b:v', '4M',          # Target bitrate
-                '-maxrate', '6M',      # Maximum bitrate
-                '-bufsize', '8M',      # Buffer size
-                '-profile:v', 'high',  # High profile
-                '-g', '30',            # Keyframe interval
-                '-keyint_min', '30',   # Minimum keyframe interval
-            ])
-            
-            # Add audio encoding settings
-            cmd.extend([
-                '-c:a', 'aac',
-                '-b:a', '192k',
-                '-ar', '48000',
-                '-ac', '2'
-            ])
+            def build_cmd(video_codec: List[str]) -> List[str]:
+                return [
+                    'ffmpeg', '-y',
+                    '-safe', '0',
+                    '-f', 'concat',
+                    '-i', str(temp_file)
+                ] + video_codec + [
+                    '-c:a', 'aac',
+                    '-b:a', '192k',
+                    '-ar', '48000',
+                    '-ac', '2'
+                ] + (['-metadata', 'comment=DRAFT'] if draft else []) + [
+                    str(output_path)
+                ]
             
-            # Output path
-            cmd.append(str(output_path))
-            
-            logging.info(f"Running FFmpeg command: {' '.join(cmd)}")
-            subprocess.run(cmd, check=True)
+            # Re-encode theo profile của stage hook_concat
+            encoding_profiles.run_encode(build_cmd, "hook_concat", draft=draft)
             logging.info(f"Successfully concatenated videos: {output_path}")
             
             # Cleanup temp file
-            if temp_file.exists():
-                try:
-                    temp_file.unlink()
-                except Exception as e:
-                    logging.warning(f"Error deleting {temp_file}: {e}")
+            temp_reaper.discard(temp_file)
                     
         except Exception as e:
             logging.error(f"Error concatenating videos: {e}")
@@ -691,7 +938,9 @@ class HookVideoProcessor:
         input_folder: Path,  # Thư mục chứa các file audio, subtitle, v.v.
         subtitle_settings: Dict,
         bg_path: Path,       # Thư mục chứa các video nền
-        is_vertical: bool = False
+        is_vertical: bool = False,
+        draft: bool = False,
+        draft_duration: Optional[float] = None
     ):
         """
         Xử lý batch video trong background
@@ -701,11 +950,14 @@ class HookVideoProcessor:
             bg_path (Path): Thư mục chứa các video nền
             subtitle_settings (Dict): Cài đặt phụ đề
             is_vertical (bool): True nếu là video dọc (9:16)
+            draft (bool): Render nhanh để xem thử
+            draft_duration (float): Chỉ render N giây đầu khi draft
         """
         try:
             from ..utils.settings_manager import SettingsManager
             from ..utils.task_history_manager import TaskHistoryManager
             from api.core.paths import path_manager
+            from api.core.render_workers import job_queue
             
             task_history = TaskHistoryManager(path_manager.base_path)
             
@@ -721,80 +973,107 @@ class HookVideoProcessor:
             if not bg_path.is_dir():
                 raise ValueError(f"Đường dẫn video nền không phải là thư mục: {bg_path}")
 
-            # Tìm các file theo pattern trong input_folder
-            file_groups = {}
-            for file in input_folder.glob("*"):
-                stem = file.stem.lower()
-                
-                # Remove suffixes to get base name
-                for suffix in ['_hook', '_audio']:
-                    if stem.endswith(suffix):
-                        stem = stem[:-len(suffix)]
-                
-                # Create group if not exists
-                if stem not in file_groups:
-                    file_groups[stem] = {}
-                
-                # Classify file
-                if '_hook.png' in file.name.lower():
-                    file_groups[stem]['thumbnail'] = file
-                elif '_hook.wav' in file.name.lower() or '_hook.mp3' in file.name.lower():
-                    file_groups[stem]['hook_audio'] = file
-                elif '_audio.wav' in file.name.lower() or '_audio.mp3' in file.name.lower():
-                    file_groups[stem]['main_audio'] = file
-                elif file.suffix.lower() == '.srt':
-                    file_groups[stem]['subtitle'] = file
-
-            # Kiểm tra số lượng file groups
-            complete_groups = [g for g in file_groups.values() if len(g) >= 4]  # Phải có đủ 4 file
+            # Tìm các nhóm file theo pattern trong input_folder
+            complete_groups = find_batch_groups(input_folder)
             if not complete_groups:
                 raise ValueError(
                     f"Không tìm thấy đủ file trong thư mục: {input_folder}\n"
                     "Mỗi nhóm cần có:\n"
                     "- Hook audio: *_hook.mp3 hoặc *_hook.wav\n"
                     "- Main audio: *_audio.mp3 hoặc *_audio.wav\n"
-                    "- Subtitle: *.srt\n"
+                    "- Subtitle: *.srt hoặc *.ass\n"
                     "- Thumbnail: *_hook.png"
                 )
 
-            # Xử lý từng nhóm file
+            # Cài đặt render gộp vào dấu vân tay quarantine: đổi preset/tỉ lệ/nền là bộ đầu vào khác
+            render_settings = {
+                "subtitle_settings": subtitle_settings,
+                "is_vertical": is_vertical,
+                "bg_path": str(bg_path),
+                "draft": draft,
+                "draft_duration": draft_duration
+            }
+
+            # Kiểm tra trước cả batch: nhóm lỗi bị loại ngay, không tốn thời gian encode
+            complete_groups, rejected = BatchPreflight(
+                self.subtitle_processor, quarantine=job_queue, render_settings=render_settings
+            ).check(complete_groups, bg_path)
+            group_results = {
+                result.name: {"status": "rejected", "error": result.reason()}
+                for result in rejected
+            }
+            if rejected:
+                task_history.merge_task(task_id, {"groups": group_results}, create=False)
+            if not complete_groups:
+                raise ValueError(
+                    f"Không có nhóm file hợp lệ ({len(rejected)} nhóm bị loại): "
+                    + "; ".join(f"{result.name}: {result.reason()}" for result in rejected[:5])
+                )
+
+            # Xử lý các nhóm file song song (số nhóm encode cùng lúc: common.batch.concurrency)
             processed_count = 0
             error_count = 0
             output_paths = []
-            
-            for name, group in file_groups.items():
-                if len(group) >= 4:  # Phải có đủ file
-                    try:
-                        # Generate output filename
-                        output_filename = f"{name}_{int(time.time())}.mp4"
-                        output_path = self.final_dir / output_filename
-                        
-                        # Process video
-                        self.process_hook_video(
-                            hook_audio=group['hook_audio'],
-                            audio_path=group['main_audio'],
-                            thumbnail_path=group['thumbnail'],
-                            subtitle_path=group['subtitle'],
-                            output_path=output_path,
-                            subtitle_settings=subtitle_settings,
-                            is_vertical=is_vertical,
-                            bg_path=bg_path  # <--- thêm
-                        )
-                        processed_count += 1
-                        output_paths.append(str(output_path))
-                        
-                    except Exception as e:
-                        logging.error(f"Lỗi khi xử lý nhóm {name}: {e}")
-                        error_count += 1
-                        continue
+            tracker = BatchProgressTracker(task_id, task_history, HOOK_STAGE_WEIGHTS, len(complete_groups))
+
+            def record_group(result):
+                # Ghi kết quả từng nhóm ngay khi xong (không chờ hết batch)
+                nonlocal processed_count, error_count
+                name = result.item[0]
+                if result.ok:
+                    processed_count += 1
+                    output_paths.append(str(result.value))
+                    group_results[name] = {
+                        "status": "completed",
+                        "output_path": str(Path(result.value).relative_to(path_manager.base_path))
+                    }
+                else:
+                    kind = classify_error(result.error)
+                    stage = getattr(result.error, "pipeline_stage", None)
+                    logging.error(f"Lỗi khi xử lý nhóm {name} ({kind}, {stage}): {result.error}")
+                    error_count += 1
+                    # Chỉ quarantine khi file đầu vào không probe/decode được
+                    bad_input = failed_input(result.error) if kind == PERMANENT else None
+                    fingerprint = group_fingerprint(result.item[1], render_settings) if bad_input else None
+                    group_results[name] = {
+                        "status": "quarantined" if fingerprint else "error",
+                        "error": str(result.error),
+                        "stage": stage
+                    }
+                    if fingerprint:
+                        # Lỗi do đầu vào: không render lại nhóm này ở các batch sau
+                        job_queue.add_quarantine(fingerprint, name, str(result.error), stage)
+                task_history.merge_task(task_id, {
+                    "groups": group_results,
+                    "output_paths": [
+                        str(Path(p).relative_to(path_manager.base_path)) 
+                        for p in output_paths
+                    ],
+                    "base_path": str(path_manager.base_path)
+                }, create=False)
+
+            with tracker.activate():
+                self.render_batch(
+                    complete_groups,
+                    self.final_dir,
+                    subtitle_settings,
+                    is_vertical=is_vertical,
+                    bg_path=bg_path,  # <--- thêm
+                    draft=draft,
+                    draft_duration=draft_duration,
+                    on_done=record_group
+                )
 
             # Update task status based on results
-            if error_count == 0:
+            if error_count == 0 and not rejected:
                 task_history.update_task_status(
                     task_id,
                     "completed",
                     message=f"Đã xử lý thành công {processed_count} video",
                     data={
+                        "progress": 100,
+                        "stage": None,
+                        "eta_seconds": 0,
                         "output_paths": [
                             str(Path(p).relative_to(path_manager.base_path)) 
                             for p in output_paths
@@ -806,8 +1085,9 @@ class HookVideoProcessor:
                 task_history.update_task_status(
                     task_id,
                     "error",
-                    error=f"Có lỗi khi xử lý {error_count}/"
-                          f"{processed_count + error_count} video",
+                    error=f"Có lỗi khi xử lý {error_count + len(rejected)}/"
+                          f"{processed_count + error_count + len(rejected)} video"
+                          + (f" ({len(rejected)} nhóm bị loại khi kiểm tra trước)" if rejected else ""),
                     data={
                         "output_paths": [
                             str(Path(p).relative_to(path_manager.base_path)) 
@@ -817,6 +1097,17 @@ class HookVideoProcessor:
                     }
                 )
 
+        except TaskCancelledError:
+            # Giữ lại danh sách video đã xong trước khi bị hủy
+            logging.info(f"Batch task {task_id} cancelled after {processed_count} videos")
+            task_history.merge_task(task_id, {
+                "output_paths": [
+                    str(Path(p).relative_to(path_manager.base_path)) 
+                    for p in output_paths
+                ],
+                "base_path": str(path_manager.base_path)
+            }, create=False)
+            raise
         except Exception as e:
             logging.error(f"Lỗi khi xử lý batch video: {e}")
             task_history.update_task_status(
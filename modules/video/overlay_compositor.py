@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from api.core.paths import path_manager
+
+class OverlayCompositor:
+    """
+    Gộp các overlay (overlay1, overlay2, ...) thành 1 ảnh RGBA duy nhất
+
+    Mỗi overlay được đặt giữa khung hình ở kích thước gốc giống filter
+    overlay=(W-w)/2:(H-h)/2, sau đó ảnh gộp được cắt theo vùng có pixel không
+    trong suốt. Khi render chỉ cần 1 filter overlay nhỏ tại (x, y) thay vì
+    nhiều lần blend toàn khung hình. Overlay trong suốt hoàn toàn bị bỏ qua.
+    Kết quả được cache theo hash nội dung ảnh + kích thước khung hình.
+    """
+
+    # Tăng khi đổi cách gộp ảnh để bỏ cache cũ
+    CACHE_VERSION = 1
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        """
+        Args:
+            cache_dir: Thư mục cache, mặc định là <base_path>/cache/overlays
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else path_manager.get_path("common", "cache") / "overlays"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._digest_cache: Dict[Tuple[str, float, int], str] = {}
+        self._lock = threading.Lock()
+
+    def _file_digest(self, path: Path) -> str:
+        """Hash nội dung file ảnh (nhớ theo mtime/size để không đọc lại)"""
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = (str(path), stat.st_mtime, stat.st_size)
+        digest = self._digest_cache.get(key)
+        if digest is None:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            self._digest_cache[key] = digest
+        return digest
+
+    def cache_key(self, overlay_paths: List[Path], frame_size: Tuple[int, int], scale: float = 1.0) -> str:
+        """Key cache của một tổ hợp overlay"""
+        key = json.dumps({
+            "version": self.CACHE_VERSION,
+            "overlays": [self._file_digest(p) for p in overlay_paths],
+            "frame": list(frame_size),
+            "scale": round(float(scale), 4)
+        }, sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def composite(self, overlay_paths: List[Optional[Path]], frame_size: Tuple[int, int],
+                  scale: float = 1.0) -> Optional[Tuple[Path, int, int]]:
+        """
+        Gộp các overlay theo thứ tự (overlay sau nằm trên)
+
+        Args:
+            overlay_paths: Danh sách ảnh overlay (None/không tồn tại sẽ bị bỏ qua)
+            frame_size: Kích thước khung hình video gốc (width, height)
+            scale: Tỉ lệ thu nhỏ (vd. render draft), áp dụng cho cả khung hình và overlay
+        Returns:
+            (đường dẫn PNG, x, y) để dùng với overlay=x:y, hoặc None nếu không còn gì để vẽ
+        """
+        overlay_paths = [Path(p) for p in overlay_paths if p and Path(p).exists()]
+        if not overlay_paths:
+            return None
+
+        key = self.cache_key(overlay_paths, frame_size, scale)
+        image_path = self.cache_dir / f"{key}.png"
+        meta_path = self.cache_dir / f"{key}.json"
+
+        with self._lock:
+            if meta_path.exists():
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                    if meta.get("empty"):
+                        return None
+                    if image_path.exists():
+                        logging.debug(f"Overlay cache hit: {image_path}")
+                        return image_path, int(meta["x"]), int(meta["y"])
+                except Exception as e:
+                    logging.warning(f"Invalid overlay cache entry {meta_path}: {e}")
+
+            frame_width = max(2, int(round(frame_size[0] * scale)))
+            frame_height = max(2, int(round(frame_size[1] * scale)))
+            canvas = Image.new("RGBA", (frame_width, frame_height), (0, 0, 0, 0))
+
+            for path in overlay_paths:
+                with Image.open(path) as source:
+                    layer = source.convert("RGBA")
+                if scale != 1.0:
+                    layer = layer.resize(
+                        (max(1, int(round(layer.width * scale))), max(1, int(round(layer.height * scale)))),
+                        Image.LANCZOS
+                    )
+                # Giống overlay=(W-w)/2:(H-h)/2, cắt phần tràn ra ngoài khung hình
+                x = (frame_width - layer.width) // 2
+                y = (frame_height - layer.height) // 2
+                src_box = (max(0, -x), max(0, -y),
+                           min(layer.width, frame_width - x), min(layer.height, frame_height - y))
+                if src_box[0] >= src_box[2] or src_box[1] >= src_box[3]:
+                    continue
+                canvas.alpha_composite(layer, dest=(max(0, x), max(0, y)), source=src_box)
+
+            bbox = canvas.getchannel("A").getbbox()
+            if not bbox:
+                logging.info(f"Overlays are fully transparent, skipping: {[str(p) for p in overlay_paths]}")
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({"empty": True}, f)
+                return None
+
+            # Giữ tọa độ/kích thước chẵn cho yuv420p
+            left, top = bbox[0] - bbox[0] % 2, bbox[1] - bbox[1] % 2
+            right = min(frame_width, bbox[2] + (bbox[2] - left) % 2)
+            bottom = min(frame_height, bbox[3] + (bbox[3] - top) % 2)
+            cropped = canvas.crop((left, top, right, bottom))
+
+            tmp_path = image_path.with_suffix(".tmp.png")
+            cropped.save(tmp_path, format="PNG")
+            tmp_path.replace(image_path)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"x": left, "y": top, "width": cropped.width, "height": cropped.height}, f)
+
+            logging.info(
+                f"Composited {len(overlay_paths)} overlays into {cropped.width}x{cropped.height} "
+                f"at ({left}, {top}): {image_path}"
+            )
+            return image_path, left, top
@@ -3,11 +3,19 @@ from pathlib import Path
 import logging
 import subprocess
 import random
-import time
 from typing import Dict, List, Optional
 from modules.file.file_manager import FileManager
 from .video_cutter import VideoCutter
 from .subtitle_processor import SubtitleProcessor
+from .smart_cut import SmartCutter
+from .encoding_profiles import encoding_profiles
+from .overlay_compositor import OverlayCompositor
+from .baked_background_cache import BakedBackgroundCache, BakedCacheLease
+from modules.utils.progress import progress_stage
+from modules.utils.cancellation import TaskCancelledError
+from modules.utils.job_workspace import JobWorkspace, sweep_orphaned_workspaces
+from modules.utils.scratch_manager import scratch_manager
+from modules.utils.temp_reaper import temp_reaper
 
 class VideoProcessor:
     def __init__(self, base_path: Path, paths: Dict[str, Path] = None):
@@ -16,34 +24,15 @@ class VideoProcessor:
         self.file_manager = FileManager(base_path)
         self.video_cutter = VideoCutter(self.paths.get('cut', base_path / 'cut'))
         self.subtitle_processor = SubtitleProcessor()
+        self.smart_cutter = SmartCutter()
+        self.overlay_compositor = OverlayCompositor()
+        self.baked_cache = BakedBackgroundCache()
+        # Dọn workspace của job từ lần chạy trước bị crash/kill
+        sweep_orphaned_workspaces(self.base_path / 'temp')
         
-    def _safe_delete_file(self, file_path: Path, max_retries: int = 3, initial_delay: float = 0.5):
-        """Safely delete a file with retries and exponential backoff"""
-        if not file_path.exists():
-            return
-
-        delay = initial_delay
-        for attempt in range(max_retries):
-            try:
-                # Wait before trying to delete
-                time.sleep(delay)
-                file_path.unlink()
-                logging.debug(f"Successfully deleted {file_path}")
-                return
-            except PermissionError:
-                if attempt < max_retries - 1:
-                    logging.debug(f"Failed to delete {file_path}, retrying in {delay}s...")
-                    delay *= 2  # Exponential backoff
-                else:
-                    logging.warning(f"Could not delete {file_path} after {max_retries} attempts")
-            except Exception as e:
-                logging.warning(f"Error deleting {file_path}: {e}")
-                break
-
     def _cleanup_temp_files(self, temp_files: List[Path]):
-        """Clean up temporary files safely"""
-        for file_path in temp_files:
-            self._safe_delete_file(file_path)
+        """Giao file tạm cho TempReaper xóa ở thread nền (render không chờ)"""
+        temp_reaper.discard_many(temp_files)
 
     def get_video_duration(self, video_path: Path) -> float:
         """Get video duration in seconds"""
@@ -136,39 +125,11 @@ class VideoProcessor:
 
     def check_gpu_support(self) -> bool:
         """Check if GPU encoding is supported"""
-        try:
-            result = subprocess.run(
-                ['ffmpeg', '-hide_banner', '-encoders'],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            return 'h264_nvenc' in result.stdout
-        except Exception:
-            return False
+        return encoding_profiles.gpu_available()
             
-    def get_encoding_settings(self) -> dict:
-        """Get encoding settings based on hardware support"""
-        if self.check_gpu_support():
-            return {
-                'hwaccel': [],
-                'video_codec': [
-                    '-c:v', 'h264_nvenc',
-                    '-preset', 'p7',
-                    '-rc', 'vbr',
-                    '-cq', '20',
-                    '-b:v', '0'
-                ]
-            }
-        else:
-            return {
-                'hwaccel': [],
-                'video_codec': [
-                    '-c:v', 'libx264',
-                    '-preset', 'medium',
-                    '-crf', '23'
-                ]
-            }
+    def get_encoding_settings(self, stage: str = "video_final") -> dict:
+        """Get encoding settings for a pipeline stage from the profile registry"""
+        return encoding_profiles.encoding_settings(stage)
 
     def process_video(
         self,
@@ -177,9 +138,49 @@ class VideoProcessor:
         overlay1_path: Optional[Path] = None,
         overlay2_path: Optional[Path] = None,
         subtitle_config: Optional[Dict] = None,
-        output_name: Optional[str] = None
+        output_name: Optional[str] = None,
+        draft: bool = False,
+        draft_duration: Optional[float] = None
     ):
+        """
+        Tạo video cuối từ audio, subtitle và overlay
+
+        Args:
+            draft: Render nhanh để xem thử (480p, fps thấp, profile 'draft'),
+                   file đầu ra có hậu tố _draft
+            draft_duration: Chỉ render N giây đầu khi draft (None = lấy theo settings)
+        Returns:
+            Path: Đường dẫn video đầu ra
+        """
+        # Mỗi lần render có thư mục làm việc riêng (temp/jobs/<id> hoặc trên scratch), xóa khi xong
+        size_estimate = None
+        if scratch_manager.enabled and Path(audio_path).exists():
+            # File trung gian: đoạn cắt cuối + bản concat video nền (file ASS không đáng kể)
+            size_estimate = scratch_manager.estimate_bytes(self.get_video_duration(audio_path), video_copies=2)
+        # Lease giữ các clip nền đã bake (không bị evict) tới khi render xong
+        with JobWorkspace(self.base_path / 'temp', size_estimate=size_estimate) as workspace, \
+                self.baked_cache.lease() as baked_lease:
+            return self._render_video(
+                workspace, baked_lease, audio_path, subtitle_path, overlay1_path, overlay2_path,
+                subtitle_config, output_name, draft, draft_duration
+            )
+
+    def _render_video(
+        self,
+        workspace: JobWorkspace,
+        baked_lease: BakedCacheLease,
+        audio_path: Path,
+        subtitle_path: Path,
+        overlay1_path: Optional[Path],
+        overlay2_path: Optional[Path],
+        subtitle_config: Optional[Dict],
+        output_name: Optional[str],
+        draft: bool,
+        draft_duration: Optional[float]
+    ) -> Path:
+        """process_video trong workspace của job, mọi file trung gian ghi vào workspace"""
         temp_files = []
+        partial_output = None
         try:
             audio_path = Path(audio_path)
             subtitle_path = Path(subtitle_path)
@@ -203,16 +204,32 @@ class VideoProcessor:
                 logging.warning(f"Overlay2 file not found: {overlay2_path}")
                 overlay2_path = None
             
-            self.base_path.joinpath('temp').mkdir(parents=True, exist_ok=True)
             self.base_path.joinpath('final').mkdir(parents=True, exist_ok=True)
             
             audio_duration = self.get_video_duration(audio_path)
+            if draft:
+                draft_duration = encoding_profiles.draft_duration(draft_duration)
+                if draft_duration:
+                    audio_duration = min(audio_duration, draft_duration)
+                logging.info(f"Draft render: {audio_duration:.2f}s")
             
             cut_videos = self.file_manager.get_cut_videos()
             if not cut_videos:
                 raise ValueError("No cut videos available. Please run video cutter first.")
             
+            # Gộp overlay1 + overlay2 thành 1 ảnh nhỏ (cache theo nội dung)
+            frame_size = (
+                int(encoding_profiles.video_settings.get('width', 1920)),
+                int(encoding_profiles.video_settings.get('height', 1080))
+            )
+            overlay_scale = encoding_profiles.draft_size()[1] / float(frame_size[1]) if draft else 1.0
+            overlay = self.overlay_compositor.composite([overlay1_path, overlay2_path], frame_size, overlay_scale)
+            
+            # Bộ overlay dùng lại nhiều lần: lấy clip nền đã burn sẵn overlay
+            bake_overlay = bool(overlay) and not draft and self.baked_cache.enabled
+            
             selected_videos = []
+            used_sources = []  # Clip gốc đã chọn (selected_videos có thể là bản đã bake)
             current_duration = 0
             available_videos = cut_videos.copy()
             
@@ -226,34 +243,30 @@ class VideoProcessor:
                     logging.warning(f"Skipping video with zero duration: {video}")
                     continue
                 
+                clip = self.baked_cache.get_or_bake(video, overlay, baked_lease) if bake_overlay else video
+                
                 if current_duration + video_duration > audio_duration:
                     cut_duration = audio_duration - current_duration
                     
-                    cut_video_path = self.base_path / 'temp' / f"cut_{len(selected_videos):04d}.mp4"
+                    cut_video_path = workspace.file(f"cut_{len(selected_videos):04d}.mp4")
                     temp_files.append(cut_video_path)
                     
-                    cut_cmd = [
-                        'ffmpeg', '-y', 
-                        '-i', str(video), 
-                        '-t', str(cut_duration),
-                        '-c', 'copy',
-                        str(cut_video_path)
-                    ]
-                    
-                    subprocess.run(cut_cmd, check=True)
+                    # Cắt chính xác tới frame, chỉ encode lại GOP cuối
+                    self.smart_cutter.cut(clip, 0, cut_duration, cut_video_path)
                     
                     selected_videos.append(cut_video_path)
                     current_duration += cut_duration
                     logging.info(f"Partially selected video: {video} (Cut duration: {cut_duration:.2f}s, Total: {current_duration:.2f}s)")
                     break
                 else:
-                    selected_videos.append(video)
+                    selected_videos.append(clip)
+                    used_sources.append(video)
                     current_duration += video_duration
                     logging.info(f"Selected video: {video} (Duration: {video_duration:.2f}s, Total: {current_duration:.2f}s)")
                 
                 if current_duration < audio_duration and not available_videos:
                     logging.warning(f"Reusing cut videos to reach target duration. Current: {current_duration:.2f}s, Target: {audio_duration:.2f}s")
-                    available_videos = [v for v in cut_videos if v not in selected_videos]
+                    available_videos = [v for v in cut_videos if v not in used_sources]
                     if not available_videos:
                         available_videos = cut_videos.copy()
             
@@ -261,74 +274,67 @@ class VideoProcessor:
                 raise ValueError("Could not find suitable videos for the audio duration")
             
             # Create concat file
-            concat_file = self.base_path / 'temp' / 'concat.txt'
+            concat_file = workspace.file('concat.txt')
             temp_files.append(concat_file)
             
             with open(concat_file, 'w', encoding='utf-8') as f:
                 for video in selected_videos:
                     f.write(f"file '{video.absolute()}'\n")
             
-            # Concatenate videos
-            temp_video = self.base_path / 'temp' / 'temp_concat.mp4'
-            temp_files.append(temp_video)
-            
-            encoding_settings = self.get_encoding_settings()
-            
-            concat_cmd = [
-                'ffmpeg', '-y'
-            ]
-            concat_cmd.extend(encoding_settings['hwaccel'])
-            concat_cmd.extend([
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', str(concat_file)
-            ])
-            concat_cmd.extend(encoding_settings['video_codec'])
-            concat_cmd.append(str(temp_video))
-            
-            subprocess.run(concat_cmd, check=True)
-            
             # Add audio, subtitle and overlays
             if output_name:
                 output_path = self.base_path / 'final' / output_name
             else:
                 output_path = self.base_path / 'final' / f"{audio_path.stem}_final.mp4"
+            if draft:
+                output_path = encoding_profiles.draft_output_path(output_path)
             output_path.parent.mkdir(exist_ok=True)
+            partial_output = output_path
 
             # Build FFmpeg command
             cmd = ['ffmpeg', '-y']
-            cmd.extend(encoding_settings['hwaccel'])
-            cmd.extend([
-                '-i', str(temp_video),
-                '-i', str(audio_path)
-            ])
-
-            input_files = 2
-            if overlay1_path:
-                cmd.extend(['-i', str(overlay1_path)])
-                input_files += 1
-            if overlay2_path:
-                cmd.extend(['-i', str(overlay2_path)])
-                input_files += 1
+            if draft:
+                # Draft: đọc thẳng danh sách clip, bỏ qua bước encode nối video trung gian
+                cmd.extend(['-f', 'concat', '-safe', '0', '-i', str(concat_file)])
+            else:
+                # Concatenate videos
+                temp_video = workspace.file('temp_concat.mp4')
+                temp_files.append(temp_video)
+                
+                def build_concat_cmd(video_codec: List[str]) -> List[str]:
+                    return [
+                        'ffmpeg', '-y',
+                        '-f', 'concat',
+                        '-safe', '0',
+                        '-i', str(concat_file),
+                        '-an'
+                    ] + video_codec + [str(temp_video)]
+                
+                with progress_stage("video_concat", audio_duration):
+                    encoding_profiles.run_encode(build_concat_cmd, "video_concat")
+                cmd.extend(['-i', str(temp_video)])
+            cmd.extend(['-i', str(audio_path)])
 
             filter_complex = []
             
-            filter_complex.append("[0:v]null[base]")
+            if draft:
+                # Thu nhỏ khung hình trước, overlay được gộp sẵn theo cùng tỉ lệ
+                draft_width, draft_height = encoding_profiles.draft_size()
+                draft_fps = encoding_profiles.draft_settings.get('fps', 15)
+                filter_complex.append(f"[0:v]scale={draft_width}:{draft_height},setsar=1,fps={draft_fps}[base]")
+            else:
+                filter_complex.append("[0:v]null[base]")
             last_output = "base"
             
-            if overlay1_path:
-                filter_complex.append(f"[{last_output}][{input_files-2}:v]overlay=(W-w)/2:(H-h)/2[ov1]")
-                last_output = "ov1"
-            
-            if overlay2_path:
-                filter_complex.append(f"[{last_output}][{input_files-1}:v]overlay=(W-w)/2:(H-h)/2[ov2]")
-                last_output = "ov2"
+            # Clip nền đã có overlay thì bước cuối chỉ còn burn subtitle
+            if overlay and not bake_overlay:
+                overlay_path, overlay_x, overlay_y = overlay
+                cmd.extend(['-i', str(overlay_path)])
+                filter_complex.append(f"[{last_output}][2:v]overlay={overlay_x}:{overlay_y}[ov]")
+                last_output = "ov"
             
-            # Chuẩn hóa đường dẫn subtitle
-            subtitle_path_str = str(subtitle_path).replace("\\", "/").replace(":", "\\:")
-            
-            # Thêm subtitle ở layer cuối cùng
-            filter_complex.append(f"[{last_output}]ass='{subtitle_path_str}'[final]")
+            # Thêm subtitle ở layer cuối cùng (fontsdir chỉ chứa font cần dùng)
+            filter_complex.append(f"[{last_output}]{self.subtitle_processor.ass_filter(subtitle_path)}[final]")
             last_output = "final"
 
             cmd.extend([
@@ -336,26 +342,36 @@ class VideoProcessor:
                 '-map', f'[{last_output}]',
                 '-map', '1:a'
             ])
-            cmd.extend(encoding_settings['video_codec'])
-            cmd.extend([
-                '-c:a', 'aac',
-                '-b:a', '192k'
-            ])
-            cmd.append(str(output_path))
-
-            # Log FFmpeg command
-            logging.info(f"FFmpeg command: {' '.join(cmd)}")
+            if draft:
+                cmd.extend([
+                    '-r', str(draft_fps),
+                    '-t', f"{audio_duration:.3f}",
+                    '-metadata', 'comment=DRAFT'
+                ])
+            else:
+                cmd.extend(['-r', str(encoding_profiles.video_settings.get('fps', 30))])
 
-            subprocess.run(cmd, check=True)
+            def build_final_cmd(video_codec: List[str]) -> List[str]:
+                return cmd + video_codec + [
+                    '-c:a', 'aac',
+                    '-b:a', '96k' if draft else '192k',
+                    str(output_path)
+                ]
 
-            # Give ffmpeg some time to release file handles
-            time.sleep(0.5)
+            with progress_stage("video_final", audio_duration):
+                encoding_profiles.run_encode(build_final_cmd, "video_final", draft=draft,
+                                             env=self.subtitle_processor.ass_env(subtitle_path))
 
             # Clean up temp files
             self._cleanup_temp_files(temp_files)
 
             return output_path
 
+        except TaskCancelledError:
+            # Bị hủy: xóa file tạm và file đầu ra đang ghi dở
+            logging.info("Video processing cancelled, cleaning up temp files")
+            self._cleanup_temp_files(temp_files + ([partial_output] if partial_output else []))
+            raise
         except Exception as e:
             logging.error(f"Error processing video: {str(e)}")
             raise
@@ -0,0 +1,301 @@
+import logging
+import subprocess
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from .encoding_profiles import encoding_profiles
+from .ffmpeg_runner import run_ffmpeg
+
+class SmartCutter:
+    """
+    Cắt video chính xác tới từng frame với tốc độ gần bằng stream copy.
+
+    Phần nằm giữa 2 keyframe được copy nguyên (không encode lại), chỉ GOP
+    dở dang ở điểm đầu/cuối được encode lại bằng libx264 với profile, level,
+    kích thước, số ref frame của nguồn. Các phần được ghép qua MPEG-TS (SPS/PPS
+    nằm trong từng đoạn); nguồn không khớp được (High 10, 4:2:2, ...) thì encode
+    lại toàn bộ đoạn cắt thay vì ghép SPS khác nhau vào 1 file MP4.
+    """
+
+    # Sai số (giây) khi so sánh mốc cắt với keyframe
+    EPSILON = 0.001
+
+    # profile H.264 của nguồn (ffprobe) -> profile libx264 tạo ra SPS tương thích
+    X264_PROFILES = {
+        'baseline': 'baseline',
+        'constrained baseline': 'baseline',
+        'main': 'main',
+        'high': 'high'
+    }
+
+    # pix_fmt mà các profile trên encode được
+    X264_PIX_FMTS = ('yuv420p', 'yuvj420p')
+
+    def __init__(self, temp_dir: Optional[Path] = None):
+        """
+        Args:
+            temp_dir: Thư mục chứa các đoạn tạm, mặc định là thư mục của file đầu ra
+        """
+        self.temp_dir = Path(temp_dir) if temp_dir else None
+        self._keyframe_cache: Dict[Tuple[str, float], List[float]] = {}
+        self._stream_cache: Dict[Tuple[str, float], dict] = {}
+
+    def _cache_key(self, video_path: Path) -> Tuple[str, float]:
+        video_path = Path(video_path).resolve()
+        return str(video_path), video_path.stat().st_mtime
+
+    def get_keyframes(self, video_path: Path) -> List[float]:
+        """Lấy danh sách thời điểm keyframe (giây) từ packet flags, không cần decode"""
+        key = self._cache_key(video_path)
+        if key in self._keyframe_cache:
+            return self._keyframe_cache[key]
+
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0',
+            str(video_path)
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+        keyframes = []
+        for line in result.stdout.splitlines():
+            parts = line.strip().split(',')
+            if len(parts) < 2 or 'K' not in parts[1]:
+                continue
+            try:
+                keyframes.append(float(parts[0]))
+            except ValueError:
+                continue
+
+        keyframes.sort()
+        self._keyframe_cache[key] = keyframes
+        return keyframes
+
+    def get_stream_info(self, video_path: Path) -> dict:
+        """Lấy thông tin stream video (codec, pix_fmt, fps, timescale) để encode đoạn biên khớp với nguồn"""
+        key = self._cache_key(video_path)
+        if key in self._stream_cache:
+            return self._stream_cache[key]
+
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=codec_name,profile,level,width,height,refs,has_b_frames,'
+                             'pix_fmt,r_frame_rate,time_base',
+            '-of', 'default=noprint_wrappers=1',
+            str(video_path)
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        info = {}
+        for line in result.stdout.splitlines():
+            if '=' in line:
+                name, value = line.split('=', 1)
+                info[name.strip()] = value.strip()
+
+        has_audio = subprocess.run(
+            [
+                'ffprobe', '-v', 'error',
+                '-select_streams', 'a:0',
+                '-show_entries', 'stream=index',
+                '-of', 'csv=p=0',
+                str(video_path)
+            ],
+            capture_output=True, text=True
+        ).stdout.strip() != ''
+        info['has_audio'] = has_audio
+
+        self._stream_cache[key] = info
+        return info
+
+    def _match_args(self, stream_info: dict) -> Optional[List[str]]:
+        """
+        Tham số libx264 để đoạn biên có SPS khớp đoạn copy (profile, level, kích thước,
+        số ref frame, B-frame, pix_fmt, fps)
+
+        File MP4 ghép chỉ có 1 avcC (của đoạn đầu) và SPS/PPS của từng đoạn nằm
+        in-band; nếu các thông số này khác nhau nhiều decoder phần cứng/trình duyệt
+        không phát được.
+        Returns:
+            List[str], None nếu không khớp được (khi đó phải encode lại toàn bộ đoạn cắt)
+        """
+        profile = self.X264_PROFILES.get((stream_info.get('profile') or '').lower())
+        pix_fmt = stream_info.get('pix_fmt') or ''
+        try:
+            level = int(stream_info.get('level') or 0)
+            width = int(stream_info.get('width') or 0)
+            height = int(stream_info.get('height') or 0)
+        except ValueError:
+            return None
+        if profile is None or pix_fmt not in self.X264_PIX_FMTS or level <= 0 or width <= 0 or height <= 0:
+            return None
+
+        args = [
+            '-profile:v', profile,
+            '-level', f"{level // 10}.{level % 10}",
+            '-s', f"{width}x{height}",
+            '-pix_fmt', pix_fmt
+        ]
+        refs = stream_info.get('refs')
+        if refs and refs.isdigit() and int(refs) > 0:
+            args.extend(['-refs', refs])
+        if profile == 'baseline' or stream_info.get('has_b_frames') == '0':
+            args.extend(['-bf', '0'])
+        return args
+
+    def _encode_args(self, stream_info: dict, match: bool = True) -> List[str]:
+        """
+        Tham số encode đoạn cắt
+        Args:
+            match: Khớp SPS với đoạn copy (đoạn biên); False khi encode lại toàn bộ
+        """
+        # Luôn encode bằng CPU (libx264) để điều khiển được profile/level
+        args = encoding_profiles.stage_args("smart_cut", gpu=False)
+        match_args = self._match_args(stream_info) if match else None
+        if match_args:
+            # Đặt sau tham số của profile để ghi đè -profile:v/-pix_fmt của profile
+            args.extend(match_args)
+        else:
+            args.extend(['-pix_fmt', stream_info.get('pix_fmt') or 'yuv420p'])
+        if stream_info.get('r_frame_rate') and stream_info['r_frame_rate'] != '0/0':
+            args.extend(['-r', stream_info['r_frame_rate']])
+        return args
+
+    def _encode_part(self, video_path: Path, start: float, duration: float,
+                     output_path: Path, stream_info: dict, match: bool = True):
+        """Encode lại một đoạn (chính xác tới frame)"""
+        cmd = [
+            'ffmpeg', '-y',
+            '-ss', f"{start:.6f}",
+            '-i', str(video_path),
+            '-t', f"{duration:.6f}",
+            '-map', '0:v:0',
+            '-an'
+        ]
+        cmd.extend(self._encode_args(stream_info, match))
+        cmd.extend(['-f', 'mpegts', str(output_path)])
+        run_ffmpeg(cmd, "smart_cut")
+
+    def _copy_part(self, video_path: Path, start: float, duration: float, output_path: Path):
+        """Copy nguyên đoạn nằm giữa 2 keyframe"""
+        cmd = [
+            'ffmpeg', '-y',
+            '-ss', f"{start:.6f}",
+            '-i', str(video_path),
+            '-t', f"{duration:.6f}",
+            '-map', '0:v:0',
+            '-an',
+            '-c', 'copy',
+            '-bsf:v', 'h264_mp4toannexb',
+            '-f', 'mpegts',
+            str(output_path)
+        ]
+        run_ffmpeg(cmd, "smart_cut")
+
+    def cut(self, video_path: Path, start: float, duration: float, output_path: Path) -> Path:
+        """
+        Cắt đoạn [start, start + duration) chính xác tới frame.
+
+        Args:
+            video_path: Video nguồn
+            start: Thời điểm bắt đầu (giây)
+            duration: Độ dài đoạn cắt (giây)
+            output_path: File đầu ra (.mp4)
+        Returns:
+            Path: Đường dẫn file đầu ra
+        """
+        video_path = Path(video_path)
+        output_path = Path(output_path)
+        start = max(0.0, float(start or 0.0))
+        duration = float(duration)
+        end = start + duration
+        work_dir = self.temp_dir or output_path.parent
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+        stream_info = self.get_stream_info(video_path)
+        # Chỉ copy GOP khi đoạn biên encode ra được SPS tương thích với nguồn
+        can_copy = stream_info.get('codec_name') == 'h264' and self._match_args(stream_info) is not None
+        if stream_info.get('codec_name') == 'h264' and not can_copy:
+            logging.info(
+                f"Smart cut {video_path.name}: cannot match source profile/level "
+                f"({stream_info.get('profile')}, level {stream_info.get('level')}, {stream_info.get('pix_fmt')}), "
+                "re-encoding the whole cut"
+            )
+        keyframes = self.get_keyframes(video_path) if can_copy else []
+
+        # Keyframe đầu tiên >= start và keyframe cuối cùng <= end
+        k_in = next((k for k in keyframes if k >= start - self.EPSILON), None)
+        k_out = next((k for k in reversed(keyframes) if k <= end + self.EPSILON), None)
+
+        token = uuid.uuid4().hex[:8]
+        parts = []
+        # (loại, bắt đầu, độ dài)
+        if k_in is None or k_out is None or k_out - k_in <= self.EPSILON:
+            # Không có GOP nguyên vẹn nào trong đoạn (hoặc không copy được): encode lại toàn bộ
+            plan = [('full', start, duration)]
+        else:
+            plan = []
+            if k_in - start > self.EPSILON:
+                plan.append(('encode', start, k_in - start))
+            plan.append(('copy', k_in, k_out - k_in))
+            if end - k_out > self.EPSILON:
+                plan.append(('encode', k_out, end - k_out))
+
+        logging.info(
+            f"Smart cut {video_path.name} [{start:.3f}s - {end:.3f}s]: "
+            + ", ".join(f"{kind} {part_start:.3f}s+{part_duration:.3f}s" for kind, part_start, part_duration in plan)
+        )
+
+        try:
+            for index, (kind, part_start, part_duration) in enumerate(plan):
+                part_path = work_dir / f"smartcut_{token}_{index}.ts"
+                parts.append(part_path)
+                if kind == 'copy':
+                    self._copy_part(video_path, part_start, part_duration, part_path)
+                else:
+                    self._encode_part(video_path, part_start, part_duration, part_path, stream_info,
+                                      match=kind == 'encode')
+
+            # Ghép các đoạn video và lấy audio từ nguồn cho đúng khoảng thời gian
+            list_file = work_dir / f"smartcut_{token}.txt"
+            parts.append(list_file)
+            with open(list_file, 'w', encoding='utf-8') as f:
+                for part in parts[:-1]:
+                    f.write(f"file '{part.absolute().as_posix()}'\n")
+
+            cmd = [
+                'ffmpeg', '-y',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', str(list_file)
+            ]
+            if stream_info.get('has_audio'):
+                cmd.extend([
+                    '-ss', f"{start:.6f}",
+                    '-t', f"{duration:.6f}",
+                    '-i', str(video_path),
+                    '-map', '0:v:0',
+                    '-map', '1:a:0',
+                    '-c:v', 'copy',
+                    '-c:a', 'aac',
+                    '-shortest'
+                ])
+            else:
+                cmd.extend(['-map', '0:v:0', '-c:v', 'copy'])
+            cmd.extend(['-movflags', '+faststart', str(output_path)])
+            run_ffmpeg(cmd, "smart_cut")
+
+            return output_path
+
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Smart cut failed for {video_path}: {e.stderr}")
+            raise
+        finally:
+            for part in parts:
+                try:
+                    part.unlink(missing_ok=True)
+                except Exception as e:
+                    logging.warning(f"Could not delete smart cut part {part}: {e}")
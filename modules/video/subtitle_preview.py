@@ -0,0 +1,260 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+from api.core.paths import path_manager
+from .subtitle_processor import SubtitleProcessor
+from .encoding_profiles import encoding_profiles
+from .ffmpeg_runner import run_ffmpeg
+
+class SubtitlePreviewRenderer:
+    """
+    Render 1 frame PNG để xem thử style subtitle của một preset
+
+    Dùng đúng đường render thật: SubtitleProcessor.convert_srt_to_ass + filter ass (libass),
+    vẽ lên một frame nền đã cache sẵn theo tỉ lệ khung hình. Kết quả được cache theo
+    (hash preset, nội dung text/subtitle, timestamp, tỉ lệ) nên xem lại là có ngay.
+    Dung lượng cache bị giới hạn, ảnh xem lâu nhất (theo mtime) bị xóa trước.
+    """
+
+    # Dung lượng tối đa của các ảnh preview đã render (frame nền không tính)
+    MAX_CACHE_SIZE_MB = 256
+
+    # Thời lượng cue khi xem thử bằng 1 dòng text mẫu
+    SAMPLE_CUE_DURATION = 5.0
+
+    # Render 1 frame: quá thời gian này coi như ffmpeg bị treo (giây)
+    FRAME_TIMEOUT = 60
+
+    def __init__(self, cache_dir: Optional[Path] = None, subtitle_processor: Optional[SubtitleProcessor] = None,
+                 max_size_mb: Optional[float] = None):
+        """
+        Args:
+            cache_dir: Thư mục cache, mặc định là <base_path>/cache/subtitle_preview
+            subtitle_processor: SubtitleProcessor dùng chung (nếu có)
+            max_size_mb: Dung lượng tối đa của cache (MB), mặc định MAX_CACHE_SIZE_MB
+        """
+        self.max_size_bytes = int(float(max_size_mb if max_size_mb is not None else self.MAX_CACHE_SIZE_MB) * 1024 ** 2)
+        self.cache_dir = Path(cache_dir) if cache_dir else path_manager.get_path("common", "cache") / "subtitle_preview"
+        self.frames_dir = self.cache_dir / "frames"
+        self.frames_dir.mkdir(parents=True, exist_ok=True)
+        self.subtitle_processor = subtitle_processor or SubtitleProcessor()
+        self._frame_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    def frame_size(self, is_vertical: bool = False) -> tuple:
+        """Kích thước frame (width, height) giống video thật"""
+        if is_vertical:
+            return 1080, 1920
+        return encoding_profiles.video_settings.get("width", 1920), encoding_profiles.video_settings.get("height", 1080)
+
+    def _find_background_clip(self, is_vertical: bool) -> Optional[Path]:
+        """Tìm một clip nền để lấy frame"""
+        candidates = [
+            path_manager.get_path("hook_maker", "input_9_16" if is_vertical else "input_16_9"),
+            path_manager.get_path("hook_maker", "cut")
+        ]
+        for folder in candidates:
+            folder = Path(folder)
+            if folder.exists():
+                clips = sorted(folder.glob("*.mp4"))
+                if clips:
+                    return clips[0]
+        return None
+
+    def get_background_frame(self, is_vertical: bool = False) -> Path:
+        """
+        Lấy frame nền (cache theo tỉ lệ khung hình)
+        Returns:
+            Path: File PNG frame nền
+        """
+        frame_path = self.frames_dir / ("background_9_16.png" if is_vertical else "background_16_9.png")
+        with self._frame_lock:
+            if frame_path.exists():
+                return frame_path
+
+            width, height = self.frame_size(is_vertical)
+            scale = (
+                f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+                f"crop={width}:{height},setsar=1"
+            )
+            clip = self._find_background_clip(is_vertical)
+            tmp_path = frame_path.with_name(f"{frame_path.stem}_{uuid.uuid4().hex[:8]}.png")
+
+            if clip:
+                cmd = [
+                    'ffmpeg', '-y',
+                    '-ss', '1',
+                    '-i', str(clip),
+                    '-vf', scale,
+                    '-frames:v', '1',
+                    str(tmp_path)
+                ]
+                result = run_ffmpeg(cmd, "preview_background", check=False, timeout=self.FRAME_TIMEOUT)
+                if not result.ok or not tmp_path.exists():
+                    logging.warning(f"Could not extract preview frame from {clip}: {result.stderr}")
+                    clip = None
+
+            if not clip:
+                # Không có clip nền: dùng nền xám
+                cmd = [
+                    'ffmpeg', '-y',
+                    '-f', 'lavfi',
+                    '-i', f"color=c=0x404040:s={width}x{height}",
+                    '-frames:v', '1',
+                    str(tmp_path)
+                ]
+                run_ffmpeg(cmd, "preview_background", timeout=self.FRAME_TIMEOUT)
+
+            tmp_path.replace(frame_path)
+            logging.info(f"Cached subtitle preview background: {frame_path}")
+            return frame_path
+
+    def _cache_key(self, settings: Dict, text: Optional[str], subtitle_bytes: Optional[bytes],
+                   timestamp: float, is_vertical: bool) -> str:
+        """Key cache: hash của preset + nội dung + timestamp + tỉ lệ"""
+        preset_hash = hashlib.sha256(
+            json.dumps(settings or {}, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        content_hash = hashlib.sha256(subtitle_bytes).hexdigest() if subtitle_bytes is not None else None
+        key = json.dumps({
+            "preset": preset_hash,
+            "text": text,
+            "subtitle": content_hash,
+            "timestamp": round(float(timestamp), 3),
+            "vertical": bool(is_vertical)
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _format_srt_time(seconds: float) -> str:
+        """Giây -> HH:MM:SS,mmm"""
+        ms = int(round(max(seconds, 0.0) * 1000))
+        hours, ms = divmod(ms, 3600000)
+        minutes, ms = divmod(ms, 60000)
+        secs, ms = divmod(ms, 1000)
+        return f"{hours:02d}:{minutes:02d}:{secs:02d},{ms:03d}"
+
+    def render(self, settings: Dict, text: Optional[str] = None, subtitle_path: Optional[Path] = None,
+               timestamp: float = 0.0, is_vertical: bool = False) -> Path:
+        """
+        Render 1 frame xem thử subtitle
+
+        Args:
+            settings: Cài đặt subtitle (preset)
+            text: Dòng text mẫu (dùng khi không có subtitle_path)
+            subtitle_path: File .srt/.ass để lấy dòng subtitle tại timestamp
+            timestamp: Thời điểm (giây) cần render
+            is_vertical: True nếu là video dọc (9:16)
+        Returns:
+            Path: File PNG đã render (trong cache)
+        """
+        if not text and not subtitle_path:
+            raise ValueError("Either text or subtitle_path is required")
+
+        subtitle_bytes = None
+        if subtitle_path:
+            subtitle_path = Path(subtitle_path)
+            if not subtitle_path.exists():
+                raise FileNotFoundError(f"Subtitle file not found: {subtitle_path}")
+            subtitle_bytes = subtitle_path.read_bytes()
+            text = None
+        else:
+            # Dòng text mẫu luôn hiện từ 0s
+            timestamp = min(float(timestamp or 0.0), self.SAMPLE_CUE_DURATION - 0.5)
+
+        timestamp = max(float(timestamp or 0.0), 0.0)
+        key = self._cache_key(settings, text, subtitle_bytes, timestamp, is_vertical)
+        output_path = self.cache_dir / f"{key}.png"
+        if output_path.exists():
+            logging.debug(f"Subtitle preview cache hit: {output_path}")
+            try:
+                os.utime(output_path, None)  # Đánh dấu vừa dùng
+            except OSError:
+                pass
+            return output_path
+
+        background = self.get_background_frame(is_vertical)
+        work_dir = self.cache_dir / f"work_{key[:16]}_{uuid.uuid4().hex[:8]}"
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+        try:
+            # convert_srt_to_ass ghi vào cache ASS, không ghi cạnh file gốc
+            if subtitle_path and subtitle_path.suffix.lower() == '.ass':
+                ass_path = subtitle_path
+            else:
+                srt_path = subtitle_path
+                if not srt_path:
+                    srt_path = work_dir / "preview.srt"
+                    with open(srt_path, 'w', encoding='utf-8') as f:
+                        f.write("1\n")
+                        f.write(f"{self._format_srt_time(0)} --> {self._format_srt_time(self.SAMPLE_CUE_DURATION)}\n")
+                        f.write(f"{text.strip()}\n\n")
+
+                ass_path = self.subtitle_processor.convert_srt_to_ass(srt_path, settings, 0, is_vertical)
+                if not ass_path or not Path(ass_path).exists():
+                    raise ValueError("Failed to convert subtitle to ASS for preview")
+
+            tmp_output = work_dir / "preview.png"
+
+            # Dời PTS của frame nền tới timestamp để libass vẽ đúng dòng tại thời điểm đó
+            cmd = [
+                'ffmpeg', '-y',
+                '-loop', '1',
+                '-i', str(background),
+                '-vf', f"setpts=PTS+{timestamp:.3f}/TB,{self.subtitle_processor.ass_filter(ass_path)}",
+                '-frames:v', '1',
+                str(tmp_output)
+            ]
+            logging.info(f"Rendering subtitle preview: {' '.join(cmd)}")
+            result = run_ffmpeg(cmd, "preview", check=False, timeout=self.FRAME_TIMEOUT,
+                                env=self.subtitle_processor.ass_env(ass_path))
+            if not result.ok or not tmp_output.exists():
+                logging.error(f"Subtitle preview render failed: {result.stderr}")
+                raise RuntimeError(f"Subtitle preview render failed: {result.stderr[-500:] if result.stderr else ''}")
+
+            tmp_output.replace(output_path)
+
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        self.evict(keep=output_path)
+        return output_path
+
+    def evict(self, keep: Optional[Path] = None):
+        """
+        Xóa các ảnh preview dùng lâu nhất cho tới khi cache nhỏ hơn giới hạn
+        Args:
+            keep: Ảnh vừa render (không xóa)
+        """
+        with self._evict_lock:
+            entries = []
+            total_size = 0
+            for path in self.cache_dir.glob("*.png"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+            if total_size <= self.max_size_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size_bytes:
+                    break
+                if keep is not None and path == keep:
+                    continue
+                try:
+                    path.unlink()
+                    total_size -= size
+                    logging.debug(f"Evicted subtitle preview: {path}")
+                except OSError as e:
+                    logging.warning(f"Could not evict subtitle preview {path}: {e}")
@@ -1,10 +1,15 @@
 import os
-import pysubs2
+import json
+import uuid
+import hashlib
+import tempfile
 import logging
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from ..utils.font_manager import FontManager
 import ffmpeg
+from .encoding_profiles import EncodingProfiles, encoding_profiles
+from .ass_writer import convert_srt_stream, iter_ass_cues, iter_srt_cues
 
 class ColorConverter:
     """Xử lý chuyển đổi màu giữa các định dạng"""
@@ -74,15 +79,101 @@ class ColorConverter:
             return DEFAULT_COLORS['primary']
 
 class SubtitleProcessor:
-    def __init__(self):
-        """Initialize SubtitleProcessor"""
+    # Tăng khi đổi cách convert để bỏ cache ASS cũ
+    ASS_CACHE_VERSION = 2
+
+    def __init__(self, ass_cache_dir: Optional[Path] = None):
+        """
+        Initialize SubtitleProcessor
+        
+        Args:
+            ass_cache_dir (Path, optional): Thư mục cache ASS, mặc định là ASS_CACHE_DIR
+                hoặc <thư mục temp hệ thống>/videomaker/ass_cache (riêng cho từng máy)
+        """
         self.color_converter = ColorConverter()
         self.font_manager = FontManager()
+        self.ass_cache_dir = Path(
+            ass_cache_dir
+            or os.getenv("ASS_CACHE_DIR")
+            or Path(tempfile.gettempdir()) / "videomaker" / "ass_cache"
+        )
+        self.ass_cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _build_style_config(self, config: Optional[Dict]) -> Dict:
+        """
+        Chuyển cấu hình preset sang tên field của ASS style (đã chuẩn hóa kiểu số và màu)
+        
+        Args:
+            config (dict, optional): Cấu hình subtitle
+        
+        Returns:
+            dict: {ass_field: value}
+        """
+        if not config:
+            return {}
+            
+        # Map preset field names to ASS style names
+        field_mapping = {
+            'font_name': 'fontname',
+            'font_size': 'fontsize',
+            'primary_color': 'primarycolor',
+            'outline_color': 'outlinecolor',
+            'back_color': 'backcolor',
+            'outline_width': 'outline',
+            'shadow_width': 'shadow',
+            'margin_v': 'marginv',
+            'margin_h': 'marginl',  # Use marginl for horizontal margin
+            'alignment': 'alignment'
+        }
+        
+        # Convert config to ASS style format
+        ass_config = {}
+        for preset_field, ass_field in field_mapping.items():
+            if preset_field in config:
+                value = config[preset_field]
+                # Convert numeric fields
+                if preset_field in ['font_size', 'outline_width', 'shadow_width', 'margin_v', 'margin_h', 'alignment']:
+                    value = int(float(str(value)))
+                # Convert color fields
+                elif preset_field in ['primary_color', 'outline_color', 'back_color']:
+                    value = self.color_converter.normalize_color(value)
+                ass_config[ass_field] = value
+                # Set right margin equal to left margin
+                if preset_field == 'margin_h':
+                    ass_config['marginr'] = value
+        return ass_config
+
+    @staticmethod
+    def _file_hash(path: Path, chunk_size: int = 1024 * 1024) -> str:
+        """Hash nội dung file theo từng chunk (không đọc cả file vào bộ nhớ)"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _ass_cache_path(self, srt_hash: str, style_config: Dict, start_offset: float, is_vertical: bool) -> Path:
+        """Đường dẫn file ASS trong cache theo (hash SRT, hash preset đã chuẩn hóa, offset, hướng video)"""
+        key = json.dumps({
+            "version": self.ASS_CACHE_VERSION,
+            "srt": srt_hash,
+            "style": hashlib.sha256(
+                json.dumps(style_config, sort_keys=True, ensure_ascii=False).encode('utf-8')
+            ).hexdigest(),
+            "offset": round(float(start_offset or 0), 3),
+            "vertical": bool(is_vertical)
+        }, sort_keys=True)
+        return self.ass_cache_dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.ass"
 
     def convert_srt_to_ass(self, input_path: Path, config: Optional[Dict] = None, start_offset: float = 0, is_vertical: bool = False) -> Optional[Path]:
         """
         Chuyển đổi subtitle từ SRT sang ASS
         
+        File ASS được ghi vào cache của máy (ASS_CACHE_DIR hoặc thư mục temp hệ thống),
+        không ghi cạnh file SRT. Cùng nội dung SRT + preset + offset + hướng video
+        thì trả về ngay file đã convert. SRT được đọc và ghi ra ASS theo từng cue
+        nên file subtitle rất dài cũng không phải load hết vào bộ nhớ.
+        
         Args:
             input_path (Path): Đường dẫn file SRT
             config (dict, optional): Cấu hình subtitle
@@ -93,128 +184,37 @@ class SubtitleProcessor:
             Path: Đường dẫn file ASS
         """
         try:
+            input_path = Path(input_path)
             if not input_path.exists():
                 logging.error(f"Input SRT file not found: {input_path}")
                 return None
-                
-            # Đọc subtitle
-            try:
-                subs = pysubs2.load(str(input_path), encoding='utf-8')
-                logging.info(f"Successfully loaded SRT file: {input_path}")
-            except Exception as e:
-                logging.error(f"Error loading subtitle file: {e}")
-                return None
             
-            # Cấu hình mặc định cho video dọc
+            srt_hash = self._file_hash(input_path)
+            style_config = self._build_style_config(config)
+            output_path = self._ass_cache_path(srt_hash, style_config, start_offset, is_vertical)
+            if output_path.exists():
+                logging.info(f"ASS cache hit for {input_path}: {output_path}")
+                return output_path
+            
+            # Cấu hình mặc định theo hướng video, preset ghi đè lên
             if is_vertical:
-                style = pysubs2.SSAStyle(
-                    fontname="Arial",
-                    fontsize=20,
-                    primarycolor="&HFFFFFF&",  # Trắng
-                    outlinecolor="&H000000&",  # Đen
-                    backcolor="&H000000&",     # Đen
-                    bold=0,
-                    italic=0,
-                    alignment=5,  # Middle-center cho video dọc (Legacy ASS)
-                    marginv=20,   # Margin dọc
-                    marginl=20,   # Margin trái
-                    marginr=20    # Margin phải
-                )
+                style = {'alignment': 5, 'marginv': 20, 'marginl': 20, 'marginr': 20}  # Middle-center cho video dọc
             else:
-                # Cấu hình cho video ngang
-                style = pysubs2.SSAStyle(
-                    fontname="Arial",
-                    fontsize=20,
-                    primarycolor="&HFFFFFF&",  # Trắng
-                    outlinecolor="&H000000&",  # Đen
-                    backcolor="&H000000&",     # Đen
-                    bold=0,
-                    italic=0,
-                    alignment=2,  # Bottom-center cho video ngang
-                    marginv=10,   # Margin dọc
-                    marginl=10,   # Margin trái
-                    marginr=10    # Margin phải
-                )
-            
-            # Log cấu hình ban đầu
-            logging.info(f"Initial style alignment: {style.alignment}")
-            
-            # Cập nhật style từ config nếu có
-            if config:
-                logging.info(f"Applying config: {config}")
-                
-                # Map preset field names to ASS style names
-                field_mapping = {
-                    'font_name': 'fontname',
-                    'font_size': 'fontsize',
-                    'primary_color': 'primarycolor',
-                    'outline_color': 'outlinecolor',
-                    'back_color': 'backcolor',
-                    'outline_width': 'outline',
-                    'shadow_width': 'shadow',
-                    'margin_v': 'marginv',
-                    'margin_h': 'marginl',  # Use marginl for horizontal margin
-                    'alignment': 'alignment'
-                }
-                
-                # Convert config to ASS style format
-                ass_config = {}
-                for preset_field, ass_field in field_mapping.items():
-                    if preset_field in config:
-                        value = config[preset_field]
-                        # Convert numeric fields
-                        if preset_field in ['font_size', 'outline_width', 'shadow_width', 'margin_v', 'margin_h', 'alignment']:
-                            value = int(str(value))
-                        # Convert color fields
-                        elif preset_field in ['primary_color', 'outline_color', 'back_color']:
-                            value = self.color_converter.normalize_color(value)
-                        ass_config[ass_field] = value
-                        # Set right margin equal to left margin
-                        if preset_field == 'margin_h':
-                            ass_config['marginr'] = value
-                
-                logging.info(f"Converted config: {ass_config}")
-                
-                # Apply converted config to style
-                for key, value in ass_config.items():
-                    if hasattr(style, key):
-                        old_value = getattr(style, key)
-                        setattr(style, key, value)
-                        logging.info(f"Updated {key}: {old_value} -> {value}")
-            
-            # Thêm style vào subtitle
-            subs.styles["Default"] = style
-            logging.info(f"Final style alignment: {style.alignment}")
+                style = {'alignment': 2, 'marginv': 10, 'marginl': 10, 'marginr': 10}  # Bottom-center cho video ngang
+            style.update(style_config)
+            logging.info(f"ASS style for {input_path}: {style}")
             
-            # Áp dụng style cho tất cả dòng
-            for line in subs:
-                line.style = "Default"
-                
-                # Xóa các tag ASS cũ nếu có
-                text = line.text
-                while '}{' in text:
-                    text = text.replace('}{', '')
-                text = text.strip('{}')
-                
-                # Thêm alignment vào text
-                line.text = "{\\an%d}%s" % (style.alignment, text)
-                
-                logging.debug(f"Processed line: {line.text}")
-                
-                # Thêm offset nếu cần
-                if start_offset > 0:
-                    line.start += start_offset * 1000  # Convert to ms
-                    line.end += start_offset * 1000
-            
-            # Lưu file ASS
-            output_path = input_path.with_suffix('.ass')
-            subs.save(str(output_path))
+            # Đọc SRT và ghi ASS từng cue một (ghi file tạm rồi rename để các worker khác không đọc file dở)
+            offset_ms = int(round(start_offset * 1000)) if start_offset > 0 else 0
+            tmp_path = output_path.with_name(f"{output_path.stem}_{uuid.uuid4().hex[:8]}.tmp")
+            try:
+                with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+                    convert_srt_stream(input_path, f, style, offset_ms)
+                os.replace(tmp_path, output_path)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
             logging.info(f"Successfully saved ASS file: {output_path}")
-            
-            # Kiểm tra file đã được tạo
-            if not output_path.exists():
-                logging.error(f"Failed to create ASS file: {output_path}")
-                return None
                 
             return output_path
             
@@ -222,6 +222,38 @@ class SubtitleProcessor:
             logging.error(f"Error converting SRT to ASS: {str(e)}")
             return None
 
+    @staticmethod
+    def escape_filter_path(path) -> str:
+        """Chuẩn hóa đường dẫn để dùng trong filtergraph của FFmpeg"""
+        return str(path).replace("\\", "/").replace(":", "\\:")
+
+    def get_fontsdir(self, ass_path) -> Optional[Path]:
+        """Thư mục font riêng cho file ASS (chỉ các font nó dùng) để libass không quét toàn bộ font của máy"""
+        return self.font_manager.get_fontsdir(self.font_manager.get_ass_fonts(ass_path))
+
+    def ass_env(self, ass_path) -> Optional[Dict[str, str]]:
+        """
+        Môi trường cho lệnh ffmpeg dùng ass_filter: fontsdir mới chỉ thêm font cho libass,
+        fontconfig vẫn nạp toàn bộ font của máy nếu không đổi FONTCONFIG_FILE
+        Returns:
+            dict hoặc None (dùng fontconfig mặc định)
+        """
+        return self.font_manager.get_fontconfig_env(self.font_manager.get_ass_fonts(ass_path))
+
+    def ass_filter(self, ass_path) -> str:
+        """
+        Filter ass cho filtergraph, kèm fontsdir nếu tìm được font (chạy lệnh với env=ass_env())
+        Args:
+            ass_path: Đường dẫn file ASS
+        Returns:
+            str: vd. ass='sub.ass':fontsdir='cache/fonts/sets/...'
+        """
+        ass_filter = f"ass='{self.escape_filter_path(ass_path)}'"
+        fontsdir = self.get_fontsdir(ass_path)
+        if fontsdir:
+            ass_filter += f":fontsdir='{self.escape_filter_path(fontsdir)}'"
+        return ass_filter
+
     def create_ass_subtitle(self, srt_path: str, video_path: str, output_path: str, 
                           subtitle_settings: dict, start_offset: float = 0, is_vertical: bool = False):
         """Create ASS subtitle from SRT and apply to video
@@ -247,43 +279,83 @@ class SubtitleProcessor:
                 ass_path = srt_path
 
             # Build ffmpeg command
+            stream = ffmpeg.input(video_path)
             if is_vertical:
-                stream = (
-                    ffmpeg
-                    .input(video_path)
-                    .filter('ass', ass_path)
-                    .output(output_path,
-                           acodec='aac',
-                           vcodec='libx264',
-                           preset='medium',
-                           crf=23,
-                           video_bitrate='2500k',
-                           audio_bitrate='192k',
-                           vf='scale=1080:1920')  # Scale for vertical video
-                    .overwrite_output()
-                )
+                stream = stream.filter('scale', 1080, 1920)  # Scale for vertical video
+            fontsdir = self.get_fontsdir(ass_path)
+            if fontsdir:
+                stream = stream.filter('ass', str(ass_path), fontsdir=str(fontsdir))
             else:
-                stream = (
-                    ffmpeg
-                    .input(video_path)
-                    .filter('ass', ass_path)
+                stream = stream.filter('ass', str(ass_path))
+
+            def build_cmd(video_codec):
+                return (
+                    stream
                     .output(output_path,
                            acodec='aac',
-                           vcodec='libx264',
-                           preset='medium',
-                           crf=23,
-                           video_bitrate='2500k',
-                           audio_bitrate='192k')
+                           audio_bitrate='192k',
+                           **EncodingProfiles.as_kwargs(video_codec))
                     .overwrite_output()
+                    .compile()
                 )
 
-            # Run ffmpeg command
-            stream.run(capture_stdout=True, capture_stderr=True)
+            # Run ffmpeg command (GPU nếu có, lỗi thì chạy lại bằng CPU)
+            encoding_profiles.run_encode(build_cmd, "subtitle_burn", env=self.ass_env(ass_path))
 
         except Exception as e:
             logging.error(f"Error creating ASS subtitle: {e}")
             raise
 
+    # Phụ đề được phép dài hơn audio tối đa max(N giây, N% độ dài audio)
+    TIMING_TOLERANCE_SECONDS = 2.0
+    TIMING_TOLERANCE_RATIO = 0.1
+
+    def check_subtitle_timing(self, subtitle_path: Path, duration: float) -> List[str]:
+        """
+        Kiểm tra thời gian phụ đề (SRT/ASS) so với độ dài audio
+        Args:
+            subtitle_path: File phụ đề
+            duration: Độ dài audio (giây), <= 0 thì chỉ kiểm tra file phụ đề
+        Returns:
+            List[str]: Các lỗi tìm thấy, rỗng nếu hợp lệ
+        """
+        subtitle_path = Path(subtitle_path)
+        try:
+            with open(subtitle_path, 'r', encoding='utf-8-sig', errors='replace') as f:
+                if subtitle_path.suffix.lower() == '.ass':
+                    cues = list(iter_ass_cues(f))
+                else:
+                    cues = [(start, end) for start, end, _ in iter_srt_cues(f)]
+        except OSError as e:
+            return [f"cannot read subtitle: {e}"]
+
+        if not cues:
+            return ["subtitle has no cues"]
+
+        problems = []
+        inverted = sum(1 for start, end in cues if end <= start)
+        if inverted:
+            problems.append(f"{inverted} subtitle cues end before they start")
+        if duration > 0:
+            first_start = min(start for start, _ in cues) / 1000.0
+            last_end = max(end for _, end in cues) / 1000.0
+            tolerance = max(self.TIMING_TOLERANCE_SECONDS, duration * self.TIMING_TOLERANCE_RATIO)
+            if first_start >= duration:
+                problems.append(f"subtitles start at {first_start:.1f}s, after audio ends ({duration:.1f}s)")
+            elif last_end > duration + tolerance:
+                problems.append(f"subtitles run to {last_end:.1f}s, audio is only {duration:.1f}s")
+        return problems
+
     def validate_subtitle_timing(self, subtitle_path: Path, duration: float) -> bool:
-        """Always return True as we allow subtitle duration mismatch"""
-        return True
+        """
+        Phụ đề có cue, thời gian hợp lệ và khớp với audio (cho phép lệch nhỏ ở cuối)
+        Args:
+            subtitle_path: File phụ đề
+            duration: Độ dài audio (giây)
+        Returns:
+            bool: True nếu hợp lệ
+        """
+        problems = self.check_subtitle_timing(subtitle_path, duration)
+        for problem in problems:
+            logging.warning(f"{subtitle_path}: {problem}")
+        return not problems
@@ -4,14 +4,52 @@ import logging
 from typing import List, Dict
 import json
 import random
+from .encoding_profiles import encoding_profiles
+from .ffmpeg_runner import run_ffmpeg
+from .error_policy import PERMANENT, classify_ffmpeg_output, is_gpu_error
 
 class VideoCutter:
     def __init__(self, cut_dir: Path):
         self.cut_dir = Path(cut_dir)
         self.cut_dir.mkdir(parents=True, exist_ok=True)
 
+    def _wide_filter(self) -> str:
+        """Filter chuẩn hóa 16:9 theo video_settings (mặc định 1920x1080, 30fps)"""
+        width = encoding_profiles.video_settings.get("width", 1920)
+        height = encoding_profiles.video_settings.get("height", 1080)
+        fps = encoding_profiles.video_settings.get("fps", 30)
+        return (
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={fps}"
+        )
+
+    @staticmethod
+    def _gpu_fallback_useful(result) -> bool:
+        """
+        Lệnh GPU lỗi có nên chạy lại bằng CPU không: không khi bị kill (timeout/treo)
+        hoặc khi lỗi nằm ở đầu vào (file hỏng, thiếu filter) chứ không phải ở NVENC/CUDA
+        """
+        if result.reason is not None:
+            return False
+        return is_gpu_error(result.stderr) or classify_ffmpeg_output(result.stderr) != PERMANENT
+
+    def _ingest_run_kwargs(self, input_path: Path, outputs: int = 1) -> Dict:
+        """
+        Tham số run_ffmpeg cho lệnh ingest: lệnh không có -t nên timeout tính theo
+        độ dài video nguồn (mỗi đầu ra encode thêm 1 lần); không probe được thì chỉ
+        dựa vào watchdog treo (stall_timeout), không cắt ngang theo default_timeout
+        """
+        try:
+            duration = self.get_video_duration(input_path)
+        except Exception:
+            duration = 0.0
+        if duration > 0:
+            return {"expected_duration": duration * max(1, outputs)}
+        logging.warning(f"Unknown duration for {input_path}, ingest relies on the stall watchdog only")
+        return {"timeout": float("inf")}
+
     def standardize_video(self, input_path: Path, output_path: Path, gpu_enabled: bool = True) -> bool:
-        """Chuẩn hóa video về 1920x1080, 30fps"""
+        """Chuẩn hóa video về kích thước/fps trong video_settings (mặc định 1920x1080, 30fps)"""
         try:
             # Kiểm tra file input
             input_path = Path(input_path).resolve()
@@ -27,6 +65,7 @@ class VideoCutter:
             logging.info(f"Standardizing video:")
             logging.info(f"Input: {input_path} (exists: {input_path.exists()})")
             logging.info(f"Output: {output_path}")
+            gpu_enabled = gpu_enabled and encoding_profiles.gpu_available()
             logging.info(f"GPU enabled: {gpu_enabled}")
             
             cmd = ["ffmpeg", "-y"]
@@ -35,33 +74,22 @@ class VideoCutter:
             
             cmd.extend([
                 "-i", str(input_path),
-                "-vf", "scale=1920:1080:force_original_aspect_ratio=decrease,"
-                       "pad=1920:1080:(ow-iw)/2:(oh-ih)/2,fps=30",
-                "-c:v", "h264_nvenc" if gpu_enabled else "libx264",
-                "-preset", "p7" if gpu_enabled else "medium",
-                "-rc:v", "vbr_hq" if gpu_enabled else "vbr",
-                "-cq:v", "18",
-                "-profile:v", "high",
-                str(output_path)
+                "-vf", self._wide_filter()
             ])
+            cmd.extend(encoding_profiles.stage_args("ingest", gpu_enabled))
+            cmd.append(str(output_path))
             
             # Log command
             logging.info(f"FFmpeg command: {' '.join(cmd)}")
             
             try:
                 # Chạy với capture_output để lấy error message
-                result = subprocess.run(
-                    cmd, 
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace'
-                )
+                result = run_ffmpeg(cmd, "ingest", check=False, **self._ingest_run_kwargs(input_path))
                 
                 # Kiểm tra kết quả
-                if result.returncode != 0:
+                if not result.ok:
                     logging.error(f"FFmpeg error: {result.stderr}")
-                    if gpu_enabled:
+                    if gpu_enabled and self._gpu_fallback_useful(result):
                         logging.warning("GPU encoding failed, falling back to CPU")
                         return self.standardize_video(input_path, output_path, False)
                     return False
@@ -88,6 +116,78 @@ class VideoCutter:
             logging.error(f"Error standardizing video: {str(e)}")
             return False
 
+    def standardize_video_dual(self, input_path: Path, output_16_9: Path, output_9_16: Path,
+                               gpu_enabled: bool = True) -> bool:
+        """
+        Chuẩn hóa video raw thành 2 bản trong cùng một lần decode:
+        - 16:9: 1920x1080, 30fps (giống standardize_video)
+        - 9:16: crop giữa khung hình, 1080x1920, 30fps
+
+        Args:
+            input_path: Video raw đầu vào
+            output_16_9: File đầu ra 16:9
+            output_9_16: File đầu ra 9:16
+            gpu_enabled: Dùng NVENC nếu có
+        Returns:
+            bool: True nếu tạo được cả 2 file
+        """
+        try:
+            input_path = Path(input_path).resolve()
+            if not input_path.exists():
+                logging.error(f"Input file not found: {input_path}")
+                return False
+
+            output_16_9 = Path(output_16_9).resolve()
+            output_9_16 = Path(output_9_16).resolve()
+            output_16_9.parent.mkdir(parents=True, exist_ok=True)
+            output_9_16.parent.mkdir(parents=True, exist_ok=True)
+
+            logging.info("Standardizing video (16:9 + 9:16 in one pass):")
+            logging.info(f"Input: {input_path}")
+            logging.info(f"Output 16:9: {output_16_9}")
+            logging.info(f"Output 9:16: {output_9_16}")
+            gpu_enabled = gpu_enabled and encoding_profiles.gpu_available()
+            logging.info(f"GPU enabled: {gpu_enabled}")
+
+            # Decode một lần, split thành 2 nhánh filter
+            fps = encoding_profiles.video_settings.get("fps", 30)
+            filter_complex = (
+                "[0:v]split=2[wide][tall];"
+                f"[wide]{self._wide_filter()}[out169];"
+                "[tall]crop='trunc(min(iw,ih*9/16)/2)*2':'trunc(min(ih,iw*16/9)/2)*2',"
+                f"scale=1080:1920,setsar=1,fps={fps}[out916]"
+            )
+
+            codec_args = encoding_profiles.stage_args("ingest", gpu_enabled)
+
+            cmd = ["ffmpeg", "-y"]
+            if gpu_enabled:
+                cmd.extend(["-hwaccel", "cuda"])
+            cmd.extend(["-i", str(input_path), "-filter_complex", filter_complex])
+            cmd.extend(["-map", "[out169]", "-map", "0:a?"] + codec_args + [str(output_16_9)])
+            cmd.extend(["-map", "[out916]", "-map", "0:a?"] + codec_args + [str(output_9_16)])
+
+            logging.info(f"FFmpeg command: {' '.join(cmd)}")
+
+            result = run_ffmpeg(cmd, "ingest", check=False, **self._ingest_run_kwargs(input_path, outputs=2))
+
+            if not result.ok:
+                logging.error(f"FFmpeg error: {result.stderr}")
+                if gpu_enabled and self._gpu_fallback_useful(result):
+                    logging.warning("GPU encoding failed, falling back to CPU")
+                    return self.standardize_video_dual(input_path, output_16_9, output_9_16, False)
+                return False
+
+            if not output_16_9.exists() or not output_9_16.exists():
+                logging.error("Output files were not created")
+                return False
+
+            return True
+
+        except Exception as e:
+            logging.error(f"Error standardizing video (dual): {str(e)}")
+            return False
+
     def get_video_duration(self, video_path: Path) -> float:
         """Lấy thời lượng của video"""
         cmd = [
@@ -120,6 +220,7 @@ class VideoCutter:
             logging.info(f"Input: {input_path} (exists: {input_path.exists()})")
             logging.info(f"Output: {output_path}")
             logging.info(f"Start time: {start_time}s, Duration: {duration}s")
+            gpu_enabled = gpu_enabled and encoding_profiles.gpu_available()
             logging.info(f"GPU enabled: {gpu_enabled}")
             
             cmd = ["ffmpeg", "-y"]
@@ -129,32 +230,22 @@ class VideoCutter:
             cmd.extend([
                 "-ss", str(start_time),
                 "-t", str(duration),
-                "-i", str(input_path),
-                "-c:v", "h264_nvenc" if gpu_enabled else "libx264",
-                "-preset", "p7" if gpu_enabled else "medium",
-                "-rc:v", "vbr_hq" if gpu_enabled else "vbr",
-                "-cq:v", "18",
-                "-profile:v", "high",
-                str(output_path)
+                "-i", str(input_path)
             ])
+            cmd.extend(encoding_profiles.stage_args("ingest", gpu_enabled))
+            cmd.append(str(output_path))
             
             # Log command
             logging.info(f"FFmpeg command: {' '.join(cmd)}")
             
             try:
                 # Chạy với capture_output để lấy error message
-                result = subprocess.run(
-                    cmd, 
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace'
-                )
+                result = run_ffmpeg(cmd, "ingest", check=False)
                 
                 # Kiểm tra kết quả
-                if result.returncode != 0:
+                if not result.ok:
                     logging.error(f"FFmpeg error: {result.stderr}")
-                    if gpu_enabled:
+                    if gpu_enabled and self._gpu_fallback_useful(result):
                         logging.warning("GPU encoding failed, falling back to CPU")
                         return self.cut_video(input_path, start_time, duration, output_path, False)
                     return False
@@ -182,8 +273,19 @@ class VideoCutter:
             return False
 
     def process_raw_video(self, input_path: Path, min_duration: float = 4.0, 
-                         max_duration: float = 7.0) -> List[Path]:
-        """Xử lý video raw: chuẩn hóa và cắt thành các đoạn nhỏ"""
+                         max_duration: float = 7.0, vertical_cut_dir: Path = None) -> List[Path]:
+        """
+        Xử lý video raw: chuẩn hóa và cắt thành các đoạn nhỏ
+
+        Args:
+            input_path: Video raw đầu vào
+            min_duration: Độ dài tối thiểu của mỗi đoạn (giây)
+            max_duration: Độ dài tối đa của mỗi đoạn (giây)
+            vertical_cut_dir: Nếu có, tạo thêm các đoạn 9:16 (crop giữa) vào thư mục này
+                              từ cùng một lần decode video raw
+        Returns:
+            List[Path]: Danh sách các đoạn đã cắt (16:9 và 9:16 nếu có)
+        """
         try:
             # Kiểm tra file input
             input_path = Path(input_path).resolve()
@@ -198,9 +300,18 @@ class VideoCutter:
             
             # Chuẩn hóa video trước
             std_path = self.cut_dir / f"std_{input_path.name}"
+            std_vertical_path = None
             logging.info(f"Standardizing to: {std_path}")
             
-            if not self.standardize_video(input_path, std_path):
+            if vertical_cut_dir:
+                vertical_cut_dir = Path(vertical_cut_dir)
+                vertical_cut_dir.mkdir(parents=True, exist_ok=True)
+                std_vertical_path = self.cut_dir / f"std916_{input_path.name}"
+                if not self.standardize_video_dual(input_path, std_path, std_vertical_path):
+                    std_path.unlink(missing_ok=True)
+                    std_vertical_path.unlink(missing_ok=True)
+                    raise ValueError("Failed to standardize video")
+            elif not self.standardize_video(input_path, std_path):
                 raise ValueError("Failed to standardize video")
 
             # Lấy thời lượng video
@@ -209,12 +320,18 @@ class VideoCutter:
                 logging.info(f"Video duration: {duration}s")
             except Exception as e:
                 std_path.unlink(missing_ok=True)
+                if std_vertical_path:
+                    std_vertical_path.unlink(missing_ok=True)
                 raise ValueError(f"Failed to get video duration: {str(e)}")
 
             cut_files = []
+            vertical_files = []
             current_time = 0.0
+            segment_no = 0  # Tăng mỗi vòng, đặt tên cả 2 đầu ra (không phụ thuộc đoạn 16:9 có cắt được không)
 
             while current_time < duration:
+                segment_index = segment_no
+                segment_no += 1
                 try:
                     # Random độ dài đoạn cắt
                     segment_duration = random.uniform(min_duration, max_duration)
@@ -222,8 +339,8 @@ class VideoCutter:
                         segment_duration = duration - current_time
 
                     # Tạo file output cho segment
-                    output_path = self.cut_dir / f"cut_{len(cut_files):04d}_{input_path.stem}.mp4"
-                    logging.info(f"Cutting segment {len(cut_files)+1}:")
+                    output_path = self.cut_dir / f"cut_{segment_index:04d}_{input_path.stem}.mp4"
+                    logging.info(f"Cutting segment {segment_index + 1}:")
                     logging.info(f"Start time: {current_time}s")
                     logging.info(f"Duration: {segment_duration}s")
                     logging.info(f"Output: {output_path}")
@@ -235,6 +352,14 @@ class VideoCutter:
                     else:
                         logging.error(f"Failed to cut segment at {current_time}s")
                     
+                    # Cắt segment 9:16 tại cùng mốc thời gian
+                    if std_vertical_path:
+                        vertical_output = vertical_cut_dir / f"cut_{segment_index:04d}_{input_path.stem}.mp4"
+                        if self.cut_video(std_vertical_path, current_time, segment_duration, vertical_output):
+                            vertical_files.append(vertical_output)
+                        else:
+                            logging.error(f"Failed to cut 9:16 segment at {current_time}s")
+                    
                     current_time += segment_duration
 
                 except Exception as e:
@@ -243,13 +368,17 @@ class VideoCutter:
 
             # Xóa file chuẩn hóa tạm
             std_path.unlink(missing_ok=True)
+            if std_vertical_path:
+                std_vertical_path.unlink(missing_ok=True)
             
             # Kiểm tra kết quả
             if not cut_files:
                 raise ValueError("No segments were created")
             
             logging.info(f"Successfully created {len(cut_files)} segments")
-            return cut_files
+            if std_vertical_path:
+                logging.info(f"Successfully created {len(vertical_files)} 9:16 segments in {vertical_cut_dir}")
+            return cut_files + vertical_files
 
         except Exception as e:
             logging.error(f"Error processing raw video: {str(e)}")
@@ -5,10 +5,17 @@ from .video_cutter import VideoCutter
 from modules.file.file_manager import FileManager
 
 class VideoCutterProcessor:
-    def __init__(self, raw_dir: Path, cut_dir: Path):
-        """Khởi tạo processor để cắt video từ raw thành các segment"""
+    def __init__(self, raw_dir: Path, cut_dir: Path, vertical_cut_dir: Optional[Path] = None):
+        """
+        Khởi tạo processor để cắt video từ raw thành các segment
+        Args:
+            raw_dir: Thư mục video raw
+            cut_dir: Thư mục chứa các segment 16:9
+            vertical_cut_dir: Thư mục chứa các segment 9:16 (crop giữa), None để bỏ qua
+        """
         self.raw_dir = Path(raw_dir)
         self.cut_dir = Path(cut_dir)
+        self.vertical_cut_dir = Path(vertical_cut_dir) if vertical_cut_dir else None
         self.file_manager = FileManager(
             base_path=self.raw_dir.parent,
             paths={
@@ -19,12 +26,15 @@ class VideoCutterProcessor:
         )
         self.video_cutter = VideoCutter(self.cut_dir)
 
-    def process_raw_videos(self, min_duration: float = 4.0, max_duration: float = 7.0) -> List[Path]:
+    def process_raw_videos(self, min_duration: float = 4.0, max_duration: float = 7.0,
+                           include_vertical: bool = None) -> List[Path]:
         """
         Xử lý tất cả video trong thư mục raw
         Args:
             min_duration: Độ dài tối thiểu của mỗi segment (giây)
             max_duration: Độ dài tối đa của mỗi segment (giây)
+            include_vertical: Tạo thêm segment 9:16 trong cùng lần decode
+                              (mặc định: True nếu có vertical_cut_dir)
         Returns:
             List[Path]: Danh sách đường dẫn tới các file đã xử lý
         """
@@ -34,14 +44,19 @@ class VideoCutterProcessor:
             logging.warning("No raw videos found in directory")
             return []
 
+        if include_vertical is None:
+            include_vertical = self.vertical_cut_dir is not None
+        vertical_cut_dir = self.vertical_cut_dir if include_vertical else None
+
         processed_files = []
         for video in raw_videos:
             try:
-                # Cut video into segments
-                segments = self.video_cutter.cut_video(
+                # Cut video into segments (16:9 + optional 9:16 from one decode)
+                segments = self.video_cutter.process_raw_video(
                     video,
                     min_duration=min_duration,
-                    max_duration=max_duration
+                    max_duration=max_duration,
+                    vertical_cut_dir=vertical_cut_dir
                 )
                 processed_files.extend(segments)
                 
@@ -15,6 +15,7 @@ setup(
         "pillow>=10.0.0",
         "numpy>=1.24.0",
         "opencv-python>=4.8.0",
+        "psutil>=5.9.0",
         "pathlib>=1.0.1"
     ]
 )